@@ -1,4 +1,7 @@
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import FastAPI, HTTPException, Query, Header
+from fastapi.concurrency import run_in_threadpool
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
 from sqlalchemy import create_engine, text
 from sqlalchemy.exc import SQLAlchemyError, OperationalError
@@ -12,9 +15,38 @@ import pytz
 
 from typing import List
 import re
+import json
+import hashlib
+import soundfile as sf
+
+from .wer_stats import (
+    STALE_RECORDS_QUERY, DELETE_RECORD_STATS_QUERY, INSERT_STATS_QUERY, CURRENT_STATS_JOIN,
+    compute_channel_stats, word_error_rate
+)
+from .audio_stream import CHANNELS, ChannelWav, resolve_audio_path, parse_range, guess_media_type, iter_file, get_snippet
+from .jobs import (
+    JOB_STATES, ENQUEUE_JOB_QUERY, EXPIRE_JOBS_QUERY, CLAIM_JOBS_QUERY, HEARTBEAT_JOBS_QUERY,
+    COMPLETE_JOBS_QUERY, FAIL_JOB_QUERY, JOB_STATUS_QUERY, JOB_QUERY, JOB_METRICS_QUERY,
+    SCHEDULE_QUERY, UPSERT_SCHEDULE_QUERY, DELETE_SCHEDULE_QUERY
+)
+from .language_profiles import (
+    LANGUAGE_MIN_PROBABILITY, PROFILE_FOR_UPDATE_QUERY, UPSERT_PROFILE_QUERY, PROFILES_QUERY, DELETE_PROFILE_QUERY,
+    update_profile
+)
+from .speech_segments import UPSERT_SEGMENTS_QUERY, SEGMENTS_QUERY, LATEST_SEGMENTS_QUERY, speech_regions
+from .derivatives import DERIVATIVE_CHANNELS, DEFAULT_BUCKETS, content_hash, get_peaks, get_preview, get_speech, warm_derivatives
 
 app = FastAPI()
 
+# The audio endpoints are fetched directly by the browser from the frontend apps
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=os.getenv('CORS_ORIGINS', '*').split(','),
+    allow_methods=["GET"],
+    allow_headers=["Range"],
+    expose_headers=["Accept-Ranges", "Content-Range", "Content-Length"],
+)
+
 # Database connection URL
 DATABASE_URL = os.getenv('DATABASE_URL', 'postgresql://user:password@db:5432/yourdatabase')
 POSTGRES_DB = os.getenv('POSTGRES_DB', 'yourdatabase')
@@ -41,6 +73,9 @@ class UserData(BaseModel):
     mplan: Optional[str] = None
     created_by: Optional[str] = "R5"
     stereo: Optional[bool] = False
+    duplicate_of: Optional[str] = None
+    duplicate_offset: Optional[float] = None
+    stt_model: Optional[str] = None
 
 
 class Keyword(BaseModel):
@@ -61,6 +96,65 @@ class NewUser(BaseModel):
 class DeleteUser(BaseModel):
     username: str
 
+class TranscriptAppend(BaseModel):
+    circuit: str
+    start_time: str
+    file_name: str
+    created_by: Optional[str] = "R5"
+    lines: List[str]
+    duration: Optional[str] = None
+
+class RefinedTranscript(BaseModel):
+    circuit: str
+    start_time: str
+    file_name: str
+    created_by: Optional[str] = "R5"
+    stt_transcript: str
+    stt_model: str
+    # md5 of the transcript that was refined, the update is skipped if it changed since
+    previous_hash: str
+
+class LanguageDetection(BaseModel):
+    circuit: str
+    language: str
+    probability: Optional[float] = 1.0
+
+class SpeechSegments(BaseModel):
+    content_hash: str
+    vad_config: str
+    audio_file_path: Optional[str] = None
+    # [channel, start, end] in seconds
+    segments: List[list]
+
+class TranscriptionJob(BaseModel):
+    audio_file_path: str
+    signature: str
+    circuit: Optional[str] = None
+    file_name: Optional[str] = None
+    start_time: Optional[str] = None
+    created_by: Optional[str] = "R5"
+    priority: Optional[int] = 0
+    max_attempts: Optional[int] = 3
+
+class JobClaim(BaseModel):
+    worker: str
+    limit: int = 1
+    lease_seconds: int = 600
+
+class JobUpdate(BaseModel):
+    worker: str
+    ids: List[int]
+    lease_seconds: int = 600
+
+class JobFailure(BaseModel):
+    worker: str
+    error: Optional[str] = None
+
+class CircuitSchedule(BaseModel):
+    circuit: str
+    weight: float = 1.0
+    express: bool = False
+
 def validate_username(username):
     pattern = re.compile(r'^[a-zA-Z_][a-zA-Z0-9_]*$')
     return pattern.match(username) is not None
@@ -134,6 +228,9 @@ async def create_user(new_user: NewUser):
         grant_keywords_query = f"GRANT INSERT, UPDATE, DELETE ON TABLE public.keywords TO {username}"
         session.execute(text(grant_keywords_query))
 
+        grant_wer_stats_query = f"GRANT INSERT, UPDATE, DELETE ON TABLE public.wer_stats TO {username}"
+        session.execute(text(grant_wer_stats_query))
+
         session.commit()
         return {"message": "User created successfully"}
 
@@ -155,7 +252,7 @@ async def delete_user(delete_user: DeleteUser):
         drop_schema_query = f"DROP SCHEMA IF EXISTS {username} CASCADE"
         session.execute(text(drop_schema_query))
 
-        drop_role_privileges_query = f"REVOKE ALL PRIVILEGES ON TABLE public.user_data FROM {username}; REVOKE ALL PRIVILEGES ON TABLE public.keywords FROM {username};"
+        drop_role_privileges_query = f"REVOKE ALL PRIVILEGES ON TABLE public.user_data FROM {username}; REVOKE ALL PRIVILEGES ON TABLE public.keywords FROM {username}; REVOKE ALL PRIVILEGES ON TABLE public.wer_stats FROM {username};"
         session.execute(text(drop_role_privileges_query))
         
         drop_role_query = f"DROP ROLE IF EXISTS {username}"
@@ -171,9 +268,21 @@ async def delete_user(delete_user: DeleteUser):
         session.close()
 
 ###### USER DATA ##########################################################################################
-# Routes
-@app.post("/add_user_data/")
-async def add_user_data(data: UserData):
+USER_DATA_INSERT_QUERY = """
+INSERT INTO user_data (
+    circuit, audio_file_path, file_name, duration, stt_transcript, gt_transcript, 
+    operator_remark, start_time, start_year, start_month, start_day, start_hour, 
+    start_minute, start_second, created, last_modified, src, dst, bookmark, mplan, created_by, stereo,
+    duplicate_of, duplicate_offset, stt_model
+) VALUES (
+    :circuit, :audio_file_path, :file_name, :duration, :stt_transcript, :gt_transcript, 
+    :operator_remark, :start_time, :start_year, :start_month, :start_day, :start_hour, 
+    :start_minute, :start_second, :created, :last_modified, :src, :dst, :bookmark, :mplan, :created_by, :stereo,
+    :duplicate_of, :duplicate_offset, :stt_model
+)
+"""
+
+def user_data_row(data: UserData):
     # Convert start_time to datetime and extract Singapore Standard Time components
     singapore_tz = pytz.timezone('Asia/Singapore')
     start_time = datetime.fromisoformat(data.start_time)
@@ -203,23 +312,17 @@ async def add_user_data(data: UserData):
         'created': created,
         'last_modified': last_modified,
     })
+    return data_dict
 
-    query = """
-    INSERT INTO user_data (
-        circuit, audio_file_path, file_name, duration, stt_transcript, gt_transcript, 
-        operator_remark, start_time, start_year, start_month, start_day, start_hour, 
-        start_minute, start_second, created, last_modified, src, dst, bookmark, mplan, created_by, stereo
-    ) VALUES (
-        :circuit, :audio_file_path, :file_name, :duration, :stt_transcript, :gt_transcript, 
-        :operator_remark, :start_time, :start_year, :start_month, :start_day, :start_hour, 
-        :start_minute, :start_second, :created, :last_modified, :src, :dst, :bookmark, :mplan, :created_by, :stereo
-    )
-    """
+# Routes
+@app.post("/add_user_data/")
+async def add_user_data(data: UserData):
+    data_dict = user_data_row(data)
     
     session = SessionLocal()
     
     try:
-        session.execute(text(query), data_dict)
+        session.execute(text(USER_DATA_INSERT_QUERY), data_dict)
         session.commit()
         return {"message": "User data added successfully"}
     except SQLAlchemyError as e:
@@ -229,6 +332,137 @@ async def add_user_data(data: UserData):
     finally:
         session.close()
 
+@app.post("/add_user_data_batch/")
+async def add_user_data_batch(data: List[UserData]):
+    # Used by the ingestion pipeline; re-ingesting a file refreshes its STT
+    # output but leaves operator edits (gt_transcript, remarks, flags) alone
+    query = USER_DATA_INSERT_QUERY + """
+    ON CONFLICT (circuit, start_time, file_name, created_by) DO UPDATE SET
+        audio_file_path = EXCLUDED.audio_file_path,
+        duration = EXCLUDED.duration,
+        stt_transcript = EXCLUDED.stt_transcript,
+        stereo = EXCLUDED.stereo,
+        duplicate_of = EXCLUDED.duplicate_of,
+        duplicate_offset = EXCLUDED.duplicate_offset,
+        stt_model = EXCLUDED.stt_model,
+        last_modified = EXCLUDED.last_modified
+    """
+    if not data:
+        return {"message": "No user data to add", "count": 0}
+
+    session = SessionLocal()
+
+    try:
+        session.execute(text(query), [user_data_row(item) for item in data])
+        session.commit()
+        return {"message": "User data added successfully", "count": len(data)}
+    except SQLAlchemyError as e:
+        session.rollback()
+        print(e)
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        session.close()
+
+@app.post("/append_user_data_transcript/")
+async def append_user_data_transcript(data: TranscriptAppend):
+    # Used by the live stream ingest, which adds each utterance as soon as it is transcribed
+    query = """
+    UPDATE user_data SET
+        stt_transcript = CASE WHEN coalesce(stt_transcript, '') = '' THEN :lines
+                              ELSE stt_transcript || chr(10) || :lines END,
+        duration = coalesce(:duration, duration),
+        last_modified = :last_modified
+    WHERE circuit = :circuit AND start_time = :start_time AND file_name = :file_name AND created_by = :created_by
+    """
+    singapore_tz = pytz.timezone('Asia/Singapore')
+    params = data.model_dump()
+    params.update({
+        'lines': '\n'.join(data.lines),
+        'start_time': datetime.fromisoformat(data.start_time),
+        'last_modified': datetime.now(singapore_tz).isoformat(timespec='milliseconds'),
+    })
+
+    session = SessionLocal()
+
+    try:
+        updated = session.execute(text(query), params).rowcount
+        session.commit()
+        if not updated:
+            raise HTTPException(status_code=404, detail="Record not found")
+        return {"message": "Transcript appended", "count": len(data.lines)}
+    except SQLAlchemyError as e:
+        session.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        session.close()
+
+@app.get("/user_data_to_refine/")
+async def user_data_to_refine(
+    model: str,
+    circuits: Optional[str] = None,
+    path_prefix: Optional[str] = None,
+    created_by: Optional[str] = None,
+    limit: int = 10
+):
+    # Used by the ingestion pipeline in cascade mode: bookmarked and mplan
+    # records, and those of the given circuits, get the larger model
+    query = """
+    SELECT circuit, start_time, file_name, created_by, audio_file_path, stt_transcript,
+           md5(coalesce(stt_transcript, '')) AS stt_hash
+    FROM user_data
+    WHERE (bookmark = 'True' OR mplan = 'True' OR circuit = ANY(:circuits))
+      AND stt_model IS DISTINCT FROM :model
+      AND coalesce(stt_transcript, '') <> ''
+      AND audio_file_path LIKE :path_prefix || '%'
+      AND (:created_by IS NULL OR created_by = :created_by)
+    ORDER BY start_time DESC
+    LIMIT :limit
+    """
+    params = {
+        "model": model,
+        "circuits": [circuit for circuit in (circuits or '').split(',') if circuit],
+        "path_prefix": path_prefix or '',
+        "created_by": created_by,
+        "limit": limit,
+    }
+
+    session = SessionLocal()
+
+    try:
+        result = session.execute(text(query), params).mappings().fetchall()
+        return {"data": jsonable_encoder([dict(row) for row in result])}
+    except SQLAlchemyError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        session.close()
+
+@app.post("/refine_user_data/")
+async def refine_user_data(data: RefinedTranscript):
+    query = """
+    UPDATE user_data SET stt_transcript = :stt_transcript, stt_model = :stt_model, last_modified = :last_modified
+    WHERE circuit = :circuit AND start_time = :start_time AND file_name = :file_name AND created_by = :created_by
+      AND md5(coalesce(stt_transcript, '')) = :previous_hash
+    """
+    singapore_tz = pytz.timezone('Asia/Singapore')
+    params = data.model_dump()
+    params.update({
+        'start_time': datetime.fromisoformat(data.start_time),
+        'last_modified': datetime.now(singapore_tz).isoformat(timespec='milliseconds'),
+    })
+
+    session = SessionLocal()
+
+    try:
+        updated = session.execute(text(query), params).rowcount
+        session.commit()
+        # 0 when the record was re-ingested or removed while it was being refined
+        return {"message": "Transcript refined" if updated else "Transcript changed meanwhile", "count": updated}
+    except SQLAlchemyError as e:
+        session.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        session.close()
+
 @app.delete("/delete_user_data/")
 async def delete_user_data(circuit, start_time, file_name):
     session = SessionLocal()
@@ -402,11 +636,21 @@ async def update_user_data_partial(
     else:
         return {"message": "No fields to update"}
 
+def etag_response(content, if_none_match):
+    # The ETag is a hash of the body, a client that holds the same body gets a 304 without it
+    response = JSONResponse(jsonable_encoder(content))
+    etag = f'"{hashlib.sha1(response.body).hexdigest()}"'
+    if if_none_match == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    return response
+
 @app.get("/unique_values/")
 async def unique_values(
     column: str,
     user: str = Query(...),
-    password: str = Query(...)
+    password: str = Query(...),
+    if_none_match: Optional[str] = Header(None, alias="if-none-match")
     ):
     def get_unique_values(column: str) -> List[str]:
         session = get_db_session(user, password)
@@ -430,7 +674,7 @@ async def unique_values(
         finally:
             session.close()
 
-    return {"unique_values": get_unique_values(column)}
+    return etag_response({"unique_values": get_unique_values(column)}, if_none_match)
 
 
 ###### KEYWORD DATA ##########################################################################################
@@ -459,18 +703,42 @@ async def add_keyword(
     finally:
         session.close()
 
+# Moved forward by a trigger on every change to the user's keywords, 0 before the first one
+KEYWORD_VERSION_QUERY = "SELECT COALESCE(MAX(version), 0) FROM public.keyword_versions WHERE owner = lower(current_user)"
+
 @app.get("/get_all_keywords/")
 async def get_all_keywords(
     user: str = Query(...),
-    password: str = Query(...)
+    password: str = Query(...),
+    if_none_match: Optional[str] = Header(None, alias="if-none-match")
 ):
     session = get_db_session(user, password)
     query = "SELECT * FROM public.keywords"
     
     try:
+        # Read before the keywords, a change in between only makes the next check fetch them again
+        version = session.execute(text(KEYWORD_VERSION_QUERY)).scalar()
+        etag = f'"{version}"'
+        if if_none_match == etag:
+            return Response(status_code=304, headers={"ETag": etag})
         result = session.execute(text(query))
         rows = result.fetchall()
-        return {"data": [dict(row._mapping) for row in rows]}  # Convert to list of dictionaries
+        data = [dict(row._mapping) for row in rows]  # Convert to list of dictionaries
+        return JSONResponse({"data": jsonable_encoder(data), "version": version}, headers={"ETag": etag})
+    except SQLAlchemyError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        session.close()
+
+@app.get("/keywords/version/")
+async def get_keywords_version(
+    user: str = Query(...),
+    password: str = Query(...)
+):
+    # Lets the apps check a cached keyword list without fetching it
+    session = get_db_session(user, password)
+    try:
+        return {"version": session.execute(text(KEYWORD_VERSION_QUERY)).scalar()}
     except SQLAlchemyError as e:
         raise HTTPException(status_code=400, detail=str(e))
     finally:
@@ -498,4 +766,623 @@ async def delete_keyword(
         session.rollback()
         raise HTTPException(status_code=400, detail=str(e))
     finally:
-        session.close()
\ No newline at end of file
+        session.close()
+
+###### WER STATS ##########################################################################################
+
+def refresh_wer_stats(session):
+    # Only records whose gt/stt content changed since the last refresh are re-aligned
+    stale_records = session.execute(text(STALE_RECORDS_QUERY)).mappings().fetchall()
+    singapore_tz = pytz.timezone('Asia/Singapore')
+    computed_at = datetime.now(singapore_tz).isoformat(timespec='milliseconds')
+
+    for record in stale_records:
+        key = {
+            "circuit": record['circuit'],
+            "start_time": record['start_time'],
+            "file_name": record['file_name'],
+            "created_by": record['created_by'],
+        }
+        session.execute(text(DELETE_RECORD_STATS_QUERY), key)
+        for stats in compute_channel_stats(record['gt_transcript'], record['stt_transcript']):
+            session.execute(text(INSERT_STATS_QUERY), {
+                **key,
+                **stats,
+                "gt_hash": record['gt_hash'],
+                "stt_hash": record['stt_hash'],
+                "confusion_pairs": json.dumps(stats['confusion_pairs']),
+                "computed_at": computed_at,
+            })
+    session.commit()
+    return len(stale_records)
+
+def wer_filter_conditions(circuit, start_time, end_time):
+    conditions = []
+    params = {}
+    if circuit:
+        conditions.append("u.circuit = :circuit")
+        params["circuit"] = circuit
+    if start_time:
+        params["start_time"] = datetime.fromisoformat(start_time)
+        if end_time:
+            conditions.append("u.start_time BETWEEN :start_time AND :end_time")
+            params["end_time"] = datetime.fromisoformat(end_time)
+        else:
+            conditions.append("u.start_time >= :start_time")
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return where, params
+
+@app.post("/refresh_wer_stats/")
+async def refresh_wer_stats_route(
+    user: str = Query(...),
+    password: str = Query(...)
+):
+    session = get_db_session(user, password)
+    try:
+        refreshed = refresh_wer_stats(session)
+        return {"message": "WER stats refreshed", "refreshed": refreshed}
+    except SQLAlchemyError as e:
+        session.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        session.close()
+
+@app.get("/wer_summary/")
+async def wer_summary(
+    circuit: Optional[str] = None,
+    start_time: Optional[str] = None,
+    end_time: Optional[str] = None,
+    group_by: str = "circuit",
+    user: str = Query(...),
+    password: str = Query(...)
+):
+    # Validate group_by columns against a fixed list, they are formatted into the query
+    allowed_columns = {"circuit": "u.circuit", "file_name": "u.file_name", "prefix": "w.prefix",
+                       "start_year": "u.start_year", "start_month": "u.start_month",
+                       "start_day": "u.start_day", "start_hour": "u.start_hour"}
+    group_columns = [column.strip() for column in group_by.split(',') if column.strip()]
+    if not group_columns or any(column not in allowed_columns for column in group_columns):
+        raise HTTPException(status_code=400, detail="Invalid group_by column")
+
+    session = get_db_session(user, password)
+    where, params = wer_filter_conditions(circuit, start_time, end_time)
+    select_columns = ", ".join(f"{allowed_columns[column]} AS {column}" for column in group_columns)
+    group_clause = ", ".join(allowed_columns[column] for column in group_columns)
+    query = f"""
+    SELECT {select_columns},
+        COUNT(DISTINCT (u.circuit, u.start_time, u.file_name)) AS files,
+        SUM(w.hits) AS hits, SUM(w.substitutions) AS substitutions,
+        SUM(w.insertions) AS insertions, SUM(w.deletions) AS deletions
+    FROM {CURRENT_STATS_JOIN}
+    {where}
+    GROUP BY {group_clause}
+    ORDER BY {group_clause}
+    """
+
+    try:
+        refresh_wer_stats(session)
+        rows = session.execute(text(query), params).mappings().fetchall()
+        data = []
+        for row in rows:
+            row = dict(row)
+            row["wer"] = word_error_rate(row["hits"], row["substitutions"], row["insertions"], row["deletions"])
+            data.append(row)
+        return {"data": data}
+    except SQLAlchemyError as e:
+        session.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        session.close()
+
+@app.get("/wer_confusions/")
+async def wer_confusions(
+    circuit: Optional[str] = None,
+    start_time: Optional[str] = None,
+    end_time: Optional[str] = None,
+    limit: int = 100,
+    user: str = Query(...),
+    password: str = Query(...)
+):
+    session = get_db_session(user, password)
+    where, params = wer_filter_conditions(circuit, start_time, end_time)
+    params["limit"] = limit
+    query = f"""
+    SELECT pair->>'ref' AS ref, pair->>'hyp' AS hyp, SUM((pair->>'count')::INT) AS count
+    FROM {CURRENT_STATS_JOIN}
+    CROSS JOIN LATERAL jsonb_array_elements(w.confusion_pairs) AS pair
+    {where}
+    GROUP BY pair->>'ref', pair->>'hyp'
+    ORDER BY count DESC
+    LIMIT :limit
+    """
+
+    try:
+        refresh_wer_stats(session)
+        rows = session.execute(text(query), params).mappings().fetchall()
+        return {"data": [dict(row) for row in rows]}
+    except SQLAlchemyError as e:
+        session.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        session.close()
+
+###### AUDIO ##########################################################################################
+
+def get_audio_file_path(session, circuit, start_time, file_name):
+    # circuit and start_time may be omitted when only the file name is known,
+    # e.g. from errors_context.csv; the latest matching record is used then
+    conditions = ["file_name = :file_name"]
+    if circuit:
+        conditions.append("circuit = :circuit")
+    if start_time:
+        conditions.append("start_time = :start_time")
+    query = f"""
+    SELECT audio_file_path FROM user_data
+    WHERE {' AND '.join(conditions)}
+    ORDER BY start_time DESC
+    LIMIT 1
+    """
+    record = session.execute(
+        text(query),
+        {"circuit": circuit, "start_time": start_time, "file_name": file_name}
+    ).fetchone()
+
+    if not record or not record[0]:
+        raise HTTPException(status_code=404, detail="Record not found")
+
+    try:
+        return resolve_audio_path(record[0])
+    except PermissionError as e:
+        raise HTTPException(status_code=403, detail=str(e))
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Audio file not found")
+
+def get_record_audio_path(circuit, start_time, file_name, user, password):
+    session = get_db_session(user, password)
+    try:
+        return get_audio_file_path(session, circuit, start_time, file_name)
+    except SQLAlchemyError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        session.close()
+
+def range_response(iter_range, size, media_type, range_header):
+    headers = {"Accept-Ranges": "bytes"}
+    try:
+        byte_range = parse_range(range_header, size)
+    except ValueError:
+        raise HTTPException(status_code=416, detail="Requested range not satisfiable", headers={"Content-Range": f"bytes */{size}"})
+
+    if byte_range is None:
+        start, end = 0, size - 1
+        status_code = 200
+    else:
+        start, end = byte_range
+        status_code = 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+
+    return StreamingResponse(iter_range(start, end), status_code=status_code, media_type=media_type, headers=headers)
+
+@app.get("/audio/")
+async def get_audio(
+    circuit: str,
+    start_time: str,
+    file_name: str,
+    channel: Optional[str] = None,
+    range_header: Optional[str] = Header(None, alias="range"),
+    user: str = Query(...),
+    password: str = Query(...)
+):
+    path = get_record_audio_path(circuit, start_time, file_name, user, password)
+
+    if channel:
+        # Left/right are extracted on the fly, only the frames covered by the range are read
+        if channel not in CHANNELS:
+            raise HTTPException(status_code=400, detail="Invalid channel")
+        try:
+            source = ChannelWav(path, channel)
+        except (ValueError, RuntimeError) as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return range_response(source.iter_range, source.size, "audio/wav", range_header)
+
+    return range_response(lambda start, end: iter_file(path, start, end), os.path.getsize(path), guess_media_type(path), range_header)
+
+@app.get("/audio/snippet/")
+async def get_audio_snippet(
+    file_name: str,
+    start: float,
+    end: float,
+    margin: float = 0.5,
+    channel: str = 'B',
+    circuit: Optional[str] = None,
+    start_time: Optional[str] = None,
+    range_header: Optional[str] = Header(None, alias="range"),
+    user: str = Query(...),
+    password: str = Query(...)
+):
+    if channel not in DERIVATIVE_CHANNELS:
+        raise HTTPException(status_code=400, detail="Invalid channel")
+    path = get_record_audio_path(circuit, start_time, file_name, user, password)
+
+    try:
+        snippet = get_snippet(path, start, end, margin, channel)
+    except (ValueError, RuntimeError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return range_response(lambda start, end: iter([snippet[start:end + 1]]), len(snippet), "audio/wav", range_header)
+
+@app.get("/audio/peaks/")
+async def get_audio_peaks(
+    circuit: str,
+    start_time: str,
+    file_name: str,
+    channel: str = 'B',
+    buckets: int = DEFAULT_BUCKETS,
+    user: str = Query(...),
+    password: str = Query(...),
+    if_none_match: Optional[str] = Header(None, alias="if-none-match")
+):
+    if channel not in DERIVATIVE_CHANNELS:
+        raise HTTPException(status_code=400, detail="Invalid channel")
+    path = get_record_audio_path(circuit, start_time, file_name, user, password)
+
+    try:
+        # Decoding the whole file would hold up every other request on the event loop
+        peaks = await run_in_threadpool(get_peaks, path, channel, buckets)
+    except (ValueError, RuntimeError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return etag_response(peaks, if_none_match)
+
+@app.get("/audio/preview/")
+async def get_audio_preview(
+    circuit: str,
+    start_time: str,
+    file_name: str,
+    channel: str = 'B',
+    range_header: Optional[str] = Header(None, alias="range"),
+    user: str = Query(...),
+    password: str = Query(...)
+):
+    if channel not in DERIVATIVE_CHANNELS:
+        raise HTTPException(status_code=400, detail="Invalid channel")
+    path = get_record_audio_path(circuit, start_time, file_name, user, password)
+
+    try:
+        preview_path = await run_in_threadpool(get_preview, path, channel)
+    except (ValueError, RuntimeError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return range_response(lambda start, end: iter_file(preview_path, start, end), os.path.getsize(preview_path), "audio/ogg", range_header)
+
+def get_record_speech(path, user, password):
+    # Newest VAD output stored for the content of the file, see speech_segments in init.sql
+    session = get_db_session(user, password)
+    try:
+        row = session.execute(text(LATEST_SEGMENTS_QUERY), {"content_hash": content_hash(path)}).mappings().fetchone()
+    except SQLAlchemyError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        session.close()
+    if row is None:
+        raise HTTPException(status_code=404, detail="No speech segments stored for this audio")
+    return row
+
+@app.get("/audio/speech_segments/")
+async def get_audio_speech_segments(
+    circuit: str,
+    start_time: str,
+    file_name: str,
+    channel: str = 'B',
+    user: str = Query(...),
+    password: str = Query(...),
+    if_none_match: Optional[str] = Header(None, alias="if-none-match")
+):
+    if channel not in DERIVATIVE_CHANNELS:
+        raise HTTPException(status_code=400, detail="Invalid channel")
+    path = get_record_audio_path(circuit, start_time, file_name, user, password)
+    # Hashes the whole file the first time it is asked for
+    row = await run_in_threadpool(get_record_speech, path, user, password)
+
+    try:
+        duration = sf.info(path).duration
+    except RuntimeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    regions = speech_regions(row["segments"], channel, duration)
+    return etag_response({
+        "channel": channel,
+        "vad_config": row["vad_config"],
+        "created_at": jsonable_encoder(row["created_at"]),
+        "duration": duration,
+        "speech_seconds": round(sum(end - start for start, end in regions), 2),
+        "segments": row["segments"],
+        "regions": regions,
+    }, if_none_match)
+
+@app.get("/audio/speech/")
+async def get_audio_speech(
+    circuit: str,
+    start_time: str,
+    file_name: str,
+    channel: str = 'B',
+    range_header: Optional[str] = Header(None, alias="range"),
+    user: str = Query(...),
+    password: str = Query(...)
+):
+    # The speech regions of the recording back to back, for reviewing long calls without their silence
+    if channel not in DERIVATIVE_CHANNELS:
+        raise HTTPException(status_code=400, detail="Invalid channel")
+    path = get_record_audio_path(circuit, start_time, file_name, user, password)
+    # Hashes the whole file the first time it is asked for
+    row = await run_in_threadpool(get_record_speech, path, user, password)
+
+    try:
+        regions = speech_regions(row["segments"], channel, sf.info(path).duration)
+        if not regions:
+            raise HTTPException(status_code=404, detail="No speech in this audio")
+        speech_path = await run_in_threadpool(get_speech, path, channel, regions)
+    except (ValueError, RuntimeError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return range_response(lambda start, end: iter_file(speech_path, start, end), os.path.getsize(speech_path), "audio/wav", range_header)
+
+@app.post("/audio/warm_derivatives/")
+async def warm_audio_derivatives(
+    circuit: str,
+    start_time: str,
+    file_name: str,
+    user: str = Query(...),
+    password: str = Query(...)
+):
+    path = get_record_audio_path(circuit, start_time, file_name, user, password)
+
+    try:
+        await run_in_threadpool(warm_derivatives, path)
+        return {"message": "Audio derivatives generated"}
+    except (ValueError, RuntimeError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+###### TRANSCRIPTION JOBS ##########################################################################################
+# Work queue of the ingestion pipeline, see transcription_jobs in init.sql
+
+@app.post("/jobs/enqueue/")
+async def enqueue_jobs(jobs: List[TranscriptionJob]):
+    session = SessionLocal()
+    try:
+        enqueued = 0
+        for job in jobs:
+            params = job.model_dump()
+            params['start_time'] = datetime.fromisoformat(job.start_time) if job.start_time else None
+            enqueued += session.execute(text(ENQUEUE_JOB_QUERY), params).rowcount
+        session.commit()
+        return {"message": "Jobs enqueued", "enqueued": enqueued}
+    except SQLAlchemyError as e:
+        session.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        session.close()
+
+@app.post("/jobs/claim/")
+async def claim_jobs(claim: JobClaim):
+    session = SessionLocal()
+    try:
+        session.execute(text(EXPIRE_JOBS_QUERY))
+        result = session.execute(text(CLAIM_JOBS_QUERY), claim.model_dump()).mappings().fetchall()
+        session.commit()
+        return {"data": jsonable_encoder([dict(row) for row in result])}
+    except SQLAlchemyError as e:
+        session.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        session.close()
+
+@app.post("/jobs/heartbeat/")
+async def heartbeat_jobs(update: JobUpdate):
+    session = SessionLocal()
+    try:
+        extended = session.execute(text(HEARTBEAT_JOBS_QUERY), update.model_dump()).rowcount
+        session.commit()
+        # Fewer than requested means some leases were lost to another worker
+        return {"message": "Leases extended", "extended": extended}
+    except SQLAlchemyError as e:
+        session.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        session.close()
+
+@app.post("/jobs/complete/")
+async def complete_jobs(update: JobUpdate):
+    session = SessionLocal()
+    try:
+        completed = session.execute(text(COMPLETE_JOBS_QUERY), update.model_dump()).rowcount
+        session.commit()
+        return {"message": "Jobs completed", "completed": completed}
+    except SQLAlchemyError as e:
+        session.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        session.close()
+
+@app.post("/jobs/{job_id}/fail/")
+async def fail_job(job_id: int, failure: JobFailure):
+    session = SessionLocal()
+    try:
+        row = session.execute(text(FAIL_JOB_QUERY), {"id": job_id, **failure.model_dump()}).fetchone()
+        session.commit()
+        if row is None:
+            raise HTTPException(status_code=409, detail="Job is not running under this worker")
+        return {"message": "Job failed", "state": row[0]}
+    except SQLAlchemyError as e:
+        session.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        session.close()
+
+@app.get("/jobs/status/")
+async def get_jobs_status(circuit: Optional[str] = None):
+    where = "WHERE circuit = :circuit" if circuit else ""
+    session = SessionLocal()
+    try:
+        result = session.execute(text(JOB_STATUS_QUERY.format(where=where)), {"circuit": circuit}).mappings().fetchall()
+        totals = {state: 0 for state in JOB_STATES}
+        for row in result:
+            totals[row['state']] += row['count']
+        return {"totals": totals, "data": jsonable_encoder([dict(row) for row in result])}
+    except SQLAlchemyError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        session.close()
+
+@app.get("/jobs/metrics/")
+async def get_jobs_metrics(window_minutes: int = 60):
+    session = SessionLocal()
+    try:
+        result = session.execute(text(JOB_METRICS_QUERY), {"window_minutes": window_minutes}).mappings().fetchall()
+        return {"data": jsonable_encoder([dict(row) for row in result])}
+    except SQLAlchemyError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        session.close()
+
+@app.get("/jobs/schedule/")
+async def get_jobs_schedule():
+    session = SessionLocal()
+    try:
+        result = session.execute(text(SCHEDULE_QUERY)).mappings().fetchall()
+        return {"data": jsonable_encoder([dict(row) for row in result])}
+    except SQLAlchemyError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        session.close()
+
+@app.put("/jobs/schedule/")
+async def set_jobs_schedule(schedule: List[CircuitSchedule]):
+    if any(entry.weight <= 0 for entry in schedule):
+        raise HTTPException(status_code=400, detail="Weights must be positive")
+    session = SessionLocal()
+    try:
+        for entry in schedule:
+            session.execute(text(UPSERT_SCHEDULE_QUERY), entry.model_dump())
+        session.commit()
+        return {"message": "Schedule updated"}
+    except SQLAlchemyError as e:
+        session.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        session.close()
+
+@app.delete("/jobs/schedule/{circuit}/")
+async def delete_jobs_schedule(circuit: str):
+    session = SessionLocal()
+    try:
+        deleted = session.execute(text(DELETE_SCHEDULE_QUERY), {"circuit": circuit}).rowcount
+        session.commit()
+        if not deleted:
+            raise HTTPException(status_code=404, detail="Circuit has no schedule entry")
+        return {"message": "Schedule entry deleted"}
+    except SQLAlchemyError as e:
+        session.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        session.close()
+
+@app.get("/jobs/{job_id}/")
+async def get_job(job_id: int):
+    session = SessionLocal()
+    try:
+        row = session.execute(text(JOB_QUERY), {"id": job_id}).mappings().fetchone()
+        if row is None:
+            raise HTTPException(status_code=404, detail="Job not found")
+        return {"data": jsonable_encoder(dict(row))}
+    except SQLAlchemyError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        session.close()
+
+
+###### LANGUAGE PROFILES ##########################################################################################
+# Languages detected per circuit by the ingestion pipeline, see language_profiles in init.sql
+
+@app.post("/language_profiles/detections/")
+async def add_language_detections(detections: List[LanguageDetection]):
+    session = SessionLocal()
+    try:
+        added = 0
+        for detection in detections:
+            if detection.probability is not None and detection.probability < LANGUAGE_MIN_PROBABILITY:
+                continue
+            row = session.execute(text(PROFILE_FOR_UPDATE_QUERY), {"circuit": detection.circuit}).fetchone()
+            window, language, confidence = update_profile(row[0] if row else [], detection.language)
+            session.execute(text(UPSERT_PROFILE_QUERY), {
+                "circuit": detection.circuit,
+                "language": language,
+                "confidence": confidence,
+                "detections": json.dumps(window),
+            })
+            added += 1
+        session.commit()
+        return {"message": "Detections added", "added": added}
+    except SQLAlchemyError as e:
+        session.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        session.close()
+
+@app.get("/language_profiles/")
+async def get_language_profiles():
+    session = SessionLocal()
+    try:
+        result = session.execute(text(PROFILES_QUERY)).mappings().fetchall()
+        return {"data": jsonable_encoder([dict(row) for row in result])}
+    except SQLAlchemyError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        session.close()
+
+@app.delete("/language_profiles/{circuit}/")
+async def delete_language_profile(circuit: str):
+    # The circuit goes back to detecting every file until a new profile is learned
+    session = SessionLocal()
+    try:
+        deleted = session.execute(text(DELETE_PROFILE_QUERY), {"circuit": circuit}).rowcount
+        session.commit()
+        if not deleted:
+            raise HTTPException(status_code=404, detail="Circuit has no language profile")
+        return {"message": "Language profile deleted"}
+    except SQLAlchemyError as e:
+        session.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        session.close()
+
+###### SPEECH SEGMENTS ##########################################################################################
+# VAD output of the ingestion pipeline per audio content and VAD settings, see speech_segments in init.sql
+
+@app.post("/speech_segments/")
+async def add_speech_segments(entries: List[SpeechSegments]):
+    session = SessionLocal()
+    try:
+        for entry in entries:
+            session.execute(text(UPSERT_SEGMENTS_QUERY), {
+                "content_hash": entry.content_hash,
+                "vad_config": entry.vad_config,
+                "audio_file_path": entry.audio_file_path,
+                "segments": json.dumps(entry.segments),
+            })
+        session.commit()
+        return {"message": "Speech segments added", "added": len(entries)}
+    except SQLAlchemyError as e:
+        session.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        session.close()
+
+@app.get("/speech_segments/{content_hash}/")
+async def get_speech_segments(content_hash: str, vad_config: str):
+    session = SessionLocal()
+    try:
+        row = session.execute(text(SEGMENTS_QUERY), {"content_hash": content_hash, "vad_config": vad_config}).fetchone()
+        if row is None:
+            raise HTTPException(status_code=404, detail="No speech segments for this audio and VAD config")
+        return {"segments": row[0]}
+    except SQLAlchemyError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        session.close()
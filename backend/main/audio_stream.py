@@ -0,0 +1,187 @@
+import os
+import math
+import mimetypes
+import struct
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import soundfile as sf
+
+# Only files under these directories are served, audio_file_path comes from user data
+AUDIO_ROOTS = [os.path.realpath(root) for root in os.getenv('AUDIO_ROOTS', '/app/input').split(',') if root]
+CHUNK_SIZE = 64 * 1024
+CHANNELS = {'L': 0, 'R': 1}
+WAV_HEADER_SIZE = 44
+SAMPLE_WIDTH = 2
+SNIPPET_CACHE_BYTES = int(os.getenv('SNIPPET_CACHE_BYTES', str(64 * 1024 ** 2)))
+MAX_SNIPPET_SECONDS = 300
+
+
+def resolve_audio_path(audio_file_path):
+    path = os.path.realpath(audio_file_path)
+    if not any(os.path.commonpath([path, root]) == root for root in AUDIO_ROOTS):
+        raise PermissionError(f"{audio_file_path} is outside the audio directories")
+    if not os.path.isfile(path):
+        raise FileNotFoundError(audio_file_path)
+    return path
+
+
+def parse_range(range_header, size):
+    """Returns the inclusive (start, end) byte range, or None to send the whole file.
+
+    Only the first range of a multi-range request is honoured. Raises ValueError
+    when the range cannot be satisfied.
+    """
+    if not range_header or not range_header.startswith('bytes='):
+        return None
+    first = range_header[len('bytes='):].split(',')[0].strip()
+    start, _, end = first.partition('-')
+    if start:
+        start = int(start)
+        end = min(int(end), size - 1) if end else size - 1
+    elif end:
+        # Suffix range, the last N bytes
+        start = max(size - int(end), 0)
+        end = size - 1
+    else:
+        raise ValueError(range_header)
+    if start > end or start >= size:
+        raise ValueError(range_header)
+    return start, end
+
+
+def guess_media_type(path):
+    return mimetypes.guess_type(path)[0] or 'application/octet-stream'
+
+
+def iter_file(path, start, end):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def wav_header(frames, samplerate, channels=1):
+    data_size = frames * channels * SAMPLE_WIDTH
+    byte_rate = samplerate * channels * SAMPLE_WIDTH
+    return (b'RIFF' + struct.pack('<I', 36 + data_size) + b'WAVE'
+            + b'fmt ' + struct.pack('<IHHIIHH', 16, 1, channels, samplerate, byte_rate, channels * SAMPLE_WIDTH, SAMPLE_WIDTH * 8)
+            + b'data' + struct.pack('<I', data_size))
+
+
+class ChannelWav:
+    """A single channel of a multi-channel file, exposed as a 16-bit PCM WAV.
+
+    The WAV is never materialised: byte ranges are mapped to frame ranges and
+    only those frames are read from the source file.
+    """
+
+    def __init__(self, path, channel):
+        self.path = path
+        self.channel = CHANNELS[channel]
+        info = sf.info(path)
+        if info.channels <= self.channel:
+            raise ValueError(f"{path} has no channel {channel}")
+        self.frames = info.frames
+        self.samplerate = info.samplerate
+        self.header = wav_header(self.frames, self.samplerate)
+        self.size = WAV_HEADER_SIZE + self.frames * SAMPLE_WIDTH
+
+    def iter_range(self, start, end):
+        if start < WAV_HEADER_SIZE:
+            yield self.header[start:min(end + 1, WAV_HEADER_SIZE)]
+            start = WAV_HEADER_SIZE
+        if end < WAV_HEADER_SIZE:
+            return
+
+        first_frame = (start - WAV_HEADER_SIZE) // SAMPLE_WIDTH
+        last_frame = (end - WAV_HEADER_SIZE) // SAMPLE_WIDTH
+        skip = (start - WAV_HEADER_SIZE) % SAMPLE_WIDTH
+        keep = end - start + 1
+        block_frames = CHUNK_SIZE // SAMPLE_WIDTH
+
+        with sf.SoundFile(self.path) as f:
+            f.seek(first_frame)
+            frame = first_frame
+            while frame <= last_frame and keep > 0:
+                count = min(block_frames, last_frame - frame + 1)
+                block = f.read(count, dtype='int16', always_2d=True)
+                if not len(block):
+                    break
+                chunk = np.ascontiguousarray(block[:, self.channel]).astype('<i2').tobytes()[skip:skip + keep]
+                skip = 0
+                keep -= len(chunk)
+                frame += len(block)
+                yield chunk
+
+
+class SnippetCache:
+    """LRU of rendered snippets, bounded by total bytes."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def put(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.size -= len(self.entries.pop(key))
+            self.entries[key] = value
+            self.size += len(value)
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+
+snippet_cache = SnippetCache(SNIPPET_CACHE_BYTES)
+
+
+def read_snippet(path, start, end, channel='B'):
+    """Returns start..end seconds of the file as WAV bytes, reading only those frames.
+
+    B keeps every channel of the source, L/R extract a single channel.
+    """
+    with sf.SoundFile(path) as f:
+        index = CHANNELS.get(channel)
+        if index is not None and f.channels <= index:
+            raise ValueError(f"{path} has no channel {channel}")
+        first_frame = min(max(0, int(start * f.samplerate)), f.frames)
+        last_frame = min(f.frames, int(math.ceil(end * f.samplerate)))
+        f.seek(first_frame)
+        data = f.read(max(0, last_frame - first_frame), dtype='int16', always_2d=True)
+        samplerate = f.samplerate
+
+    if index is not None:
+        data = data[:, index:index + 1]
+    return wav_header(len(data), samplerate, data.shape[1]) + np.ascontiguousarray(data).astype('<i2').tobytes()
+
+
+def get_snippet(path, start, end, margin=0.0, channel='B'):
+    start = max(0.0, start - margin)
+    end = end + margin
+    if end <= start or end - start > MAX_SNIPPET_SECONDS:
+        raise ValueError("Invalid snippet bounds")
+
+    key = (path, os.stat(path).st_mtime_ns, round(start, 3), round(end, 3), channel)
+    snippet = snippet_cache.get(key)
+    if snippet is None:
+        snippet = read_snippet(path, start, end, channel)
+        snippet_cache.put(key, snippet)
+    return snippet
@@ -0,0 +1,228 @@
+import os
+import json
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import soundfile as sf
+
+DERIVATIVE_CACHE_DIR = os.getenv('DERIVATIVE_CACHE_DIR', '/app/cache/derivatives')
+DERIVATIVE_CACHE_BYTES = int(os.getenv('DERIVATIVE_CACHE_BYTES', str(2 * 1024 ** 3)))
+PREVIEW_SAMPLERATE = int(os.getenv('PREVIEW_SAMPLERATE', '8000'))
+# Vorbis compression level, 0 is best quality and 1 the smallest file
+PREVIEW_COMPRESSION = float(os.getenv('PREVIEW_COMPRESSION', '0.8'))
+DEFAULT_BUCKETS = 2000
+MAX_BUCKETS = 20000
+BLOCK_FRAMES = 65536
+DERIVATIVE_CHANNELS = ('B', 'L', 'R')
+# Content hashes remembered, a few hundred bytes each
+HASH_MEMO_ENTRIES = int(os.getenv('HASH_MEMO_ENTRIES', '10000'))
+
+_lock = threading.Lock()
+
+
+class HashMemo:
+    """LRU of content hashes by (path, size, mtime), bounded by entries."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+_hash_memo = HashMemo(HASH_MEMO_ENTRIES)
+
+
+def content_hash(path):
+    # Hashing is memoised on (path, size, mtime) so a file is only read once while it is in use
+    stat = os.stat(path)
+    key = (path, stat.st_size, stat.st_mtime_ns)
+    value = _hash_memo.get(key)
+    if value is None:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        value = digest.hexdigest()
+        _hash_memo.put(key, value)
+    return value
+
+
+def derivative_path(path, name):
+    digest = content_hash(path)
+    return os.path.join(DERIVATIVE_CACHE_DIR, digest[:2], digest, name)
+
+
+def iter_channel_blocks(f, channel):
+    # B is the mixdown of all channels, L/R pick a single channel
+    index = {'L': 0, 'R': 1}.get(channel)
+    if index is not None and f.channels <= index:
+        raise ValueError(f"{f.name} has no channel {channel}")
+    for block in f.blocks(blocksize=BLOCK_FRAMES, dtype='float32', always_2d=True):
+        yield block.mean(axis=1) if index is None else block[:, index]
+
+
+def compute_peaks(path, channel, buckets):
+    with sf.SoundFile(path) as f:
+        frames, samplerate = f.frames, f.samplerate
+        buckets = max(1, min(buckets, frames or 1))
+        edges = np.linspace(0, frames, buckets + 1).astype(np.int64)
+        mins = np.full(buckets, np.inf, dtype=np.float32)
+        maxs = np.full(buckets, -np.inf, dtype=np.float32)
+
+        offset = 0
+        for block in iter_channel_blocks(f, channel):
+            # Bucket of every sample, then one reduceat per run of equal buckets
+            positions = np.arange(offset, offset + len(block))
+            bucket_ids = np.clip(np.searchsorted(edges, positions, side='right') - 1, 0, buckets - 1)
+            starts = np.flatnonzero(np.diff(bucket_ids, prepend=-1))
+            ids = bucket_ids[starts]
+            mins[ids] = np.minimum(mins[ids], np.minimum.reduceat(block, starts))
+            maxs[ids] = np.maximum(maxs[ids], np.maximum.reduceat(block, starts))
+            offset += len(block)
+
+        mins[np.isinf(mins)] = 0
+        maxs[np.isinf(maxs)] = 0
+
+    return {
+        "channel": channel,
+        "samplerate": samplerate,
+        "duration": frames / samplerate if samplerate else 0,
+        "peaks": np.round(np.stack([mins, maxs], axis=1), 4).tolist(),
+    }
+
+
+def write_preview(path, channel, output_path):
+    with sf.SoundFile(path) as f:
+        # Integer decimation with a box filter, enough for a scrubbing preview
+        factor = max(1, f.samplerate // PREVIEW_SAMPLERATE)
+        with sf.SoundFile(output_path, 'w', samplerate=f.samplerate // factor, channels=1,
+                          format='OGG', subtype='VORBIS', compression_level=PREVIEW_COMPRESSION) as out:
+            remainder = np.zeros(0, dtype=np.float32)
+            for block in iter_channel_blocks(f, channel):
+                block = np.concatenate([remainder, block])
+                usable = len(block) - len(block) % factor
+                remainder = block[usable:]
+                if usable:
+                    out.write(block[:usable].reshape(-1, factor).mean(axis=1))
+
+
+def write_speech(path, channel, regions, output_path):
+    # The (start, end) regions back to back, read region by region so long files stay out of memory
+    with sf.SoundFile(path) as f:
+        with sf.SoundFile(output_path, 'w', samplerate=f.samplerate, channels=1, format='WAV', subtype='PCM_16') as out:
+            for start, end in regions:
+                f.seek(min(int(start * f.samplerate), f.frames))
+                remaining = min(int(end * f.samplerate), f.frames) - f.tell()
+                if remaining <= 0:
+                    continue
+                for block in iter_channel_blocks(f, channel):
+                    out.write(block[:remaining])
+                    remaining -= len(block)
+                    if remaining <= 0:
+                        break
+
+
+def _atomic_write(target, write):
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target), suffix=os.path.splitext(target)[1])
+    os.close(fd)
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, target)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    evict_to_budget()
+
+
+def _touch(target):
+    # mtime doubles as last access time for LRU eviction
+    os.utime(target)
+    return target
+
+
+def get_peaks(path, channel='B', buckets=DEFAULT_BUCKETS):
+    buckets = max(1, min(int(buckets), MAX_BUCKETS))
+    target = derivative_path(path, f'peaks_{channel}_{buckets}.json')
+    try:
+        with open(_touch(target)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        # Not rendered yet, or evicted by another request meanwhile
+        pass
+    peaks = compute_peaks(path, channel, buckets)
+
+    def write(tmp_path):
+        with open(tmp_path, 'w') as f:
+            json.dump(peaks, f)
+    _atomic_write(target, write)
+    return peaks
+
+
+def _get_rendered(target, render):
+    # The cached file, rendered again when it is missing or was evicted between the check and the touch
+    try:
+        return _touch(target)
+    except FileNotFoundError:
+        _atomic_write(target, render)
+        return target
+
+
+def get_preview(path, channel='B'):
+    target = derivative_path(path, f'preview_{channel}.ogg')
+    return _get_rendered(target, lambda tmp_path: write_preview(path, channel, tmp_path))
+
+
+def get_speech(path, channel, regions):
+    # Named by the regions, a new VAD run over the file renders a new file
+    digest = hashlib.sha256(json.dumps(regions).encode('utf-8')).hexdigest()[:16]
+    target = derivative_path(path, f'speech_{channel}_{digest}.wav')
+    return _get_rendered(target, lambda tmp_path: write_speech(path, channel, regions, tmp_path))
+
+
+def warm_derivatives(path):
+    channels = DERIVATIVE_CHANNELS if sf.info(path).channels >= 2 else ('B',)
+    for channel in channels:
+        get_peaks(path, channel)
+        get_preview(path, channel)
+
+
+def evict_to_budget(budget=None):
+    budget = DERIVATIVE_CACHE_BYTES if budget is None else budget
+    with _lock:
+        entries = []
+        for root, _, files in os.walk(DERIVATIVE_CACHE_DIR):
+            for name in files:
+                file_path = os.path.join(root, name)
+                try:
+                    stat = os.stat(file_path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, file_path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, file_path in sorted(entries):
+            if total <= budget:
+                break
+            try:
+                os.remove(file_path)
+                total -= size
+            except FileNotFoundError:
+                pass
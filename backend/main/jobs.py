@@ -0,0 +1,135 @@
+JOB_STATES = ['queued', 'running', 'done', 'failed']
+
+# A file version already in the queue, whatever its state, is not queued again
+ENQUEUE_JOB_QUERY = """
+INSERT INTO transcription_jobs (
+    audio_file_path, signature, circuit, file_name, start_time, created_by, priority, max_attempts
+) VALUES (
+    :audio_file_path, :signature, :circuit, :file_name, :start_time, :created_by, :priority, :max_attempts
+)
+ON CONFLICT (audio_file_path, signature) DO NOTHING
+"""
+
+# Jobs whose lease ran out on their last attempt are not claimed again
+EXPIRE_JOBS_QUERY = """
+UPDATE transcription_jobs
+SET state = 'failed', finished_at = now(), lease_owner = NULL, lease_expires = NULL,
+    last_error = coalesce(last_error, 'lease expired')
+WHERE state = 'running' AND lease_expires < now() AND attempts >= max_attempts
+"""
+
+# SKIP LOCKED lets any number of workers claim at once without blocking on,
+# or double-claiming, the rows another worker is taking. Running jobs with an
+# expired lease belong to a worker that died and are claimed again.
+#
+# Circuits are served by weighted fair sharing: the n-th waiting job of a
+# circuit that already has r jobs running is tagged (n + r) / weight and the
+# lowest tags are claimed first, so each circuit holds workers in proportion
+# to its weight however many files it has waiting. Express circuits are
+# claimed ahead of all others. Only the first :limit jobs of each circuit can
+# be claimed, which keeps the ranking cheap when one circuit floods the queue.
+CLAIM_JOBS_QUERY = """
+WITH waiting AS (
+    SELECT id, circuit, enqueued_at,
+           row_number() OVER (PARTITION BY circuit ORDER BY priority DESC, enqueued_at, id) AS position
+    FROM transcription_jobs
+    WHERE state = 'queued' OR (state = 'running' AND lease_expires < now())
+),
+running AS (
+    SELECT circuit, COUNT(*) AS running
+    FROM transcription_jobs
+    WHERE state = 'running' AND lease_expires >= now()
+    GROUP BY circuit
+),
+claimable AS (
+    SELECT j.id
+    FROM transcription_jobs j
+    JOIN waiting w ON w.id = j.id
+    LEFT JOIN running r ON r.circuit IS NOT DISTINCT FROM w.circuit
+    LEFT JOIN circuit_schedule s ON s.circuit = w.circuit
+    WHERE w.position <= :limit
+      -- Rechecked on j itself, so a job claimed by another worker while this one waited for its lock is skipped
+      AND (j.state = 'queued' OR (j.state = 'running' AND j.lease_expires < now()))
+    ORDER BY coalesce(s.express, FALSE) DESC,
+             (w.position + coalesce(r.running, 0)) / coalesce(s.weight, 1.0),
+             w.enqueued_at, j.id
+    LIMIT :limit
+    FOR UPDATE OF j SKIP LOCKED
+)
+UPDATE transcription_jobs j
+SET state = 'running', attempts = j.attempts + 1, lease_owner = :worker,
+    lease_expires = now() + make_interval(secs => :lease_seconds), started_at = now()
+FROM claimable
+WHERE j.id = claimable.id
+RETURNING j.id, j.audio_file_path, j.signature, j.circuit, j.file_name, j.start_time,
+          j.created_by, j.priority, j.attempts
+"""
+
+HEARTBEAT_JOBS_QUERY = """
+UPDATE transcription_jobs
+SET lease_expires = now() + make_interval(secs => :lease_seconds)
+WHERE id = ANY(:ids) AND lease_owner = :worker AND state = 'running'
+"""
+
+COMPLETE_JOBS_QUERY = """
+UPDATE transcription_jobs
+SET state = 'done', finished_at = now(), lease_expires = NULL, last_error = NULL
+WHERE id = ANY(:ids) AND lease_owner = :worker AND state = 'running'
+"""
+
+# A failed attempt goes back to the queue until max_attempts is reached
+FAIL_JOB_QUERY = """
+UPDATE transcription_jobs
+SET state = CASE WHEN attempts >= max_attempts THEN 'failed' ELSE 'queued' END,
+    finished_at = CASE WHEN attempts >= max_attempts THEN now() END,
+    lease_owner = NULL, lease_expires = NULL, last_error = :error
+WHERE id = :id AND lease_owner = :worker AND state = 'running'
+RETURNING state
+"""
+
+JOB_STATUS_QUERY = """
+SELECT circuit, state, COUNT(*) AS count, MIN(enqueued_at) AS oldest_enqueued_at
+FROM transcription_jobs
+{where}
+GROUP BY circuit, state
+ORDER BY circuit, state
+"""
+
+JOB_QUERY = """
+SELECT * FROM transcription_jobs WHERE id = :id
+"""
+
+# Queue depth and waiting times per circuit. Waits are measured from
+# enqueue to claim over the jobs claimed in the last :window_minutes.
+JOB_METRICS_QUERY = """
+SELECT j.circuit,
+       coalesce(s.weight, 1.0) AS weight,
+       coalesce(s.express, FALSE) AS express,
+       COUNT(*) FILTER (WHERE j.state = 'queued') AS queued,
+       COUNT(*) FILTER (WHERE j.state = 'running') AS running,
+       extract(epoch FROM now() - MIN(j.enqueued_at) FILTER (WHERE j.state = 'queued')) AS oldest_wait_seconds,
+       COUNT(*) FILTER (WHERE j.started_at >= now() - make_interval(mins => :window_minutes)) AS claimed,
+       AVG(extract(epoch FROM j.started_at - j.enqueued_at))
+           FILTER (WHERE j.started_at >= now() - make_interval(mins => :window_minutes)) AS mean_wait_seconds,
+       percentile_cont(0.95) WITHIN GROUP (ORDER BY extract(epoch FROM j.started_at - j.enqueued_at))
+           FILTER (WHERE j.started_at >= now() - make_interval(mins => :window_minutes)) AS p95_wait_seconds
+FROM transcription_jobs j
+LEFT JOIN circuit_schedule s ON s.circuit = j.circuit
+WHERE j.state IN ('queued', 'running') OR j.started_at >= now() - make_interval(mins => :window_minutes)
+GROUP BY j.circuit, s.weight, s.express
+ORDER BY express DESC, j.circuit
+"""
+
+SCHEDULE_QUERY = """
+SELECT circuit, weight, express FROM circuit_schedule ORDER BY circuit
+"""
+
+UPSERT_SCHEDULE_QUERY = """
+INSERT INTO circuit_schedule (circuit, weight, express)
+VALUES (:circuit, :weight, :express)
+ON CONFLICT (circuit) DO UPDATE SET weight = EXCLUDED.weight, express = EXCLUDED.express
+"""
+
+DELETE_SCHEDULE_QUERY = """
+DELETE FROM circuit_schedule WHERE circuit = :circuit
+"""
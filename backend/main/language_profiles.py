@@ -0,0 +1,44 @@
+import os
+from collections import Counter
+
+# Detections kept per circuit, the profile is the most common language among them
+LANGUAGE_WINDOW = int(os.getenv('LANGUAGE_WINDOW', '20'))
+# Fewer detections than this count as missing ones, so a young profile is never confident
+LANGUAGE_MIN_DETECTIONS = int(os.getenv('LANGUAGE_MIN_DETECTIONS', '5'))
+# Detections the recognizer was unsure of do not shape the profile
+LANGUAGE_MIN_PROBABILITY = float(os.getenv('LANGUAGE_MIN_PROBABILITY', '0.5'))
+
+PROFILE_FOR_UPDATE_QUERY = """
+SELECT detections FROM language_profiles WHERE circuit = :circuit FOR UPDATE
+"""
+
+UPSERT_PROFILE_QUERY = """
+INSERT INTO language_profiles (circuit, language, confidence, detections, updated_at)
+VALUES (:circuit, :language, :confidence, CAST(:detections AS JSONB), now())
+ON CONFLICT (circuit) DO UPDATE SET
+    language = EXCLUDED.language,
+    confidence = EXCLUDED.confidence,
+    detections = EXCLUDED.detections,
+    updated_at = EXCLUDED.updated_at
+"""
+
+PROFILES_QUERY = """
+SELECT circuit, language, confidence, jsonb_array_length(detections) AS detections, updated_at
+FROM language_profiles
+ORDER BY circuit
+"""
+
+DELETE_PROFILE_QUERY = """
+DELETE FROM language_profiles WHERE circuit = :circuit
+"""
+
+
+def update_profile(detections, language):
+    """Adds a detection to the window of a circuit.
+
+    Returns the new window, its most common language and the share of the
+    window that language holds, the confidence of the profile.
+    """
+    detections = (detections + [language])[-LANGUAGE_WINDOW:]
+    language, count = Counter(detections).most_common(1)[0]
+    return detections, language, count / max(len(detections), LANGUAGE_MIN_DETECTIONS)
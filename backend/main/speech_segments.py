@@ -0,0 +1,51 @@
+import os
+
+# Silence kept around every speech region when playing back speech only, so words are not clipped
+SPEECH_PADDING = float(os.getenv('SPEECH_PADDING', '0.25'))
+# Regions closer than this are played as one, short pauses are part of the conversation
+SPEECH_MIN_GAP = float(os.getenv('SPEECH_MIN_GAP', '1.0'))
+
+UPSERT_SEGMENTS_QUERY = """
+INSERT INTO speech_segments (content_hash, vad_config, audio_file_path, segments, created_at)
+VALUES (:content_hash, :vad_config, :audio_file_path, CAST(:segments AS JSONB), now())
+ON CONFLICT (content_hash, vad_config) DO UPDATE SET
+    audio_file_path = EXCLUDED.audio_file_path,
+    segments = EXCLUDED.segments,
+    created_at = EXCLUDED.created_at
+"""
+
+SEGMENTS_QUERY = """
+SELECT segments FROM speech_segments
+WHERE content_hash = :content_hash AND vad_config = :vad_config
+"""
+
+# Playback takes the newest VAD run over the audio, whatever its settings
+LATEST_SEGMENTS_QUERY = """
+SELECT vad_config, segments, created_at FROM speech_segments
+WHERE content_hash = :content_hash
+ORDER BY created_at DESC
+LIMIT 1
+"""
+
+
+def speech_regions(segments, channel, duration=None):
+    """Merges the [prefix, start, end] segments of a channel into padded (start, end) regions.
+
+    B takes the speech of every channel. L and R fall back to it when the
+    channel has no segments of its own, e.g. fake stereo files transcribed
+    as B.
+    """
+    spans = [(start, end) for prefix, start, end in segments if prefix == channel]
+    if channel == 'B' or not spans:
+        spans = [(start, end) for _, start, end in segments]
+
+    regions = []
+    for start, end in sorted(spans):
+        start, end = max(start - SPEECH_PADDING, 0.0), end + SPEECH_PADDING
+        if duration is not None:
+            end = min(end, duration)
+        if regions and start - regions[-1][1] < SPEECH_MIN_GAP:
+            regions[-1] = (regions[-1][0], max(regions[-1][1], end))
+        else:
+            regions.append((start, end))
+    return [(round(start, 2), round(end, 2)) for start, end in regions if end > start]
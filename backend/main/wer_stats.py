@@ -0,0 +1,114 @@
+import jiwer
+
+PUNCTUATION = ",.!?，。！？"
+PREFIXES = ['L', 'R', 'B']
+
+# Records whose transcripts have no wer_stats rows computed from the same
+# content. Hashing in SQL keeps unchanged records out of Python entirely.
+STALE_RECORDS_QUERY = """
+SELECT u.circuit, u.start_time, u.file_name, u.created_by,
+       u.gt_transcript, u.stt_transcript,
+       md5(u.gt_transcript) AS gt_hash, md5(u.stt_transcript) AS stt_hash
+FROM user_data u
+WHERE coalesce(btrim(u.gt_transcript), '') <> ''
+AND coalesce(btrim(u.stt_transcript), '') <> ''
+AND NOT EXISTS (
+    SELECT 1 FROM wer_stats w
+    WHERE w.circuit = u.circuit AND w.start_time = u.start_time
+    AND w.file_name = u.file_name AND w.created_by = u.created_by
+    AND w.gt_hash = md5(u.gt_transcript) AND w.stt_hash = md5(u.stt_transcript)
+)
+"""
+
+DELETE_RECORD_STATS_QUERY = """
+DELETE FROM wer_stats
+WHERE circuit = :circuit AND start_time = :start_time
+AND file_name = :file_name AND created_by = :created_by
+"""
+
+INSERT_STATS_QUERY = """
+INSERT INTO wer_stats (
+    circuit, start_time, file_name, created_by, prefix, gt_hash, stt_hash,
+    hits, substitutions, insertions, deletions, confusion_pairs, computed_at
+) VALUES (
+    :circuit, :start_time, :file_name, :created_by, :prefix, :gt_hash, :stt_hash,
+    :hits, :substitutions, :insertions, :deletions, CAST(:confusion_pairs AS JSONB), :computed_at
+)
+"""
+
+# Only stats computed from the current transcripts are joined in
+CURRENT_STATS_JOIN = """
+user_data u JOIN wer_stats w
+ON w.circuit = u.circuit AND w.start_time = u.start_time
+AND w.file_name = u.file_name AND w.created_by = u.created_by
+AND w.gt_hash = md5(u.gt_transcript) AND w.stt_hash = md5(u.stt_transcript)
+"""
+
+def remove_punct(s):
+    for punct in PUNCTUATION:
+        s = s.replace(punct, "")
+    return s
+
+# Same normalisation as app_drift/calculate_wer.py so both report the same WER
+def split_transcript_by_prefix(transcript):
+    transcripts = {'L': [], 'R': [], 'B': []}
+    for line in transcript.strip().split('\n'):
+        tokens = line.strip().split()
+        if not tokens:
+            continue
+        if tokens[0] in transcripts:
+            prefix = tokens[0]
+            content = ' '.join(tokens[1:])
+        else:
+            prefix = 'B'
+            content = ' '.join(tokens)
+
+        content = remove_punct(content.lower())
+        content = ' '.join(content.split()[2:])
+        transcripts[prefix].append(content)
+    return {key: ' '.join(value) for key, value in transcripts.items()}
+
+def get_confusion_pairs(wer_output):
+    ref = wer_output.references[0]
+    hyp = wer_output.hypotheses[0]
+    counts = {}
+    for chunk in wer_output.alignments[0]:
+        if chunk.type == "substitute":
+            for i, j in zip(range(chunk.ref_start_idx, chunk.ref_end_idx),
+                            range(chunk.hyp_start_idx, chunk.hyp_end_idx)):
+                counts[(ref[i], hyp[j])] = counts.get((ref[i], hyp[j]), 0) + 1
+        elif chunk.type == "delete":
+            for i in range(chunk.ref_start_idx, chunk.ref_end_idx):
+                counts[(ref[i], 'NIL')] = counts.get((ref[i], 'NIL'), 0) + 1
+        elif chunk.type == "insert":
+            for j in range(chunk.hyp_start_idx, chunk.hyp_end_idx):
+                counts[('NIL', hyp[j])] = counts.get(('NIL', hyp[j]), 0) + 1
+    return [{"ref": src, "hyp": dst, "count": count} for (src, dst), count in counts.items()]
+
+def compute_channel_stats(gt_transcript, stt_transcript):
+    ref_segments = split_transcript_by_prefix(gt_transcript)
+    hyp_segments = split_transcript_by_prefix(stt_transcript)
+
+    results = []
+    for prefix in PREFIXES:
+        ref = ref_segments.get(prefix, '')
+        hyp = hyp_segments.get(prefix, '')
+        if not ref.strip() or not hyp.strip():
+            continue
+
+        wer_output = jiwer.process_words(ref, hyp)
+        results.append({
+            "prefix": prefix,
+            "hits": wer_output.hits,
+            "substitutions": wer_output.substitutions,
+            "insertions": wer_output.insertions,
+            "deletions": wer_output.deletions,
+            "confusion_pairs": get_confusion_pairs(wer_output),
+        })
+    return results
+
+def word_error_rate(hits, substitutions, insertions, deletions):
+    ref_words = hits + substitutions + deletions
+    if not ref_words:
+        return None
+    return (substitutions + insertions + deletions) / ref_words
@@ -0,0 +1,111 @@
+import time
+import logging
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+
+class BackendClient:
+    def __init__(self, base_url, timeout=30):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def post(self, path, payload):
+        response = self.session.post(f"{self.base_url}{path}", json=payload, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def add_user_data_batch(self, records):
+        return self.post("/add_user_data_batch/", records)
+
+    def append_transcript(self, key, lines, duration=None):
+        # key holds the circuit, start_time, file_name and created_by of the record
+        return self.post("/append_user_data_transcript/", {**key, 'lines': lines, 'duration': duration})
+
+    def records_to_refine(self, model, circuits, path_prefix, created_by, limit):
+        params = {'model': model, 'circuits': ','.join(circuits), 'path_prefix': path_prefix,
+                  'created_by': created_by, 'limit': limit}
+        response = self.session.get(f"{self.base_url}/user_data_to_refine/", params=params, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()['data']
+
+    def refine_record(self, record, stt_transcript, stt_model):
+        key = {field: record[field] for field in ('circuit', 'start_time', 'file_name', 'created_by')}
+        return self.post("/refine_user_data/", {**key, 'stt_transcript': stt_transcript, 'stt_model': stt_model,
+                                                'previous_hash': record['stt_hash']})['count']
+
+    def language_profiles(self):
+        response = self.session.get(f"{self.base_url}/language_profiles/", timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()['data']
+
+    def add_language_detections(self, detections):
+        return self.post("/language_profiles/detections/", detections)['added']
+
+    def speech_segments(self, content_hash, vad_config):
+        # None when the VAD never ran over this audio with these settings
+        response = self.session.get(f"{self.base_url}/speech_segments/{content_hash}/",
+                                    params={'vad_config': vad_config}, timeout=self.timeout)
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return response.json()['segments']
+
+    def add_speech_segments(self, entries):
+        return self.post("/speech_segments/", entries)['added']
+
+    def enqueue_jobs(self, jobs):
+        return self.post("/jobs/enqueue/", jobs)['enqueued']
+
+    def claim_jobs(self, worker, limit, lease_seconds):
+        return self.post("/jobs/claim/", {'worker': worker, 'limit': limit, 'lease_seconds': lease_seconds})['data']
+
+    def heartbeat_jobs(self, worker, ids, lease_seconds):
+        return self.post("/jobs/heartbeat/", {'worker': worker, 'ids': ids, 'lease_seconds': lease_seconds})['extended']
+
+    def complete_jobs(self, worker, ids):
+        return self.post("/jobs/complete/", {'worker': worker, 'ids': ids})['completed']
+
+    def fail_job(self, job_id, worker, error):
+        return self.post(f"/jobs/{job_id}/fail/", {'worker': worker, 'error': error})['state']
+
+
+class ResultWriter:
+    """Buffers finished records and writes them to the API in batches.
+
+    A batch is sent once batch_size records are waiting or flush_interval
+    seconds have passed since the last write. Failed batches stay buffered and
+    are retried on the next flush.
+    """
+
+    def __init__(self, client, batch_size=20, flush_interval=10.0):
+        self.client = client
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.buffer = []
+        self.last_flush = time.monotonic()
+
+    def add(self, record):
+        self.buffer.append(record)
+
+    def maybe_flush(self):
+        due = time.monotonic() - self.last_flush >= self.flush_interval
+        if len(self.buffer) >= self.batch_size or (self.buffer and due):
+            return self.flush()
+        return []
+
+    def flush(self):
+        flushed = []
+        while self.buffer:
+            batch = self.buffer[:self.batch_size]
+            try:
+                self.client.add_user_data_batch(batch)
+            except requests.RequestException:
+                logger.exception("Writing %d records failed, will retry", len(batch))
+                break
+            del self.buffer[:len(batch)]
+            flushed.extend(batch)
+        self.last_flush = time.monotonic()
+        return flushed
@@ -0,0 +1,192 @@
+import math
+from multiprocessing import shared_memory
+
+import numpy as np
+import soundfile as sf
+from scipy.signal import resample_poly
+
+from config import SAMPLE_RATE
+
+# Source frames decoded at a time, so decoding a file needs memory for a few seconds of it only
+DECODE_BLOCK_FRAMES = 1 << 18
+# Source frames read past both ends of a block, far more than the resampling filter reaches
+RESAMPLE_CONTEXT_FRAMES = 1 << 12
+
+
+def resample_factors(samplerate, target=SAMPLE_RATE):
+    divisor = math.gcd(samplerate, target)
+    return target // divisor, samplerate // divisor
+
+
+def resampled_frames(frames, samplerate, target=SAMPLE_RATE):
+    # Length resample_poly gives, ceil(frames * up / down)
+    up, down = resample_factors(samplerate, target)
+    return -(-frames * up // down)
+
+
+def resample(samples, samplerate, target=SAMPLE_RATE):
+    if samplerate == target:
+        return samples.astype(np.float32, copy=False)
+    up, down = resample_factors(samplerate, target)
+    return resample_poly(samples, up, down, axis=0).astype(np.float32)
+
+
+def iter_audio_blocks(path, block_frames=DECODE_BLOCK_FRAMES):
+    """Decodes a file block by block, yielding (frames, channels) float32 blocks at SAMPLE_RATE.
+
+    Every block is resampled along with RESAMPLE_CONTEXT_FRAMES of its
+    neighbours on both sides, which are cut off again, so the blocks join up
+    to the same signal as resampling the whole file at once.
+    """
+    with sf.SoundFile(path) as f:
+        up, down = resample_factors(f.samplerate)
+        if up == down:
+            yield from f.blocks(blocksize=block_frames, dtype='float32', always_2d=True)
+            return
+        # Blocks and context start on multiples of down, so they map to whole output frames
+        block_frames = max(block_frames - block_frames % down, down)
+        context = max(RESAMPLE_CONTEXT_FRAMES - RESAMPLE_CONTEXT_FRAMES % down, down)
+        for start in range(0, f.frames, block_frames):
+            end = min(start + block_frames, f.frames)
+            first = max(start - context, 0)
+            f.seek(first)
+            data = f.read(min(end + context, f.frames) - first, dtype='float32', always_2d=True)
+            offset = (start - first) * up // down
+            count = resampled_frames(end, f.samplerate) - start * up // down
+            yield resample_poly(data, up, down, axis=0)[offset:offset + count].astype(np.float32)
+
+
+def decoded_bytes(path):
+    # Size of the file decoded to float32 at SAMPLE_RATE
+    info = sf.info(path)
+    return resampled_frames(info.frames, info.samplerate) * info.channels * 4
+
+
+def load_audio(path):
+    """Returns (channels, duration) with every channel resampled to SAMPLE_RATE.
+
+    channels is a 2D float32 array shaped (frames, channels). The file is
+    decoded block by block straight into it.
+    """
+    info = sf.info(path)
+    channels = np.empty((resampled_frames(info.frames, info.samplerate), info.channels), dtype=np.float32)
+    position = 0
+    for block in iter_audio_blocks(path):
+        # Never past the length the header promised
+        block = block[:len(channels) - position]
+        channels[position:position + len(block)] = block
+        position += len(block)
+    duration = info.frames / info.samplerate if info.samplerate else 0
+    return channels[:position], duration
+
+
+def load_audio_range(path, start, end):
+    """Like load_audio, but only decodes the frames between start and end seconds."""
+    with sf.SoundFile(path) as f:
+        f.seek(min(int(start * f.samplerate), f.frames))
+        data = f.read(max(int(end * f.samplerate) - f.tell(), 0), dtype='float32', always_2d=True)
+        return resample(data, f.samplerate)
+
+
+class SharedAudio:
+    """A decoded recording in a named shared memory block, for handing audio to other processes.
+
+    The channels are stored one after the other at SAMPLE_RATE, so every
+    channel is a contiguous view into the block. A process creates it from
+    the file's header with create, any process can attach to its handle and
+    decode into it or read from it without a copy, and the creator unlinks
+    it once the file is done. close only unmaps it in the calling process.
+    """
+
+    def __init__(self, shm, channel_count, frames, duration):
+        self.shm = shm
+        self.channel_count = channel_count
+        self.frames = frames
+        self.duration = duration
+        self.planar = np.ndarray((channel_count, frames), dtype=np.float32, buffer=shm.buf)
+
+    @classmethod
+    def create(cls, path):
+        info = sf.info(path)
+        frames = resampled_frames(info.frames, info.samplerate)
+        shm = shared_memory.SharedMemory(create=True, size=max(frames * info.channels * 4, 1))
+        return cls(shm, info.channels, frames, info.frames / info.samplerate if info.samplerate else 0)
+
+    @classmethod
+    def attach(cls, handle):
+        return cls(shared_memory.SharedMemory(name=handle['name']), handle['channels'], handle['frames'],
+                   handle['duration'])
+
+    @property
+    def handle(self):
+        # Small enough to pass to a pool process with every task
+        return {'name': self.shm.name, 'channels': self.channel_count, 'frames': self.frames, 'duration': self.duration}
+
+    @property
+    def nbytes(self):
+        return self.shm.size
+
+    @property
+    def channels(self):
+        # (frames, channels) like load_audio returns, a view of the block
+        return self.planar.T
+
+    def decode(self, path):
+        position = 0
+        for block in iter_audio_blocks(path):
+            block = block[:self.frames - position]
+            self.planar[:, position:position + len(block)] = block.T
+            position += len(block)
+
+    def downmix(self, block_frames=DECODE_BLOCK_FRAMES):
+        # Mixes the channels into the first one in place, the rest of the block goes unused
+        for i in range(0, self.frames, block_frames):
+            self.planar[0, i:i + block_frames] = self.planar[:, i:i + block_frames].mean(axis=0)
+        self.channel_count = 1
+        self.planar = self.planar[:1]
+
+    def close(self):
+        self.planar = None
+        try:
+            self.shm.close()
+        except BufferError:
+            # Views of the block are still referenced, e.g. by a traceback, it is unmapped once they are collected
+            pass
+
+    def unlink(self):
+        self.close()
+        self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def channel_correlation(channels, block=1 << 20):
+    """Pearson correlation between the two channels of a stereo signal.
+
+    Accumulated block by block in float64, so long recordings need no
+    extra full-length copies. Two silent channels count as identical.
+    """
+    sums = np.zeros(5)
+    for i in range(0, len(channels), block):
+        chunk = channels[i:i + block].astype(np.float64)
+        left, right = chunk[:, 0], chunk[:, 1]
+        sums += (left.sum(), right.sum(), left @ left, right @ right, left @ right)
+    n = len(channels)
+    if not n:
+        return 1.0
+    mean_l, mean_r = sums[0] / n, sums[1] / n
+    var_l = sums[2] / n - mean_l ** 2
+    var_r = sums[3] / n - mean_r ** 2
+    covariance = sums[4] / n - mean_l * mean_r
+    if var_l <= 1e-12 or var_r <= 1e-12:
+        return 1.0 if var_l <= 1e-12 and var_r <= 1e-12 else 0.0
+    return covariance / math.sqrt(var_l * var_r)
+
+
+def format_duration(seconds):
+    seconds = int(round(seconds))
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
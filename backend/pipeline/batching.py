@@ -0,0 +1,37 @@
+import time
+from collections import deque
+
+
+class SegmentBatcher:
+    """Collects speech segments from many recordings into recognizer batches.
+
+    A batch is released once batch_size segments are waiting, or once the
+    oldest waiting segment has waited max_latency seconds.
+    """
+
+    def __init__(self, batch_size, max_latency):
+        self.batch_size = batch_size
+        self.max_latency = max_latency
+        self.pending = deque()
+
+    def __len__(self):
+        return len(self.pending)
+
+    def add(self, items):
+        now = time.monotonic()
+        self.pending.extend((now, item) for item in items)
+
+    def timeout(self):
+        # Seconds until the oldest segment is due, None when nothing is waiting
+        if not self.pending:
+            return None
+        return max(self.pending[0][0] + self.max_latency - time.monotonic(), 0)
+
+    def ready(self, force=False):
+        batches = []
+        while len(self.pending) >= self.batch_size:
+            batches.append([self.pending.popleft()[1] for _ in range(self.batch_size)])
+        if self.pending and (force or self.timeout() == 0):
+            batches.append([item for _, item in self.pending])
+            self.pending.clear()
+        return batches
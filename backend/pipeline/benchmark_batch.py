@@ -0,0 +1,57 @@
+import time
+import argparse
+
+from config import RECOGNIZER, SAMPLE_RATE, available_cpus, load_vad_config, load_whisper_config
+from recognizer import load_recognizer
+from transcribe import Transcriber, channel_prefixes, select_channel
+from vad import load_vad
+
+
+def collect_items(transcriber, paths):
+    # (prefix, start, samples) of every speech region, as the worker would batch them
+    items = []
+    duration = 0
+    for path in paths:
+        channels, file_duration = transcriber.load_channels(path)
+        duration += file_duration
+        for prefix in channel_prefixes(channels):
+            samples = select_channel(channels, prefix)
+            for start, end in transcriber.speech_regions(samples):
+                items.append((prefix, start, samples[int(start * SAMPLE_RATE):int(end * SAMPLE_RATE)]))
+    return items, duration
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the real-time factor of recognizer batch sizes on CPU')
+    parser.add_argument('paths', nargs='+', help='recordings to transcribe')
+    parser.add_argument('--max-batch', type=int, default=8, help='largest batch size to try')
+    parser.add_argument('--recognizer', default=RECOGNIZER)
+    parser.add_argument('--threads', type=int, default=available_cpus(), help='recognizer CPU threads')
+    parser.add_argument('--repeat', type=int, default=1, help='runs per batch size, the fastest is reported')
+    args = parser.parse_args()
+
+    recognizer = load_recognizer(args.recognizer, cpu_threads=args.threads)
+    transcriber = Transcriber(recognizer, load_vad(load_vad_config()), load_whisper_config())
+    items, duration = collect_items(transcriber, args.paths)
+    speech = sum(len(samples) for _, _, samples in items) / SAMPLE_RATE
+    print(f"{len(items)} segments, {speech:.1f}s of speech over all channels, {duration:.1f}s of audio")
+
+    # Warm up so model loading and allocation are not counted against batch size 1
+    transcriber.recognize(items[:1])
+
+    print(f"{'batch':>5} {'seconds':>9} {'RTF':>7} {'speedup':>8}")
+    baseline = None
+    for batch_size in range(1, args.max_batch + 1):
+        transcriber.batch_size = batch_size
+        elapsed = float('inf')
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            transcriber.recognize(items)
+            elapsed = min(elapsed, time.perf_counter() - started)
+        baseline = baseline or elapsed
+        # RTF is processing time per second of audio, below 1 is faster than real time
+        print(f"{batch_size:>5} {elapsed:>9.2f} {elapsed / duration:>7.3f} {baseline / elapsed:>7.2f}x")
+
+
+if __name__ == '__main__':
+    main()
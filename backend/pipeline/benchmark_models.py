@@ -0,0 +1,227 @@
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+import itertools
+import multiprocessing
+
+# Models only ever come from disk, faster-whisper and the hub must not reach out
+os.environ.setdefault('HF_HUB_OFFLINE', '1')
+
+import yaml
+import soundfile as sf
+
+from config import MODEL_DIR, load_vad_config, load_whisper_config
+from model_store import installed
+from recognizer import load_recognizer
+from transcribe import Transcriber
+from vad import load_vad
+
+# process_pair and split_transcript_by_prefix come from the drift app
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+CALCULATE_WER_DIR = os.getenv('CALCULATE_WER_DIR', os.path.join(REPO_DIR, 'frontend', 'app_drift'))
+sys.path.insert(0, CALCULATE_WER_DIR)
+
+from calculate_wer import process_pair, split_transcript_by_prefix  # noqa: E402
+
+COUNTS = ('correct', 'substitutions', 'deletions', 'insertions')
+COLUMNS = ('model', 'vad', 'files', 'unscored', 'audio_seconds', 'load_seconds', 'processing_seconds', 'rtf', 'peak_rss_mb',
+           'wer', 'correct', 'substitutions', 'deletions', 'insertions')
+
+
+def gt_pairs(gt_dir):
+    # Recordings with a transcript of the same name next to them, as Extras/Upload GT.py expects
+    pairs = []
+    for root, _, files in os.walk(gt_dir):
+        for name in sorted(files):
+            stem, extension = os.path.splitext(name)
+            if extension.lower() in ('.wav', '.flac', '.ogg', '.mp3') and stem + '.txt' in files:
+                pairs.append((os.path.join(root, name), os.path.join(root, stem + '.txt')))
+    return sorted(pairs)
+
+
+def vad_grid(options):
+    """The VAD settings to try, every combination of the values given per setting.
+
+    Each option is 'setting=value[,value...]', values are parsed as YAML.
+    """
+    settings = {}
+    for option in options:
+        key, _, values = option.partition('=')
+        settings[key.strip()] = [yaml.safe_load(value) for value in values.split(',')]
+    return [dict(zip(settings, values)) for values in itertools.product(*settings.values())]
+
+
+def line_start(tokens):
+    try:
+        return float(tokens[0])
+    except (IndexError, ValueError):
+        return 0.0
+
+
+def mixed_transcript(transcript):
+    # The L and R lines as B lines in time order, as if the recording had been mono
+    lines = []
+    for line in transcript.splitlines():
+        tokens = line.split()
+        if tokens and tokens[0] in ('L', 'R', 'B'):
+            tokens = tokens[1:]
+        if tokens:
+            lines.append(tokens)
+    lines.sort(key=line_start)
+    return '\n'.join('B ' + ' '.join(tokens) for tokens in lines)
+
+
+def score(gt_transcript, stt_transcript, filename):
+    """Word counts of a recording against its GT, None when the GT has no words.
+
+    Channels are scored as in the drift app, except that the GT words of a
+    channel without hypothesis words all count as deletions. A model that
+    outputs nothing on a hard recording must not score better for it.
+    Recordings the pipeline found to be fake stereo come back as B only,
+    they are scored against their L and R GT mixed into B.
+    """
+    reference = split_transcript_by_prefix(gt_transcript)
+    hypothesis = split_transcript_by_prefix(stt_transcript)
+    if (hypothesis['B'].split() and not hypothesis['L'].split() and not hypothesis['R'].split()
+            and (reference['L'].split() or reference['R'].split())):
+        gt_transcript = mixed_transcript(gt_transcript)
+        reference = split_transcript_by_prefix(gt_transcript)
+    if not any(text.split() for text in reference.values()):
+        return None
+    counts = dict.fromkeys(COUNTS, 0)
+    scored = set()
+    for stats in (process_pair(gt_transcript, stt_transcript, filename) or {}).get('stats', []):
+        scored.add(stats['prefix'])
+        for key in counts:
+            counts[key] += stats[key]
+    for prefix, text in reference.items():
+        if prefix not in scored:
+            counts['deletions'] += len(text.split())
+    return counts
+
+
+def reset_peak_rss():
+    # Linux resets the VmHWM high-water mark on this, so every VAD setting gets its own peak
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def peak_rss_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def benchmark_model(recognizer_name, model, path, pairs, grid, threads):
+    """Rows for one model, run in a process of its own so its memory is measured alone."""
+    started = time.perf_counter()
+    recognizer = load_recognizer(recognizer_name, model=path, cpu_threads=threads)
+    load_seconds = time.perf_counter() - started
+    whisper_config = load_whisper_config()
+    rows = []
+    for overrides in grid:
+        transcriber = Transcriber(recognizer, load_vad({**load_vad_config(), **overrides}), whisper_config)
+        reset_peak_rss()
+        totals = dict.fromkeys(COUNTS, 0)
+        unscored = 0
+        audio_seconds = processing_seconds = 0.0
+        for audio_path, gt_path in pairs:
+            with open(gt_path, encoding='utf-8') as f:
+                gt_transcript = f.read()
+            started = time.perf_counter()
+            record = transcriber.transcribe_file(audio_path)
+            processing_seconds += time.perf_counter() - started
+            audio_seconds += sf.info(audio_path).duration
+            counts = score(gt_transcript, record['stt_transcript'], os.path.basename(audio_path))
+            if counts is None:
+                # Empty GT, the recording only counts for the RTF
+                unscored += 1
+                continue
+            for key in totals:
+                totals[key] += counts[key]
+        errors = totals['substitutions'] + totals['deletions'] + totals['insertions']
+        reference = totals['correct'] + totals['substitutions'] + totals['deletions']
+        rows.append({
+            'model': model,
+            'vad': json.dumps(overrides, sort_keys=True),
+            'files': len(pairs),
+            'unscored': unscored,
+            'audio_seconds': round(audio_seconds, 2),
+            'load_seconds': round(load_seconds, 2),
+            'processing_seconds': round(processing_seconds, 2),
+            # Processing time per second of audio, below 1 is faster than real time
+            'rtf': round(processing_seconds / audio_seconds, 4) if audio_seconds else None,
+            'peak_rss_mb': round(peak_rss_mb(), 1),
+            'wer': round(errors / reference, 4) if reference else None,
+            **totals,
+        })
+    return rows
+
+
+def write_rows(rows, output):
+    if output and output.endswith('.json'):
+        with open(output, 'w') as f:
+            json.dump(rows, f, indent=2)
+        return
+    f = open(output, 'w', newline='') if output else sys.stdout
+    try:
+        writer = csv.DictWriter(f, fieldnames=COLUMNS)
+        writer.writeheader()
+        writer.writerows(rows)
+    finally:
+        if output:
+            f.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Real-time factor, peak memory and WER of the local Whisper models '
+                                                 'under a grid of VAD settings, over recordings with GT transcripts')
+    parser.add_argument('gt_dir', help='recordings with a .txt GT transcript of the same name next to each')
+    parser.add_argument('--models', nargs='*', help='names from model_store.MODELS or model directories, '
+                                                     'all the ones found locally by default')
+    parser.add_argument('--vad', action='append', default=[], metavar='SETTING=VALUE[,VALUE...]',
+                        help='VAD setting to vary over conf/vad_config.yaml, repeat for a grid')
+    parser.add_argument('--recognizer', default='whisper', help='whisper, or module:Class taking model=')
+    parser.add_argument('--threads', type=int, default=0, help='recognizer CPU threads, 0 for all')
+    parser.add_argument('--output', help='.csv or .json file, CSV on stdout by default')
+    args = parser.parse_args()
+
+    pairs = gt_pairs(args.gt_dir)
+    if not pairs:
+        parser.error(f'no recordings with a GT transcript in {args.gt_dir}')
+    if args.models:
+        available = installed()
+        models = {name: available.get(name, name) for name in args.models}
+    else:
+        models = installed()
+        if not models:
+            parser.error(f'no models found in {MODEL_DIR}, fetch them with model_store.py fetch')
+    grid = vad_grid(args.vad)
+    print(f"{len(pairs)} recordings, {len(models)} models, {len(grid)} VAD settings", file=sys.stderr)
+
+    rows = []
+    context = multiprocessing.get_context('spawn')
+    for name, path in models.items():
+        with context.Pool(1) as pool:
+            model_rows = pool.apply(benchmark_model, (args.recognizer, name, path, pairs, grid, args.threads))
+        for row in model_rows:
+            print(f"{row['model']:>16} {row['vad']:<40} RTF {row['rtf']} WER {row['wer']} "
+                  f"({row['unscored']} unscored) {row['peak_rss_mb']} MB", file=sys.stderr)
+        rows.extend(model_rows)
+    write_rows(rows, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+import time
+import argparse
+
+import numpy as np
+
+from audio_io import load_audio
+from config import SAMPLE_RATE, load_vad_config
+from transcribe import channel_prefixes, select_channel
+from vad import load_vad
+
+
+def synthetic_recording(minutes, activity, seed=0):
+    """A low-activity circuit: faint line noise with short voiced bursts making up activity of the time."""
+    rng = np.random.default_rng(seed)
+    samples = rng.normal(0, 10 ** (-70 / 20), int(minutes * 60 * SAMPLE_RATE)).astype(np.float32)
+    burst = 2 * SAMPLE_RATE
+    t = np.arange(burst) / SAMPLE_RATE
+    for start in rng.choice(len(samples) - burst, int(len(samples) * activity / burst), replace=False):
+        # Harmonics of a wavering pitch under a syllable-rate envelope, roughly voiced speech
+        pitch = 120 + 20 * np.sin(2 * np.pi * 0.7 * t)
+        phase = 2 * np.pi * np.cumsum(pitch) / SAMPLE_RATE
+        voiced = sum(np.sin(k * phase) / k for k in range(1, 12)) * (0.5 + 0.5 * np.sin(2 * np.pi * 4 * t)) ** 2
+        samples[start:start + burst] += 0.1 * voiced.astype(np.float32)
+    return samples
+
+
+def speech_seconds(regions):
+    return sum(end - start for start, end in regions)
+
+
+def overlap_seconds(regions, others):
+    return sum(max(0.0, min(end, other_end) - max(start, other_start))
+               for start, end in regions for other_start, other_end in others)
+
+
+def run(vad, signals, repeat):
+    elapsed = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        regions = [vad(samples) for samples in signals]
+        elapsed = min(elapsed, time.perf_counter() - started)
+    return elapsed, regions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the VAD with and without the energy gate in front of it')
+    parser.add_argument('paths', nargs='*', help='recordings to run the VAD over, long quiet ones show the gain')
+    parser.add_argument('--synthetic', type=float, default=0, help='minutes of generated low-activity audio to add')
+    parser.add_argument('--activity', type=float, default=0.05, help='share of the generated audio with speech')
+    parser.add_argument('--repeat', type=int, default=1, help='runs per setting, the fastest is reported')
+    args = parser.parse_args()
+
+    signals = []
+    for path in args.paths:
+        channels, _ = load_audio(path)
+        signals.extend(select_channel(channels, prefix) for prefix in channel_prefixes(channels))
+    if args.synthetic:
+        signals.append(synthetic_recording(args.synthetic, args.activity))
+    if not signals:
+        parser.error('give recordings or --synthetic minutes')
+    duration = sum(len(samples) for samples in signals) / SAMPLE_RATE
+
+    config = load_vad_config()
+    print(f"{len(signals)} channels, {duration:.1f}s of audio, VAD model {config['model']}")
+    plain_vad = load_vad({**config, 'energy_gate': False})
+    gated_vad = load_vad({**config, 'energy_gate': True})
+    # Warm up so model loading is not counted against the first run
+    plain_vad(signals[0][:SAMPLE_RATE])
+
+    plain_time, plain_regions = run(plain_vad, signals, args.repeat)
+    gated_time, gated_regions = run(gated_vad, signals, args.repeat)
+    passed = sum(speech_seconds(gated_vad.gate(samples)) for samples in signals)
+
+    print(f"{'vad':>6} {'seconds':>9} {'RTF':>8} {'speech':>8}")
+    for name, elapsed, regions in (('plain', plain_time, plain_regions), ('gated', gated_time, gated_regions)):
+        speech = sum(speech_seconds(channel) for channel in regions)
+        print(f"{name:>6} {elapsed:>9.2f} {elapsed / duration:>8.4f} {speech:>7.1f}s")
+    plain_speech = sum(speech_seconds(channel) for channel in plain_regions)
+    kept = sum(overlap_seconds(plain, gated) for plain, gated in zip(plain_regions, gated_regions))
+    print(f"gate passed {passed / duration:.1%} of the audio, speedup {plain_time / gated_time:.2f}x")
+    if plain_speech:
+        # Share of the speech found without the gate that is still found with it
+        print(f"speech kept by the gate: {kept / plain_speech:.1%}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+import os
+import json
+import hashlib
+
+import yaml
+
+CONF_DIR = os.getenv('CONF_DIR', '/app/conf')
+INPUT_DIR = os.getenv('INPUT_DIR', '/app/input')
+CACHE_DIR = os.getenv('CACHE_DIR', '/app/cache')
+BACKEND_URL = os.getenv('BACKEND_URL', 'http://localhost:8000')
+
+RECOGNIZER = os.getenv('RECOGNIZER', 'whisper')  # whisper, stub or module:Class
+WHISPER_MODEL = os.getenv('WHISPER_MODEL', 'tiny')
+MODEL_DIR = os.getenv('MODEL_DIR', '/app/models')
+USE_GPU = os.getenv('USE_GPU', '0') == '1'
+# RECOGNIZER=cascade transcribes with CASCADE_FAST_MODEL and redoes the segments it is unsure of with WHISPER_MODEL
+CASCADE_FAST_MODEL = os.getenv('CASCADE_FAST_MODEL', 'base')
+CASCADE_MIN_CONFIDENCE = float(os.getenv('CASCADE_MIN_CONFIDENCE', '0.6'))
+
+# Without a configured language, circuits whose language profile is this confident skip detection
+LANGUAGE_PROFILE_CONFIDENCE = float(os.getenv('LANGUAGE_PROFILE_CONFIDENCE', '0.9'))
+
+CREATED_BY = os.getenv('CREATED_BY', 'R5')
+DEFAULT_CIRCUIT = os.getenv('DEFAULT_CIRCUIT', 'default')
+AUDIO_EXTENSIONS = ('.wav', '.flac', '.ogg', '.mp3')
+
+# Recognizers are fed 16kHz mono float32
+SAMPLE_RATE = 16000
+
+VAD_DEFAULTS = {
+    'model': 'silero',
+    'threshold': 0.5,
+    'min_speech_duration_ms': 250,
+    'max_speech_duration_s': 30,
+    'min_silence_duration_ms': 2000,
+    'speech_pad_ms': 400,
+    # Cheap energy and zero-crossing gate that drops dead air before the VAD model runs
+    'energy_gate': True,
+    'gate_threshold_db': -50,
+    'gate_max_zcr': 0.35,
+    'gate_pad_ms': 500,
+}
+
+WHISPER_DEFAULTS = {
+    'use_vad': True,
+    'use_stt': True,
+    'language': None,
+    # Stereo files with channels correlated at least this much are transcribed as mono, null disables
+    'fake_stereo_threshold': 0.98,
+}
+
+# Written by tune_workers.py, the WORKERS, RECOGNIZER_THREADS and PARALLEL_CHANNELS variables take precedence
+WORKER_DEFAULTS = {
+    'workers': None,
+    'recognizer_threads': None,
+    'parallel_channels': None,
+    # CPUs each pool process is pinned to, one list per process
+    'cpu_sets': None,
+    # What the split was measured with
+    'recognizer': None,
+    'model': None,
+}
+
+
+def available_cpus():
+    # Respects container CPU sets, unlike os.cpu_count()
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def load_yaml(name):
+    path = os.path.join(CONF_DIR, name)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return yaml.safe_load(f) or {}
+
+
+def load_vad_config():
+    return {**VAD_DEFAULTS, **load_yaml('vad_config.yaml')}
+
+
+def load_whisper_config():
+    return {**WHISPER_DEFAULTS, **load_yaml('whisper_config.yaml')}
+
+
+def load_worker_config():
+    return {**WORKER_DEFAULTS, **load_yaml('worker_config.yaml')}
+
+
+def config_hash(*configs):
+    payload = json.dumps(configs, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]
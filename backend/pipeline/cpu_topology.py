@@ -0,0 +1,59 @@
+import os
+import logging
+
+from config import available_cpus
+
+logger = logging.getLogger(__name__)
+
+TOPOLOGY_DIR = '/sys/devices/system/cpu'
+
+
+def read_topology(cpu, name):
+    try:
+        with open(os.path.join(TOPOLOGY_DIR, f'cpu{cpu}', 'topology', name)) as f:
+            return int(f.read().strip())
+    except (OSError, ValueError):
+        return 0
+
+
+def usable_cpus():
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(available_cpus()))
+
+
+def cpu_order():
+    """The usable logical CPUs, hyperthread siblings next to each other and sockets one after the other.
+
+    Cutting this list into consecutive sets gives every worker whole
+    physical cores on one socket where the counts allow it.
+    """
+    return sorted(usable_cpus(), key=lambda cpu: (read_topology(cpu, 'physical_package_id'),
+                                                   read_topology(cpu, 'core_id'), cpu))
+
+
+def core_sets(workers, threads):
+    # One set of threads CPUs per worker, or None when there are not enough CPUs to give every worker its own
+    order = cpu_order()
+    if workers * threads > len(order):
+        return None
+    return [order[i * threads:(i + 1) * threads] for i in range(workers)]
+
+
+def pin_process(cpu_sets, counter):
+    """Pins the calling pool process to the next of cpu_sets, counter is a shared multiprocessing.Value.
+
+    CPUs that are no longer usable, e.g. after the container's CPU set
+    changed, are left out. Returns the CPUs pinned to, or None.
+    """
+    if not cpu_sets:
+        return None
+    with counter.get_lock():
+        slot = counter.value
+        counter.value += 1
+    cpus = set(cpu_sets[slot % len(cpu_sets)]) & set(usable_cpus())
+    if not cpus or not hasattr(os, 'sched_setaffinity'):
+        logger.warning("Not pinning process %d, CPUs %s are not usable", os.getpid(), cpu_sets[slot % len(cpu_sets)])
+        return None
+    os.sched_setaffinity(0, cpus)
+    return sorted(cpus)
@@ -0,0 +1,188 @@
+import os
+import sqlite3
+
+import numpy as np
+from scipy.ndimage import maximum_filter
+
+from audio_io import resample
+from config import CACHE_DIR, SAMPLE_RATE
+
+FINGERPRINT_INDEX = os.getenv('FINGERPRINT_INDEX', os.path.join(CACHE_DIR, 'fingerprints.sqlite'))
+# A match needs this many aligned hashes and this share of the shorter recording's hashes
+FINGERPRINT_MIN_MATCHES = int(os.getenv('FINGERPRINT_MIN_MATCHES', '20'))
+FINGERPRINT_MATCH_RATIO = float(os.getenv('FINGERPRINT_MATCH_RATIO', '0.03'))
+# The original's transcript is only reused when this share of the new recording's own hashes match at the
+# offset. Recordings that merely share an intro or a hold message match far fewer and are transcribed
+FINGERPRINT_REUSE_RATIO = float(os.getenv('FINGERPRINT_REUSE_RATIO', '0.5'))
+# Hashes kept in the index, about 40 bytes each with their index. The oldest recordings are dropped beyond it
+FINGERPRINT_MAX_HASHES = int(os.getenv('FINGERPRINT_MAX_HASHES', '20000000'))
+
+FINGERPRINT_RATE = 8000
+N_FFT = 512
+HOP = 256
+FRAME_SECONDS = HOP / FINGERPRINT_RATE
+BLOCK_FRAMES = 4096
+# Peaks are local maxima over +-PEAK_FREQ bins and +-PEAK_TIME frames
+PEAK_FREQ = 10
+PEAK_TIME = 10
+PEAK_DB = 10
+# Each peak is paired with the next FAN_OUT peaks at most MAX_DT frames later
+FAN_OUT = 5
+MAX_DT = 63
+# Frame differences within this many frames of each other count as the same alignment
+DELTA_WINDOW = 2
+
+
+def spectrogram(samples):
+    frames = np.lib.stride_tricks.sliding_window_view(samples, N_FFT)[::HOP]
+    spectrum = np.abs(np.fft.rfft(frames * np.hanning(N_FFT).astype(np.float32), axis=1))
+    return 20 * np.log10(spectrum + 1e-6)
+
+
+def find_peaks(samples):
+    """Returns (frame, bin) of the spectral peaks, computed block by block to bound memory."""
+    total = max((len(samples) - N_FFT) // HOP + 1, 0)
+    peaks = []
+    for first in range(0, total, BLOCK_FRAMES):
+        # Overlap the blocks so the maximum filter sees the neighbours of edge frames
+        start = max(first - PEAK_TIME, 0)
+        stop = min(first + BLOCK_FRAMES + PEAK_TIME, total)
+        spec = spectrogram(samples[start * HOP:(stop - 1) * HOP + N_FFT])
+        local_max = maximum_filter(spec, size=(2 * PEAK_TIME + 1, 2 * PEAK_FREQ + 1), mode='constant', cval=-np.inf)
+        mask = (spec == local_max) & (spec > np.median(spec) + PEAK_DB)
+        frames, bins = np.nonzero(mask)
+        frames += start
+        keep = (frames >= first) & (frames < first + BLOCK_FRAMES)
+        peaks.append(np.stack([frames[keep], bins[keep]], axis=1))
+    return np.concatenate(peaks) if peaks else np.zeros((0, 2), dtype=np.int64)
+
+
+def fingerprint(samples):
+    """Spectral peak pair hashes of a mono SAMPLE_RATE signal.
+
+    Returns an (n, 2) int64 array of (hash, anchor frame). A hash packs the
+    two peak frequencies and their distance in frames, so it survives
+    re-encoding, and the anchor frame gives its position for alignment.
+    """
+    peaks = find_peaks(resample(samples, SAMPLE_RATE, FINGERPRINT_RATE))
+    peaks = peaks[np.lexsort((peaks[:, 1], peaks[:, 0]))].astype(np.int64)
+    hashes = []
+    for k in range(1, FAN_OUT + 1):
+        anchors, targets = peaks[:-k], peaks[k:]
+        dt = targets[:, 0] - anchors[:, 0]
+        valid = (dt > 0) & (dt <= MAX_DT)
+        packed = (anchors[valid, 1] << 20) | (targets[valid, 1] << 10) | dt[valid]
+        hashes.append(np.stack([packed, anchors[valid, 0]], axis=1))
+    return np.concatenate(hashes) if hashes else np.zeros((0, 2), dtype=np.int64)
+
+
+class FingerprintIndex:
+    """Fingerprints of transcribed recordings, in a SQLite file next to the other caches."""
+
+    def __init__(self, path=FINGERPRINT_INDEX):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.connection = sqlite3.connect(path, timeout=30)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS recordings (
+                id INTEGER PRIMARY KEY,
+                audio_file_path TEXT UNIQUE,
+                content_hash TEXT,
+                duration REAL,
+                stereo INTEGER,
+                hash_count INTEGER
+            );
+            CREATE TABLE IF NOT EXISTS hashes (
+                hash INTEGER,
+                recording_id INTEGER,
+                frame INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS hashes_hash ON hashes (hash);
+            CREATE INDEX IF NOT EXISTS hashes_recording ON hashes (recording_id);
+        """)
+
+    def add(self, audio_file_path, content_hash, duration, stereo, prints):
+        with self.connection:
+            self.remove(audio_file_path)
+            cursor = self.connection.execute(
+                "INSERT INTO recordings (audio_file_path, content_hash, duration, stereo, hash_count) VALUES (?, ?, ?, ?, ?)",
+                (audio_file_path, content_hash, duration, int(stereo), len(prints)))
+            recording_id = cursor.lastrowid
+            self.connection.executemany(
+                "INSERT INTO hashes (hash, recording_id, frame) VALUES (?, ?, ?)",
+                ((int(h), recording_id, int(frame)) for h, frame in prints))
+            self.evict_to_budget()
+
+    def remove(self, audio_file_path):
+        row = self.connection.execute(
+            "SELECT id FROM recordings WHERE audio_file_path = ?", (audio_file_path,)).fetchone()
+        if row:
+            self.connection.execute("DELETE FROM hashes WHERE recording_id = ?", row)
+            self.connection.execute("DELETE FROM recordings WHERE id = ?", row)
+
+    def evict_to_budget(self, budget=FINGERPRINT_MAX_HASHES):
+        # Ids only grow and add() inserts a file again under a new one, so the lowest ids were indexed longest ago
+        total = self.connection.execute("SELECT coalesce(sum(hash_count), 0) FROM recordings").fetchone()[0]
+        if total <= budget:
+            return
+        evicted = []
+        for recording_id, hash_count in self.connection.execute("SELECT id, hash_count FROM recordings ORDER BY id"):
+            if total <= budget:
+                break
+            evicted.append((recording_id,))
+            total -= hash_count
+        self.connection.executemany("DELETE FROM hashes WHERE recording_id = ?", evicted)
+        self.connection.executemany("DELETE FROM recordings WHERE id = ?", evicted)
+
+    def lookup(self, prints, exclude=None):
+        """Returns the best matching recording other than the one at path exclude, or None.
+
+        Matching hashes are counted per recording and difference of their
+        frames, a true duplicate has many hashes at one difference, which
+        is also its offset. Neighbouring differences are added up since
+        offsets rarely fall on a frame boundary. The result holds the
+        original's audio_file_path, content_hash, duration and stereo, plus
+        offset, the seconds into the original where this recording starts.
+        """
+        if not len(prints):
+            return None
+        row = self.connection.execute("SELECT id FROM recordings WHERE audio_file_path = ?", (exclude,)).fetchone()
+        excluded = row[0] if row else None
+        with self.connection:
+            self.connection.execute("CREATE TEMP TABLE IF NOT EXISTS query (hash INTEGER, frame INTEGER)")
+            self.connection.execute("DELETE FROM query")
+            self.connection.executemany("INSERT INTO query VALUES (?, ?)", ((int(h), int(frame)) for h, frame in prints))
+            rows = self.connection.execute("""
+                SELECT h.recording_id, h.frame - q.frame AS delta, COUNT(*)
+                FROM query q
+                JOIN hashes h ON h.hash = q.hash
+                WHERE h.recording_id IS NOT ?
+                GROUP BY h.recording_id, delta
+                HAVING COUNT(*) > 1
+            """, (excluded,)).fetchall()
+        counts = {(recording_id, delta): count for recording_id, delta, count in rows}
+
+        best, best_matches = None, 0
+        for recording_id, delta in counts:
+            window = range(delta - DELTA_WINDOW, delta + DELTA_WINDOW + 1)
+            matches = sum(counts.get((recording_id, d), 0) for d in window)
+            if matches > best_matches:
+                best, best_matches = (recording_id, delta), matches
+        if best is None:
+            return None
+
+        recording_id, delta = best
+        row = self.connection.execute(
+            "SELECT audio_file_path, content_hash, duration, stereo, hash_count FROM recordings WHERE id = ?",
+            (recording_id,)).fetchone()
+        audio_file_path, content_hash, duration, stereo, hash_count = row
+        if best_matches < FINGERPRINT_MIN_MATCHES or best_matches < FINGERPRINT_MATCH_RATIO * min(hash_count, len(prints)):
+            return None
+        return {
+            'audio_file_path': audio_file_path,
+            'content_hash': content_hash,
+            'duration': duration,
+            'stereo': bool(stereo),
+            'offset': delta * FRAME_SECONDS,
+            'matches': best_matches,
+        }
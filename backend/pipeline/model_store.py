@@ -0,0 +1,429 @@
+import os
+import sys
+import json
+import time
+import shutil
+import fnmatch
+import hashlib
+import logging
+import argparse
+import tempfile
+
+from config import MODEL_DIR, RECOGNIZER, WHISPER_MODEL, CASCADE_FAST_MODEL
+
+logger = logging.getLogger(__name__)
+
+# Directory laid out like MODEL_DIR that models are copied from before the hub is tried, e.g. a read-only share
+MODEL_MIRROR = os.getenv('MODEL_MIRROR', '')
+# Disk the models fetched into MODEL_DIR may take, the least recently used ones are removed first
+MODEL_CACHE_BYTES = int(os.getenv('MODEL_CACHE_BYTES', str(20 * 1024 ** 3)))
+# 0 to never reach out to the Hugging Face Hub, models then have to be in MODEL_DIR or MODEL_MIRROR
+MODEL_DOWNLOAD = os.getenv('MODEL_DOWNLOAD', '1') == '1'
+
+# sha256 and size of every file of a model, written when it is fetched
+MANIFEST_NAME = 'manifest.json'
+# Size and mtime of the files when they last matched the manifest, so unchanged models are not hashed again
+VERIFIED_NAME = '.verified.json'
+# The files faster-whisper loads, the rest of a model repository is not fetched
+MODEL_FILES = ('config.json', 'preprocessor_config.json', 'model.bin', 'tokenizer.json', 'vocabulary.*')
+# Fetches that were interrupted leave their staging directory behind, it is removed after this long
+STAGING_MAX_AGE = 24 * 3600
+
+MODELS = {
+    "tiny.en": "Systran/faster-whisper-tiny.en",
+    "tiny": "Systran/faster-whisper-tiny",
+    "base.en": "Systran/faster-whisper-base.en",
+    "base": "Systran/faster-whisper-base",
+    "small.en": "Systran/faster-whisper-small.en",
+    "small": "Systran/faster-whisper-small",
+    "medium.en": "Systran/faster-whisper-medium.en",
+    "medium": "Systran/faster-whisper-medium",
+    "large-v1": "Systran/faster-whisper-large-v1",
+    "large-v2": "Systran/faster-whisper-large-v2",
+    "large-v3": "Systran/faster-whisper-large-v3",
+    "large": "Systran/faster-whisper-large-v3",
+    "distil-large-v2": "Systran/faster-distil-whisper-large-v2",
+    "distil-medium.en": "Systran/faster-distil-whisper-medium.en",
+    "distil-small.en": "Systran/faster-distil-whisper-small.en",
+    "distil-large-v3": "Systran/faster-distil-whisper-large-v3",
+    "large-v3-turbo": "mobiuslabsgmbh/faster-whisper-large-v3-turbo",
+    "turbo": "mobiuslabsgmbh/faster-whisper-large-v3-turbo",
+}
+
+
+def models_in_use(recognizer=RECOGNIZER):
+    # The models the configured recognizer loads, stub and custom recognizers bring their own
+    if recognizer == 'whisper':
+        return [WHISPER_MODEL]
+    if recognizer == 'cascade':
+        return [CASCADE_FAST_MODEL, WHISPER_MODEL]
+    return []
+
+
+def repo_id(name):
+    if name in MODELS:
+        return MODELS[name]
+    return name if '/' in name else None
+
+
+def store_name(name):
+    # Aliases share one copy under the first name of their repository, hub ids are stored as org--name
+    repo = MODELS.get(name)
+    if repo:
+        return next(alias for alias, other in MODELS.items() if other == repo)
+    return name.replace('/', '--')
+
+
+def model_path(name):
+    """The directory of a model on local disk, or None. Never touches the network.
+
+    name is a model directory, a name under MODEL_DIR (also models put
+    there by hand) or a name of MODELS or hub id stored by ensure_model.
+    """
+    if os.sep in name and os.path.isfile(os.path.join(name, 'model.bin')):
+        return name
+    for candidate in dict.fromkeys((name, store_name(name))):
+        directory = os.path.join(MODEL_DIR, candidate)
+        if os.path.isfile(os.path.join(directory, 'model.bin')):
+            return directory
+    return None
+
+
+def read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def write_json(path, data):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.json')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f, indent=2)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def git_blob_sha1(path):
+    # The hub's id of files kept in git rather than LFS
+    digest = hashlib.sha1(f"blob {os.path.getsize(path)}\0".encode())
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def model_files(directory):
+    # Relative paths of the files a model consists of, the bookkeeping files and hub metadata left out
+    files = []
+    for root, dirs, names in os.walk(directory):
+        dirs[:] = [d for d in dirs if not d.startswith('.')]
+        for name in names:
+            if name not in (MANIFEST_NAME, VERIFIED_NAME) and not name.startswith('.'):
+                files.append(os.path.relpath(os.path.join(root, name), directory))
+    return sorted(files)
+
+
+def file_stats(directory, files):
+    stats = {}
+    for name in files:
+        try:
+            stat = os.stat(os.path.join(directory, name))
+        except FileNotFoundError:
+            continue
+        stats[name] = [stat.st_size, stat.st_mtime_ns]
+    return stats
+
+
+def write_manifest(directory, name, source, expected=None):
+    """Hashes the files of a model and writes its manifest.
+
+    expected maps files to the sha256 or git blob id their source gives
+    for them, a file that does not match raises ValueError.
+    """
+    files = {}
+    for file_name in model_files(directory):
+        path = os.path.join(directory, file_name)
+        files[file_name] = {'size': os.path.getsize(path), 'sha256': file_sha256(path)}
+    for file_name, checksum in (expected or {}).items():
+        if file_name not in files:
+            raise ValueError(f"{file_name} of model {name} is missing from {source}")
+        path = os.path.join(directory, file_name)
+        actual = files[file_name]['sha256'] if len(checksum) == 64 else git_blob_sha1(path)
+        if actual != checksum:
+            raise ValueError(f"{file_name} of model {name} from {source} does not match its checksum")
+    manifest = {
+        'name': name,
+        'repo_id': repo_id(name),
+        'source': source,
+        'fetched_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'files': files,
+    }
+    write_json(os.path.join(directory, MANIFEST_NAME), manifest)
+    write_json(os.path.join(directory, VERIFIED_NAME), file_stats(directory, files))
+    return manifest
+
+
+def verify(directory, full=False):
+    """Checks the files of a model against its manifest, raises ValueError when one is missing or changed.
+
+    Files whose size and mtime did not change since they last matched are
+    not hashed again, unless full is set.
+    """
+    manifest = read_json(os.path.join(directory, MANIFEST_NAME))
+    if manifest is None:
+        raise ValueError(f"{directory} has no {MANIFEST_NAME}, fetch it with model_store.py")
+    stats = file_stats(directory, manifest['files'])
+    if not full and read_json(os.path.join(directory, VERIFIED_NAME)) == stats:
+        return manifest
+    for file_name, entry in manifest['files'].items():
+        if file_name not in stats:
+            raise ValueError(f"{file_name} of {directory} is missing")
+        if stats[file_name][0] != entry['size'] or file_sha256(os.path.join(directory, file_name)) != entry['sha256']:
+            raise ValueError(f"{file_name} of {directory} does not match its checksum")
+    try:
+        write_json(os.path.join(directory, VERIFIED_NAME), stats)
+    except OSError:
+        # Read-only model directories are hashed every time
+        pass
+    return manifest
+
+
+def copy_from_mirror(name, staging):
+    """Copies a model out of MODEL_MIRROR. Returns the checksums its manifest gives, or None if it is not there."""
+    for candidate in dict.fromkeys((store_name(name), name)):
+        source = os.path.join(MODEL_MIRROR, candidate)
+        if os.path.isfile(os.path.join(source, 'model.bin')):
+            break
+    else:
+        return None
+    for file_name in model_files(source):
+        os.makedirs(os.path.dirname(os.path.join(staging, file_name)), exist_ok=True)
+        shutil.copy2(os.path.join(source, file_name), os.path.join(staging, file_name))
+    manifest = read_json(os.path.join(source, MANIFEST_NAME))
+    if manifest is None:
+        logger.warning("Mirror copy %s has no %s, its files are taken as they are", source, MANIFEST_NAME)
+        return {}
+    return {file_name: entry['sha256'] for file_name, entry in manifest['files'].items()}
+
+
+def download(name, staging):
+    """Downloads a model from the Hugging Face Hub. Returns the checksums the hub gives for its files."""
+    import huggingface_hub
+
+    repo = repo_id(name)
+    info = huggingface_hub.HfApi().model_info(repo, files_metadata=True)
+    # Pinned to the revision the checksums are for
+    huggingface_hub.snapshot_download(repo, revision=info.sha, local_dir=staging, allow_patterns=list(MODEL_FILES))
+    shutil.rmtree(os.path.join(staging, '.cache'), ignore_errors=True)
+    return {
+        sibling.rfilename: sibling.lfs.sha256 if sibling.lfs else sibling.blob_id
+        for sibling in info.siblings
+        if any(fnmatch.fnmatch(sibling.rfilename, pattern) for pattern in MODEL_FILES)
+        and (sibling.lfs or sibling.blob_id)
+    }
+
+
+def install(name, download_allowed=MODEL_DOWNLOAD):
+    """Fetches a model into MODEL_DIR, from MODEL_MIRROR or else the hub, and writes its manifest.
+
+    The files are checked and hashed in a staging directory that is only
+    renamed into place once complete, so other processes never see part
+    of a model.
+    """
+    target = os.path.join(MODEL_DIR, store_name(name))
+    os.makedirs(MODEL_DIR, exist_ok=True)
+    staging = tempfile.mkdtemp(dir=MODEL_DIR, prefix=f".{store_name(name)}-")
+    try:
+        expected = copy_from_mirror(name, staging) if MODEL_MIRROR else None
+        source = MODEL_MIRROR
+        if expected is None:
+            if not download_allowed or repo_id(name) is None:
+                raise FileNotFoundError(f"Model {name} is not in {MODEL_DIR}"
+                                        + (f" or {MODEL_MIRROR}" if MODEL_MIRROR else "")
+                                        + ("" if download_allowed else " and downloads are off"))
+            logger.info("Downloading model %s from %s", name, repo_id(name))
+            expected = download(name, staging)
+            source = f"hf://{repo_id(name)}"
+        write_manifest(staging, name, source, expected)
+        os.chmod(staging, 0o755)
+        try:
+            os.rename(staging, target)
+        except OSError:
+            # Another process put the model in place first
+            if not os.path.isfile(os.path.join(target, MANIFEST_NAME)):
+                raise
+        logger.info("Model %s fetched from %s into %s", name, source, target)
+        return target
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+
+def ensure_model(name, download_allowed=MODEL_DOWNLOAD):
+    """The directory of a verified copy of the model on local disk, fetched if it is not there yet.
+
+    Models put in MODEL_DIR by hand get a manifest of their files as they
+    are. A fetched copy that no longer matches its manifest is fetched
+    again.
+    """
+    directory = model_path(name)
+    if directory and not os.path.isfile(os.path.join(directory, MANIFEST_NAME)):
+        if os.path.dirname(directory) != os.path.normpath(MODEL_DIR):
+            # A directory given directly is the caller's
+            return directory
+        logger.info("Recording the checksums of %s", directory)
+        write_manifest(directory, name, 'local')
+    if directory:
+        try:
+            verify(directory)
+        except ValueError as e:
+            if read_json(os.path.join(directory, MANIFEST_NAME)).get('source') == 'local':
+                # Changed by hand, not fetched here, so there is nothing to fetch it from
+                logger.warning("%s, recording the checksums of the files as they are now", e)
+                write_manifest(directory, name, 'local')
+            else:
+                logger.error("%s, fetching it again", e)
+                shutil.rmtree(directory)
+                directory = None
+    if directory is None:
+        directory = install(name, download_allowed)
+    # mtime doubles as last use time for eviction
+    os.utime(os.path.join(directory, MANIFEST_NAME))
+    return directory
+
+
+def evict_to_budget(keep=(), budget=None):
+    """Removes the least recently used fetched models until the rest fit in the budget.
+
+    Models in keep and ones put in MODEL_DIR by hand are never removed,
+    there would be nothing to fetch them from again.
+    """
+    budget = MODEL_CACHE_BYTES if budget is None else budget
+    keep = {os.path.normpath(directory) for directory in keep}
+    entries = []
+    try:
+        scan = list(os.scandir(MODEL_DIR))
+    except FileNotFoundError:
+        return
+    for entry in scan:
+        if entry.name.startswith('.'):
+            if entry.is_dir() and time.time() - entry.stat().st_mtime > STAGING_MAX_AGE:
+                shutil.rmtree(entry.path, ignore_errors=True)
+            continue
+        manifest_path = os.path.join(entry.path, MANIFEST_NAME)
+        manifest = read_json(manifest_path)
+        if manifest is None or manifest['source'] == 'local':
+            continue
+        size = sum(file['size'] for file in manifest['files'].values())
+        entries.append((os.path.getmtime(manifest_path), size, os.path.normpath(entry.path)))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, directory in sorted(entries):
+        if total <= budget:
+            break
+        if directory in keep:
+            continue
+        logger.info("Removing model %s, %d MB over the model budget", directory, (total - budget) // 1024 ** 2)
+        shutil.rmtree(directory, ignore_errors=True)
+        total -= size
+    if total > budget:
+        logger.warning("Models in use take %d MB, over MODEL_CACHE_BYTES", total // 1024 ** 2)
+
+
+def warm(directory):
+    # Starts reading the model into the page cache, so the processes loading it next do not each wait on the disk
+    if not hasattr(os, 'posix_fadvise'):
+        return
+    for file_name in model_files(directory):
+        fd = os.open(os.path.join(directory, file_name), os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        finally:
+            os.close(fd)
+
+
+def preload(names=None, download_allowed=MODEL_DOWNLOAD):
+    """Verified local copies of the models, by default the ones of the configured recognizer.
+
+    Meant for startup, before processes load the models: they then find
+    them with model_path and load them from disk without asking the hub.
+    Returns {name: directory}.
+    """
+    names = models_in_use() if names is None else names
+    paths = {name: ensure_model(name, download_allowed) for name in names}
+    evict_to_budget(keep=paths.values())
+    for directory in paths.values():
+        warm(directory)
+    return paths
+
+
+def installed():
+    # {name: directory} of the models in MODEL_DIR, aliases of a listed model left out
+    found = {}
+    for name in MODELS:
+        directory = model_path(name)
+        if directory and directory not in found.values():
+            found[name] = directory
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=f'Fetch, verify and list the Whisper models in {MODEL_DIR}')
+    commands = parser.add_subparsers(dest='command', required=True)
+    fetch = commands.add_parser('fetch', help='fetch models from MODEL_MIRROR or the hub, the configured ones '
+                                              'by default')
+    fetch.add_argument('names', nargs='*', help=f'names of {", ".join(MODELS)} or hub ids')
+    fetch.add_argument('--offline', action='store_true', help='only copy from MODEL_MIRROR')
+    check = commands.add_parser('verify', help='hash the files of models against their manifest')
+    check.add_argument('names', nargs='*', help='all models in MODEL_DIR by default')
+    commands.add_parser('list', help='models in MODEL_DIR, least recently used first')
+    evict = commands.add_parser('evict', help='remove the least recently used models over the budget')
+    evict.add_argument('--budget', type=int, help='bytes, MODEL_CACHE_BYTES by default')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    if args.command == 'fetch':
+        for name, directory in preload(args.names or None, not args.offline).items():
+            print(f"{name}: {directory}")
+    elif args.command == 'verify':
+        failed = False
+        directories = [model_path(name) or name for name in args.names] or sorted(
+            entry.path for entry in os.scandir(MODEL_DIR) if os.path.isfile(os.path.join(entry.path, MANIFEST_NAME)))
+        for directory in directories:
+            try:
+                verify(directory, full=True)
+                print(f"{directory}: ok")
+            except ValueError as e:
+                print(f"{directory}: {e}")
+                failed = True
+        sys.exit(1 if failed else 0)
+    elif args.command == 'list':
+        entries = []
+        for entry in os.scandir(MODEL_DIR):
+            manifest_path = os.path.join(entry.path, MANIFEST_NAME)
+            manifest = read_json(manifest_path)
+            if manifest is not None:
+                size = sum(file['size'] for file in manifest['files'].values())
+                entries.append((os.path.getmtime(manifest_path), entry.name, size, manifest['source']))
+        for last_used, name, size, source in sorted(entries):
+            used = time.strftime('%Y-%m-%d %H:%M', time.localtime(last_used))
+            print(f"{name:>20} {size / 1024 ** 2:>9.1f} MB  used {used}  from {source}")
+    else:
+        evict_to_budget(budget=args.budget)
+
+
+if __name__ == '__main__':
+    main()
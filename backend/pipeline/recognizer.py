@@ -0,0 +1,203 @@
+import re
+import math
+import bisect
+import hashlib
+import importlib
+from collections import namedtuple
+
+import numpy as np
+
+from config import SAMPLE_RATE, RECOGNIZER, WHISPER_MODEL, USE_GPU, CASCADE_FAST_MODEL, CASCADE_MIN_CONFIDENCE
+from model_store import model_path
+
+# Times are in seconds relative to the samples passed to transcribe()
+Segment = namedtuple('Segment', ['start', 'end', 'text', 'confidence'])
+Transcription = namedtuple('Transcription', ['segments', 'language', 'language_probability'])
+
+
+class Recognizer:
+    """Interface for speech recognizers, samples are 16kHz mono float32."""
+
+    name = 'base'
+
+    def transcribe(self, samples, language=None):
+        raise NotImplementedError
+
+    def transcribe_batch(self, samples_list, language=None):
+        # Recognizers that can batch override this, the results are in input order
+        return [self.transcribe(samples, language) for samples in samples_list]
+
+    def detect_language(self, samples):
+        # (language, probability), recognizers with a cheaper way than transcribing override this
+        result = self.transcribe(samples)
+        return result.language, result.language_probability
+
+    def warm_up(self):
+        # Runs once on a second of silence, so first-call setup is not paid by the first recording
+        self.transcribe(np.zeros(SAMPLE_RATE, dtype=np.float32))
+
+
+class StubRecognizer(Recognizer):
+    """Deterministic recognizer for tests, the output only depends on the samples."""
+
+    name = 'stub'
+
+    def __init__(self, language='en', **kwargs):
+        self.language = language
+
+    def transcribe(self, samples, language=None):
+        language = language or self.language
+        if not len(samples):
+            return Transcription([], language, 1.0)
+        digest = hashlib.sha1(np.round(samples * 32767).astype('<i2').tobytes()).hexdigest()
+        duration = round(len(samples) / SAMPLE_RATE, 2)
+        confidence = int(digest[:2], 16) / 255
+        return Transcription([Segment(0.0, duration, f"speech {digest[:8]}", confidence)], language, 1.0)
+
+
+def resolve_model_path(model):
+    # Prefer the local copy, see model_store.preload, over a hub download
+    return model_path(model) or model
+
+
+class WhisperRecognizer(Recognizer):
+    name = 'whisper'
+
+    def __init__(self, model=WHISPER_MODEL, cpu_threads=0, num_workers=1, beam_size=5, **kwargs):
+        import faster_whisper
+        from faster_whisper import BatchedInferencePipeline, WhisperModel
+
+        self.model_name = model
+        # clip_timestamps are sample offsets before faster-whisper 1.2 and seconds since
+        version = tuple(int(part) for part in re.findall(r'\d+', faster_whisper.__version__)[:2])
+        self.clip_unit = 1 if version < (1, 2) else SAMPLE_RATE
+        self.beam_size = beam_size
+        self.model = WhisperModel(
+            resolve_model_path(model),
+            device='cuda' if USE_GPU else 'cpu',
+            compute_type='float16' if USE_GPU else 'int8',
+            cpu_threads=cpu_threads,
+            # Concurrent transcribe() calls from several threads, e.g. one per stereo channel
+            num_workers=num_workers,
+        )
+        self.batched = BatchedInferencePipeline(self.model)
+
+    def transcribe(self, samples, language=None):
+        segments, info = self.model.transcribe(
+            samples,
+            language=language,
+            beam_size=self.beam_size,
+            vad_filter=False,
+            condition_on_previous_text=False,
+        )
+        segments = [Segment(s.start, s.end, s.text.strip(), math.exp(s.avg_logprob)) for s in segments]
+        return Transcription(segments, info.language, info.language_probability)
+
+    def detect_language(self, samples):
+        # Only runs the encoder over the first 30 seconds and reads the language token
+        language, probability, _ = self.model.detect_language(samples)
+        return language, probability
+
+    def clip_time(self, offset):
+        return int(offset) if self.clip_unit == 1 else int(offset) / self.clip_unit
+
+    def transcribe_batch(self, samples_list, language=None):
+        """Runs the encoder and decoder over all inputs at once.
+
+        The inputs are concatenated and passed as clip timestamps, which the
+        batched pipeline turns into one batch. Without a language, it is
+        detected once for the whole batch.
+        """
+        if len(samples_list) < 2:
+            return [self.transcribe(samples, language) for samples in samples_list]
+
+        offsets = np.cumsum([0] + [len(samples) for samples in samples_list])
+        # Only used to map the segments back, the clips are in the unit the pipeline takes
+        starts = [offset / SAMPLE_RATE for offset in offsets[:-1]]
+        clips = [{'start': self.clip_time(offsets[i]), 'end': self.clip_time(offsets[i + 1])}
+                 for i in range(len(samples_list)) if offsets[i + 1] > offsets[i]]
+        if not clips:
+            return [Transcription([], language, 1.0) for _ in samples_list]
+        segments, info = self.batched.transcribe(
+            np.concatenate(samples_list),
+            language=language,
+            beam_size=self.beam_size,
+            clip_timestamps=clips,
+            batch_size=len(clips),
+            without_timestamps=False,
+        )
+
+        results = [[] for _ in samples_list]
+        for s in segments:
+            # Segment times are in the concatenated audio, map them back to their input
+            index = bisect.bisect_right(starts, s.start + 0.001) - 1
+            results[index].append(Segment(s.start - starts[index], s.end - starts[index], s.text.strip(),
+                                          math.exp(s.avg_logprob)))
+        return [Transcription(segments, info.language, info.language_probability) for segments in results]
+
+
+class CascadeRecognizer(Recognizer):
+    """Transcribes with a fast model and redoes only what it is unsure of with a larger one.
+
+    An input comes back from the accurate model when any of its fast
+    segments has a confidence below min_confidence. The accurate model is
+    loaded on first use and is also used directly for records that always
+    get it, see Transcriber.patch_lines.
+    """
+
+    name = 'cascade'
+
+    def __init__(self, fast_model=CASCADE_FAST_MODEL, model=WHISPER_MODEL, min_confidence=CASCADE_MIN_CONFIDENCE,
+                 recognizer='whisper', **kwargs):
+        self.min_confidence = min_confidence
+        self.fast = load_recognizer(recognizer, model=fast_model, **kwargs)
+        self._accurate = None
+        self._accurate_args = (recognizer, model, kwargs)
+
+    @property
+    def accurate(self):
+        if self._accurate is None:
+            recognizer, model, kwargs = self._accurate_args
+            self._accurate = load_recognizer(recognizer, model=model, **kwargs)
+        return self._accurate
+
+    def unsure(self, result):
+        return any(segment.confidence < self.min_confidence for segment in result.segments)
+
+    def transcribe(self, samples, language=None):
+        return self.transcribe_batch([samples], language)[0]
+
+    def detect_language(self, samples):
+        return self.fast.detect_language(samples)
+
+    def warm_up(self):
+        # The accurate model stays unloaded until it is needed
+        self.fast.warm_up()
+
+    def transcribe_batch(self, samples_list, language=None):
+        results = self.fast.transcribe_batch(samples_list, language)
+        unsure = [i for i, result in enumerate(results) if self.unsure(result)]
+        if unsure:
+            redone = self.accurate.transcribe_batch([samples_list[i] for i in unsure], language)
+            for i, result in zip(unsure, redone):
+                results[i] = result
+        return results
+
+
+RECOGNIZERS = {
+    'stub': StubRecognizer,
+    'whisper': WhisperRecognizer,
+    'cascade': CascadeRecognizer,
+}
+
+
+def load_recognizer(name=RECOGNIZER, **kwargs):
+    # Besides the built-in names, any 'module:Class' implementing Recognizer can be plugged in
+    if ':' in name:
+        module_name, class_name = name.split(':', 1)
+        recognizer_class = getattr(importlib.import_module(module_name), class_name)
+    elif name in RECOGNIZERS:
+        recognizer_class = RECOGNIZERS[name]
+    else:
+        raise ValueError(f"Unknown recognizer '{name}', expected one of: {', '.join(RECOGNIZERS)} or module:Class")
+    return recognizer_class(**kwargs)
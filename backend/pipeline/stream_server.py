@@ -0,0 +1,244 @@
+import os
+import json
+import itertools
+import asyncio
+import logging
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import requests
+import soundfile as sf
+from fastapi import FastAPI, WebSocket
+from starlette.websockets import WebSocketState
+
+from api_client import BackendClient
+from audio_io import format_duration
+from config import (
+    BACKEND_URL, RECOGNIZER, CREATED_BY, SAMPLE_RATE, LANGUAGE_PROFILE_CONFIDENCE, load_vad_config, load_whisper_config
+)
+from model_store import preload
+from recognizer import load_recognizer
+from streaming import StreamSegmenter, decode_pcm
+from transcribe import Transcriber
+from transcript import merge_lines
+from vad import load_vad
+
+logger = logging.getLogger('pipeline.stream')
+
+# Audio of live streams is kept here, next to but not inside the input directory
+STREAM_DIR = os.getenv('STREAM_DIR', '/app/streams')
+# How often the VAD looks for finished utterances in a stream
+STREAM_STEP_SECONDS = float(os.getenv('STREAM_STEP_SECONDS', '1'))
+# Utterances a stream may have waiting for the recognizer before reading from it pauses
+STREAM_MAX_PENDING = int(os.getenv('STREAM_MAX_PENDING', '4'))
+# Utterances transcribed at the same time, across all streams
+STREAM_THREADS = int(os.getenv('STREAM_THREADS', '2'))
+RECOGNIZER_THREADS = int(os.getenv('RECOGNIZER_THREADS', '1'))
+
+app = FastAPI()
+executor = ThreadPoolExecutor(STREAM_THREADS)
+client = BackendClient(BACKEND_URL)
+_transcriber = None
+
+
+def get_transcriber():
+    global _transcriber
+    if _transcriber is None:
+        preload()
+        recognizer = load_recognizer(RECOGNIZER, cpu_threads=RECOGNIZER_THREADS, num_workers=STREAM_THREADS)
+        recognizer.warm_up()
+        _transcriber = Transcriber(recognizer, load_vad(load_vad_config()), load_whisper_config())
+    return _transcriber
+
+
+@app.on_event('startup')
+async def load_models():
+    # Streams connecting while the model loads would fall behind, so the server only accepts them once it is ready
+    await asyncio.get_running_loop().run_in_executor(executor, get_transcriber)
+
+
+def safe_name(name):
+    # A single path segment, so circuits and file names cannot point outside STREAM_DIR
+    return bool(name) and name not in ('.', '..') and not any(c in name for c in ('/', '\\', '\0'))
+
+
+def reserve_path(path):
+    """Creates path, or path with a _1, _2... suffix when it exists, and returns the one created."""
+    stem, extension = os.path.splitext(path)
+    for n in itertools.count():
+        candidate = f"{stem}_{n}{extension}" if n else path
+        try:
+            # O_EXCL, two streams asking for the same name at once still get one each
+            os.close(os.open(candidate, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644))
+            return candidate
+        except FileExistsError:
+            continue
+
+
+class LiveRecord:
+    """The user_data record of a stream, written to as utterances are transcribed."""
+
+    def __init__(self, circuit, file_name, rate, channels):
+        start_time = datetime.now()
+        file_name = os.path.basename(file_name or f"{circuit}_{start_time:%Y%m%d_%H%M%S}.wav")
+        if not safe_name(circuit) or not safe_name(file_name):
+            raise ValueError("The circuit and file name must be plain names")
+        directory = os.path.join(STREAM_DIR, circuit)
+        os.makedirs(directory, exist_ok=True)
+        # An earlier stream's recording under the same name is kept
+        self.path = reserve_path(os.path.join(directory, file_name))
+        self.key = {
+            'circuit': circuit,
+            'start_time': start_time.isoformat(),
+            'file_name': os.path.basename(self.path),
+            'created_by': CREATED_BY,
+        }
+        self.stereo = channels == 2
+        self.lines = []
+        self.audio = sf.SoundFile(self.path, 'w', samplerate=rate, channels=channels, subtype='PCM_16')
+
+    def record(self, duration):
+        return {**self.key, 'audio_file_path': self.path, 'duration': format_duration(duration),
+                'stt_transcript': '\n'.join(merge_lines(sorted(self.lines))), 'stereo': self.stereo}
+
+    def open(self):
+        client.add_user_data_batch([self.record(0)])
+
+    def append(self, lines, duration):
+        self.lines.extend(lines)
+        try:
+            client.append_transcript(self.key, lines, format_duration(duration))
+        except requests.RequestException:
+            # The lines are kept and written with the rest when the stream closes
+            logger.exception("Appending to %s failed", self.key['file_name'])
+
+    def close(self, duration):
+        # Utterances were appended as they ended, the final write puts the lines in time order
+        self.audio.close()
+        client.add_user_data_batch([self.record(duration)])
+
+
+def circuit_language(circuit):
+    # The circuit's profiled language spares every utterance its own detection
+    try:
+        profiles = {profile['circuit']: profile for profile in client.language_profiles()}
+    except requests.RequestException:
+        logger.exception("Fetching language profiles failed")
+        return None
+    profile = profiles.get(circuit)
+    if profile is None or profile['confidence'] < LANGUAGE_PROFILE_CONFIDENCE:
+        return None
+    return profile['language']
+
+
+async def transcribe_utterances(websocket, queue, record, language):
+    loop = asyncio.get_running_loop()
+    transcriber = get_transcriber()
+    try:
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            utterances, duration = item
+            results = await loop.run_in_executor(executor, transcriber.recognize, utterances, language)
+            lines = [line for result in results for line in result]
+            if not lines:
+                continue
+            await loop.run_in_executor(executor, record.append, lines, duration)
+            if websocket.client_state == WebSocketState.CONNECTED:
+                await websocket.send_text(json.dumps({'type': 'segments', 'lines': lines}))
+    except Exception:
+        logger.exception("Transcribing the stream of %s failed", record.key['circuit'])
+        # The client stops sending, and the stream stops reading, once the socket is closed
+        if websocket.application_state == WebSocketState.CONNECTED:
+            await websocket.close(code=1011, reason="Transcription failed")
+        raise
+
+
+def failed(task):
+    return task.done() and not task.cancelled() and task.exception() is not None
+
+
+async def enqueue(queue, item, worker):
+    """Waits for room in the queue, raises the error of the worker if it fails meanwhile."""
+    put = asyncio.ensure_future(queue.put(item))
+    await asyncio.wait({put, worker}, return_when=asyncio.FIRST_COMPLETED)
+    if not put.done():
+        # Nothing takes from the queue anymore
+        put.cancel()
+        worker.result()
+
+
+@app.websocket("/stream/{circuit}")
+async def stream(websocket: WebSocket, circuit: str, rate: int = SAMPLE_RATE, channels: int = 1,
+                 file_name: Optional[str] = None):
+    """Transcribes a live circuit while it is being recorded.
+
+    The client sends binary messages of interleaved 16 bit little-endian
+    PCM at the given rate, and the text message "end" when it is done.
+    Each utterance is transcribed once the VAD sees it end and is appended
+    to the record of the stream, whose lines are also sent back. While
+    STREAM_MAX_PENDING utterances of a stream wait for the recognizer, its
+    socket is not read, so a client sending faster than it can be
+    transcribed is slowed down by the connection itself.
+    """
+    await websocket.accept()
+    if channels not in (1, 2) or rate <= 0:
+        await websocket.close(code=1003, reason="Expected 1 or 2 channels and a positive rate")
+        return
+    if not safe_name(circuit) or (file_name is not None and not safe_name(os.path.basename(file_name))):
+        await websocket.close(code=1008, reason="The circuit and file name must be plain names")
+        return
+
+    loop = asyncio.get_running_loop()
+    record = LiveRecord(circuit, file_name, rate, channels)
+    await loop.run_in_executor(executor, record.open)
+    vad_config = load_vad_config()
+    segmenter = StreamSegmenter(
+        get_transcriber().speech_regions, ['L', 'R'] if channels == 2 else ['B'], rate,
+        vad_config['min_silence_duration_ms'] / 1000, vad_config['max_speech_duration_s'], STREAM_STEP_SECONDS,
+    )
+    await websocket.send_text(json.dumps({'type': 'started', **record.key}))
+    logger.info("Streaming %s into %s", circuit, record.path)
+
+    queue = asyncio.Queue(STREAM_MAX_PENDING)
+    language = await loop.run_in_executor(executor, circuit_language, circuit)
+    worker = asyncio.create_task(transcribe_utterances(websocket, queue, record, language))
+    # Its error is logged where it happens, even if the stream is cancelled before it looks at the worker
+    worker.add_done_callback(lambda task: task.cancelled() or task.exception())
+    remainder = b''
+    try:
+        while True:
+            message = await websocket.receive()
+            if message['type'] == 'websocket.disconnect' or message.get('text') == 'end':
+                break
+            data = remainder + (message.get('bytes') or b'')
+            whole = len(data) - len(data) % (2 * channels)
+            data, remainder = data[:whole], data[whole:]
+            if not data:
+                continue
+            samples = decode_pcm(data, channels)
+            await loop.run_in_executor(None, record.audio.write, samples)
+            # The VAD runs off the event loop, other streams keep being read meanwhile
+            utterances = await loop.run_in_executor(None, segmenter.feed, samples)
+            if utterances:
+                await enqueue(queue, (utterances, segmenter.duration), worker)
+        # A client that went away early still gets what it sent transcribed
+        utterances = segmenter.flush()
+        if utterances:
+            await enqueue(queue, (utterances, segmenter.duration), worker)
+        await enqueue(queue, None, worker)
+        await worker
+    except Exception:
+        if not failed(worker):
+            logger.exception("Stream of %s failed", circuit)
+            worker.cancel()
+            raise
+        # The worker logged its error and closed the socket, the record is still closed with what was transcribed
+        return
+    finally:
+        await loop.run_in_executor(executor, record.close, segmenter.duration)
+    if websocket.client_state == WebSocketState.CONNECTED:
+        await websocket.send_text(json.dumps({'type': 'closed', 'duration': segmenter.duration}))
+        await websocket.close()
@@ -0,0 +1,81 @@
+import numpy as np
+
+from audio_io import resample
+from config import SAMPLE_RATE
+
+
+def decode_pcm(data, channels):
+    """Turns interleaved 16 bit little-endian PCM into (frames, channels) float32."""
+    samples = np.frombuffer(data, dtype='<i2').astype(np.float32) / 32768
+    return samples.reshape(-1, channels)
+
+
+class StreamSegmenter:
+    """Cuts a live signal into utterances as it arrives.
+
+    Audio is kept at its own rate until an utterance is cut from it, so the
+    resampling has no seams between network chunks. Every step_seconds the
+    speech regions of the audio since the last cut are found again. Regions
+    followed by min_silence of audio are complete and come out as
+    utterances. Once max_pending seconds are waiting without a complete
+    region, everything found so far is cut, which bounds both the latency
+    and the memory of a stream.
+    """
+
+    def __init__(self, speech_regions, prefixes, rate, min_silence, max_pending, step_seconds=1.0):
+        self.speech_regions = speech_regions
+        self.prefixes = prefixes
+        self.rate = rate
+        self.min_silence = min_silence
+        self.max_pending = max_pending
+        self.step = int(step_seconds * rate)
+        self.pending = [np.zeros(0, np.float32) for _ in prefixes]
+        # Stream frame of the first pending sample, per channel
+        self.offsets = [0] * len(prefixes)
+        self.unchecked = 0
+        self.frames = 0
+
+    @property
+    def duration(self):
+        return self.frames / self.rate
+
+    def feed(self, channels):
+        """Adds (frames, channels) samples, returns the (prefix, start, samples) utterances completed."""
+        for i in range(len(self.prefixes)):
+            self.pending[i] = np.concatenate([self.pending[i], channels[:, i]])
+        self.frames += len(channels)
+        self.unchecked += len(channels)
+        if self.unchecked < self.step:
+            return []
+        self.unchecked = 0
+        return [utterance for i in range(len(self.prefixes)) for utterance in self.cut(i)]
+
+    def flush(self):
+        # The stream ended, whatever speech is left is complete
+        return [utterance for i in range(len(self.prefixes)) for utterance in self.cut(i, final=True)]
+
+    def cut(self, index, final=False):
+        raw = self.pending[index]
+        samples = resample(raw, self.rate)
+        length = len(raw) / self.rate
+        regions = self.speech_regions(samples)
+        complete = [(start, end) for start, end in regions if end <= length - self.min_silence]
+        forced = final or (not complete and length >= self.max_pending)
+        if forced:
+            complete = regions
+
+        offset = self.offsets[index] / self.rate
+        utterances = [(self.prefixes[index], offset + start,
+                       samples[int(start * SAMPLE_RATE):int(end * SAMPLE_RATE)]) for start, end in complete]
+        if forced:
+            drop = len(raw)
+        elif complete:
+            drop = int(complete[-1][1] * self.rate)
+        elif not regions:
+            # Only silence, keep a little in case speech starts right at the end
+            drop = max(len(raw) - int(self.min_silence * self.rate), 0)
+        else:
+            drop = 0
+        self.pending[index] = raw[drop:]
+        self.offsets[index] += drop
+        return utterances
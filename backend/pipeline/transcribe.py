@@ -0,0 +1,234 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from audio_io import load_audio, load_audio_range, channel_correlation, format_duration
+from config import SAMPLE_RATE
+from transcript import format_line, merge_lines, parse_line
+
+# Whisper identifies the language from its first 30 second window
+LANGUAGE_DETECTION_SAMPLES = 30 * SAMPLE_RATE
+
+
+def channel_prefixes(channels):
+    return ['L', 'R'] if channels.shape[1] == 2 else ['B']
+
+
+def select_channel(channels, prefix):
+    if prefix == 'L':
+        return channels[:, 0]
+    if prefix == 'R':
+        return channels[:, 1]
+    # A view for mono audio, only mixing down makes a copy
+    return channels[:, 0] if channels.shape[1] == 1 else channels.mean(axis=1)
+
+
+def chunk_regions(regions, chunk_seconds):
+    """Groups consecutive speech regions into chunks spanning at most chunk_seconds.
+
+    Chunks only break between regions, so no utterance is cut in two. A
+    single region longer than chunk_seconds becomes a chunk of its own.
+    """
+    chunks = []
+    for start, end in regions:
+        if chunks and end - chunks[-1][0][0] <= chunk_seconds:
+            chunks[-1].append((start, end))
+        else:
+            chunks.append([(start, end)])
+    return chunks
+
+
+class Transcriber:
+    """Runs VAD and the recognizer over a recording and builds its transcript."""
+
+    def __init__(self, recognizer, vad, whisper_config, batch_size=1, parallel_channels=False):
+        self.recognizer = recognizer
+        self.vad = vad
+        self.whisper_config = whisper_config
+        # Number of segments passed to the recognizer per call
+        self.batch_size = batch_size
+        self.parallel_channels = parallel_channels
+
+    def load_channels(self, path):
+        """Decodes a recording, fake stereo files come back as a single channel.
+
+        Stereo files whose channels correlate at fake_stereo_threshold or
+        above carry the same audio twice and are transcribed once, as B.
+        """
+        channels, duration = load_audio(path)
+        if self.is_fake_stereo(channels):
+            channels = channels.mean(axis=1, keepdims=True)
+        return channels, duration
+
+    def is_fake_stereo(self, channels):
+        threshold = self.whisper_config['fake_stereo_threshold']
+        return channels.shape[1] == 2 and threshold is not None and channel_correlation(channels) >= threshold
+
+    def map_channels(self, function, channels):
+        """Returns [function(samples, prefix)] for every channel, in channel order.
+
+        Stereo channels run in parallel threads when parallel_channels is
+        set, the VAD and recognizer release the GIL while they compute.
+        """
+        prefixes = channel_prefixes(channels)
+        args = [(select_channel(channels, prefix), prefix) for prefix in prefixes]
+        if self.parallel_channels and len(prefixes) > 1:
+            with ThreadPoolExecutor(len(prefixes)) as executor:
+                return list(executor.map(lambda arg: function(*arg), args))
+        return [function(*arg) for arg in args]
+
+    def speech_regions(self, samples):
+        if not self.whisper_config['use_vad']:
+            return [(0.0, len(samples) / SAMPLE_RATE)] if len(samples) else []
+        return self.vad(samples)
+
+    def recognize(self, items, language=None, recognizer=None):
+        """Transcribes (prefix, start, samples) items, batch_size at a time.
+
+        Returns the transcript lines of each item, with times offset by its start.
+        """
+        language = self.whisper_config['language'] or language
+        recognizer = recognizer or self.recognizer
+        results = []
+        for i in range(0, len(items), self.batch_size):
+            batch = items[i:i + self.batch_size]
+            results.extend(recognizer.transcribe_batch([samples for _, _, samples in batch], language))
+        return [
+            # Recognizer times are relative to the item
+            [format_line(prefix, start + segment.start, start + segment.end, segment.text)
+             for segment in result.segments if segment.text]
+            for (prefix, start, _), result in zip(items, results)
+        ]
+
+    def transcribe_channel(self, samples, prefix, language=None):
+        items = [(prefix, start, samples[int(start * SAMPLE_RATE):int(end * SAMPLE_RATE)])
+                 for start, end in self.speech_regions(samples)]
+        return [line for lines in self.recognize(items, language) for line in lines]
+
+    def transcribe_channels(self, channels):
+        if not self.whisper_config['use_stt']:
+            return []
+        return [line for lines in self.map_channels(self.transcribe_channel, channels) for line in lines]
+
+    def transcribe_file(self, path):
+        channels, duration = self.load_channels(path)
+        return {
+            'stt_transcript': '\n'.join(merge_lines(self.transcribe_channels(channels))),
+            'duration': format_duration(duration),
+            'stereo': channels.shape[1] == 2,
+        }
+
+    def plan_file(self, path, chunk_seconds, language=None):
+        channels, duration = self.load_channels(path)
+        return self.plan_channels(channels, duration, chunk_seconds, language)
+
+    def detect_language(self, channels, segments):
+        """Detects the language once per file, from up to 30 seconds of its speech.
+
+        Returns (language, probability), or (None, None) without speech.
+        """
+        pieces, total = [], 0
+        for prefix, start, end in segments:
+            samples = select_channel(channels, prefix)[int(start * SAMPLE_RATE):int(end * SAMPLE_RATE)]
+            pieces.append(samples[:LANGUAGE_DETECTION_SAMPLES - total])
+            total += len(pieces[-1])
+            if total >= LANGUAGE_DETECTION_SAMPLES:
+                break
+        if not total:
+            return None, None
+        return self.recognizer.detect_language(np.concatenate(pieces))
+
+    def plan_channels(self, channels, duration, chunk_seconds, language=None, speech=None):
+        """Transcribes short files directly and only runs the VAD over long ones.
+
+        Returns the finished record for files up to chunk_seconds long, or
+        with chunk_seconds=None for none. Other files come back with
+        'segments', a list of (prefix, start, end) speech regions for
+        transcribe_segments. Every segment of a file is transcribed in the
+        same language: the configured one, the one given, or else the one
+        detected here, which the record carries as 'language' along with
+        'language_probability'.
+
+        speech takes the (prefix, start, end) regions of an earlier VAD run
+        over the same audio in place of running the VAD again. Either way
+        the record carries them as 'speech'.
+        """
+        record = {'duration': format_duration(duration), 'stereo': channels.shape[1] == 2}
+        if not self.whisper_config['use_stt']:
+            record['stt_transcript'] = ''
+            return record
+
+        def channel_segments(samples, prefix):
+            return [(prefix, start, end) for start, end in self.speech_regions(samples)]
+
+        if speech is None:
+            speech = [segment for segments in self.map_channels(channel_segments, channels) for segment in segments]
+        segments = record['speech'] = [tuple(segment) for segment in speech]
+        language = self.whisper_config['language'] or language
+        if language is None:
+            language, record['language_probability'] = self.detect_language(channels, segments)
+        record['language'] = language
+        if chunk_seconds is not None and duration <= chunk_seconds:
+            def channel_lines(samples, prefix):
+                items = [(prefix, start, samples[int(start * SAMPLE_RATE):int(end * SAMPLE_RATE)])
+                         for p, start, end in segments if p == prefix]
+                return [line for lines in self.recognize(items, language) for line in lines]
+
+            lines = [line for lines in self.map_channels(channel_lines, channels) for line in lines]
+            record['stt_transcript'] = '\n'.join(merge_lines(lines))
+            return record
+
+        record['segments'] = segments
+        return record
+
+    def transcribe_segments(self, items, languages=None, audio=None):
+        """Transcribes (path, prefix, start, end) items, which may come from several files.
+
+        audio maps a path to the channels of the file when they are decoded
+        already, e.g. in shared memory. Other files are decoded once, over
+        the span their items cover. Each file is transcribed in its language
+        from languages, a dict by path. Returns the transcript lines of each
+        item.
+        """
+        audio = dict(audio or {})
+        spans = {}
+        for path, _, start, end in items:
+            if path in audio:
+                continue
+            first, last = spans.get(path, (start, end))
+            spans[path] = (min(first, start), max(last, end))
+
+        audio.update((path, load_audio_range(path, first, last)) for path, (first, last) in spans.items())
+        groups = {}
+        for index, (path, prefix, start, end) in enumerate(items):
+            # Files decoded here start at their first item
+            first = int(spans[path][0] * SAMPLE_RATE) if path in spans else 0
+            # Sliced before the channel is selected, so mixing down only copies the item
+            channels = audio[path][int(start * SAMPLE_RATE) - first:int(end * SAMPLE_RATE) - first]
+            entry = (prefix, start, select_channel(channels, prefix))
+            groups.setdefault((languages or {}).get(path), []).append((index, entry))
+
+        # One recognizer call per language, files of several circuits can share a batch
+        results = [None] * len(items)
+        for language, entries in groups.items():
+            lines = self.recognize([entry for _, entry in entries], language)
+            for (index, _), item_lines in zip(entries, lines):
+                results[index] = item_lines
+        return results
+
+    def patch_lines(self, path, lines, recognizer):
+        """Transcribes the span of every line again with recognizer and swaps in its text.
+
+        Lines the recognizer finds nothing in are kept as they were, so the
+        transcript never loses text. Returns the patched lines in time order.
+        """
+        channels, _ = load_audio(path)
+        spans = [parse_line(line) for line in lines]
+        items = [(prefix, start, select_channel(channels, prefix)[int(start * SAMPLE_RATE):int(end * SAMPLE_RATE)])
+                 for prefix, start, end, _ in filter(None, spans)]
+        results = iter(self.recognize(items, recognizer=recognizer))
+        patched = []
+        for line, span in zip(lines, spans):
+            redone = next(results) if span else None
+            patched.extend(redone or [line])
+        return merge_lines(patched)
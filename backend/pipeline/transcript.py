@@ -0,0 +1,48 @@
+# Transcripts are stored as one "<L|R|B> start end text" line per segment
+
+
+def format_line(prefix, start, end, text):
+    return f"{prefix} {start:.2f} {end:.2f} {text}"
+
+
+def get_start_time(line):
+    # Same ordering as edit_transcript in app_audio_transcription
+    parts = line.split()
+    if len(parts) >= 3:
+        try:
+            return float(parts[1])
+        except ValueError:
+            return float('inf')
+    else:
+        return float('inf')
+
+
+def parse_line(line):
+    # (prefix, start, end, text), None for lines that do not follow the format
+    parts = line.split(' ', 3)
+    if len(parts) < 3:
+        return None
+    try:
+        return parts[0], float(parts[1]), float(parts[2]), parts[3] if len(parts) > 3 else ''
+    except ValueError:
+        return None
+
+
+def merge_lines(lines):
+    return sorted(lines, key=get_start_time)
+
+
+def shift_lines(lines, offset, duration):
+    # Maps the lines of an original onto a copy starting offset seconds into it, dropping what the copy lacks
+    shifted = []
+    for line in lines:
+        parts = line.split(' ', 3)
+        if len(parts) < 4:
+            continue
+        try:
+            start, end = float(parts[1]) - offset, float(parts[2]) - offset
+        except ValueError:
+            continue
+        if end > 0 and start < duration:
+            shifted.append(format_line(parts[0], max(start, 0.0), min(end, duration), parts[3]))
+    return shifted
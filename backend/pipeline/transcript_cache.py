@@ -0,0 +1,72 @@
+import os
+import json
+import hashlib
+import tempfile
+
+from config import CACHE_DIR
+
+TRANSCRIPT_CACHE_DIR = os.getenv('TRANSCRIPT_CACHE_DIR', os.path.join(CACHE_DIR, 'transcripts'))
+TRANSCRIPT_CACHE_BYTES = int(os.getenv('TRANSCRIPT_CACHE_BYTES', str(512 * 1024 ** 2)))
+# Record fields that only depend on the audio and the transcription settings, speech is the VAD output
+CACHED_FIELDS = ('stt_transcript', 'duration', 'stereo', 'duplicate_of', 'duplicate_offset', 'speech')
+
+
+def content_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_path(digest, config_key):
+    # The config key is part of the name, so changing the model or a config file misses the old entries
+    return os.path.join(TRANSCRIPT_CACHE_DIR, digest[:2], f"{digest}-{config_key}.json")
+
+
+def get_cached(digest, config_key):
+    target = cache_path(digest, config_key)
+    try:
+        with open(target) as f:
+            record = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    # mtime doubles as last access time for LRU eviction
+    os.utime(target)
+    return record
+
+
+def put_cached(digest, config_key, record):
+    target = cache_path(digest, config_key)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target), suffix='.json')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump({field: record.get(field) for field in CACHED_FIELDS}, f)
+        os.replace(tmp_path, target)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def evict_to_budget(budget=None):
+    budget = TRANSCRIPT_CACHE_BYTES if budget is None else budget
+    entries = []
+    for root, _, files in os.walk(TRANSCRIPT_CACHE_DIR):
+        for name in files:
+            file_path = os.path.join(root, name)
+            try:
+                stat = os.stat(file_path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, file_path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, file_path in sorted(entries):
+        if total <= budget:
+            break
+        try:
+            os.remove(file_path)
+            total -= size
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,122 @@
+import os
+import time
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait
+
+import yaml
+
+from benchmark_batch import collect_items
+from config import CONF_DIR, RECOGNIZER, SAMPLE_RATE, load_vad_config, load_whisper_config
+from cpu_topology import core_sets, cpu_order, pin_process
+from recognizer import load_recognizer
+from transcribe import Transcriber
+from vad import load_vad
+from worker import transcription_model
+
+THREAD_COUNTS = (1, 2, 4, 8, 16, 32, 64)
+
+# Set in each pool process by init_tuning
+_transcriber = None
+_items = None
+_barrier = None
+
+
+def init_tuning(recognizer_name, threads, paths, cpu_sets, counter, barrier):
+    global _transcriber, _items, _barrier
+    pin_process(cpu_sets, counter)
+    recognizer = load_recognizer(recognizer_name, cpu_threads=threads)
+    _transcriber = Transcriber(recognizer, load_vad(load_vad_config()), load_whisper_config())
+    _items, _ = collect_items(_transcriber, paths)
+    _barrier = barrier
+
+
+def warm_up():
+    # One per process, the barrier holds every process here until all of them loaded their model
+    _transcriber.recognize(_items[:1])
+    _barrier.wait(timeout=600)
+
+
+def recognize_item(index):
+    _transcriber.recognize([_items[index]])
+
+
+def candidates(cpus, max_workers):
+    """(workers, threads) splits of the CPUs, the workers sharing all CPUs between them."""
+    workers = {min(cpus // threads, max_workers) for threads in THREAD_COUNTS + (cpus,) if threads <= cpus}
+    return [(count, cpus // count) for count in sorted(workers, reverse=True)]
+
+
+def measure(args, workers, threads, cpu_sets, order):
+    """Seconds the pool takes for all items, fastest of args.repeat runs, model loading not counted."""
+    context = multiprocessing.get_context()
+    counter, barrier = context.Value('i', 0), context.Barrier(workers)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=init_tuning,
+                             initargs=(args.recognizer, threads, args.paths, cpu_sets, counter, barrier)) as pool:
+        for future in [pool.submit(warm_up) for _ in range(workers)]:
+            future.result()
+        elapsed = float('inf')
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            futures = [pool.submit(recognize_item, index) for index in order]
+            wait(futures)
+            for future in futures:
+                future.result()
+            elapsed = min(elapsed, time.perf_counter() - started)
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Find the split of the CPUs into worker processes and recognizer '
+                                                 'threads that transcribes fastest, and save it for worker.py')
+    parser.add_argument('paths', nargs='+', help='sample recordings, a few minutes of typical traffic')
+    parser.add_argument('--recognizer', default=RECOGNIZER)
+    parser.add_argument('--max-workers', type=int, default=0,
+                        help='most worker processes to try, every process holds its own copy of the model')
+    parser.add_argument('--repeat', type=int, default=1, help='runs per split, the fastest is reported')
+    parser.add_argument('--no-pin', action='store_true', help='let the OS schedule the workers instead of pinning them')
+    parser.add_argument('--output', default=os.path.join(CONF_DIR, 'worker_config.yaml'))
+    parser.add_argument('--dry-run', action='store_true', help='only print the results')
+    args = parser.parse_args()
+
+    # Only the VAD runs here, to know what the workers will transcribe
+    items, duration = collect_items(Transcriber(None, load_vad(load_vad_config()), load_whisper_config()), args.paths)
+    if not items:
+        parser.error('the sample recordings hold no speech')
+    speech = sum(len(samples) for _, _, samples in items) / SAMPLE_RATE
+    # Longest segments first, so the last ones to finish are short
+    order = sorted(range(len(items)), key=lambda index: -len(items[index][2]))
+    cpus = len(cpu_order())
+    print(f"{len(items)} segments, {speech:.1f}s of speech, {duration:.1f}s of audio, {cpus} CPUs")
+
+    print(f"{'workers':>7} {'threads':>7} {'seconds':>9} {'RTF':>7}")
+    results = []
+    for workers, threads in candidates(cpus, args.max_workers or cpus):
+        cpu_sets = None if args.no_pin else core_sets(workers, threads)
+        elapsed = measure(args, workers, threads, cpu_sets, order)
+        results.append((elapsed, workers, threads, cpu_sets))
+        # RTF is processing time per second of audio, below 1 is faster than real time
+        print(f"{workers:>7} {threads:>7} {elapsed:>9.2f} {elapsed / duration:>7.3f}")
+
+    elapsed, workers, threads, cpu_sets = min(results, key=lambda result: result[0])
+    print(f"fastest: {workers} workers x {threads} threads, {duration / elapsed:.1f}x real time")
+    if args.dry_run:
+        return
+    config = {
+        'workers': workers,
+        'recognizer_threads': threads,
+        # The split is measured with one recognition per process at a time
+        'parallel_channels': False,
+        'cpu_sets': cpu_sets,
+        'recognizer': args.recognizer,
+        'model': transcription_model() if args.recognizer == RECOGNIZER else args.recognizer,
+    }
+    with open(args.output, 'w') as f:
+        f.write(f"# Written by tune_workers.py on {time.strftime('%Y-%m-%d %H:%M')}, "
+                f"{duration / elapsed:.1f}x real time on {cpus} CPUs\n")
+        yaml.safe_dump(config, f, sort_keys=False, default_flow_style=None)
+    print(f"saved to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+import os
+
+import numpy as np
+from scipy.ndimage import binary_dilation
+
+from config import SAMPLE_RATE
+
+GATE_FRAME = int(0.02 * SAMPLE_RATE)
+# Frames this far above the gate threshold pass whatever their zero-crossing rate, speech over loud static
+GATE_LOUD_DB = 20
+
+
+def split_long_regions(regions, max_duration):
+    # Evenly split regions longer than max_duration, silero does this itself
+    result = []
+    for start, end in regions:
+        pieces = max(1, int(-(-(end - start) // max_duration)))
+        step = (end - start) / pieces
+        result.extend((start + i * step, start + (i + 1) * step) for i in range(pieces))
+    return result
+
+
+class SileroVad:
+    """Silero VAD as bundled (ONNX) with faster-whisper, no torch required."""
+
+    def __init__(self, config):
+        from faster_whisper.vad import VadOptions
+
+        self.options = VadOptions(
+            threshold=config['threshold'],
+            min_speech_duration_ms=config['min_speech_duration_ms'],
+            max_speech_duration_s=config['max_speech_duration_s'],
+            min_silence_duration_ms=config['min_silence_duration_ms'],
+            speech_pad_ms=config['speech_pad_ms'],
+        )
+
+    def __call__(self, samples):
+        from faster_whisper.vad import get_speech_timestamps
+
+        if not len(samples):
+            return []
+        chunks = get_speech_timestamps(samples, self.options, sampling_rate=SAMPLE_RATE)
+        return [(chunk['start'] / SAMPLE_RATE, chunk['end'] / SAMPLE_RATE) for chunk in chunks]
+
+
+class PyannoteVad:
+    def __init__(self, config):
+        from pyannote.audio import Model
+        from pyannote.audio.pipelines import VoiceActivityDetection
+
+        model = Model.from_pretrained(config.get('pyannote_model', 'pyannote/segmentation'),
+                                      use_auth_token=os.getenv('HF_TOKEN'))
+        self.pipeline = VoiceActivityDetection(segmentation=model)
+        self.pipeline.instantiate({
+            'onset': config['threshold'],
+            'offset': config['threshold'],
+            'min_duration_on': config['min_speech_duration_ms'] / 1000,
+            'min_duration_off': config['min_silence_duration_ms'] / 1000,
+        })
+        self.max_speech_duration_s = config['max_speech_duration_s']
+
+    def __call__(self, samples):
+        import torch
+
+        if not len(samples):
+            return []
+        annotation = self.pipeline({'waveform': torch.from_numpy(samples[None]), 'sample_rate': SAMPLE_RATE})
+        regions = [(segment.start, segment.end) for segment in annotation.get_timeline().support()]
+        return split_long_regions(regions, self.max_speech_duration_s)
+
+
+class NoVad:
+    """Treats the whole signal as one region, split at max_speech_duration_s."""
+
+    def __init__(self, config):
+        self.max_speech_duration_s = config['max_speech_duration_s']
+
+    def __call__(self, samples):
+        if not len(samples):
+            return []
+        return split_long_regions([(0.0, len(samples) / SAMPLE_RATE)], self.max_speech_duration_s)
+
+
+class EnergyGate:
+    """Finds the stretches of a signal that may hold speech, from frame energy and zero crossings.
+
+    A 20 ms frame is active when its level reaches gate_threshold_db dBFS
+    and, unless it is GATE_LOUD_DB louder still, its zero-crossing rate
+    stays under gate_max_zcr, which leaves out faint line hiss. Active
+    frames are widened by gate_pad_ms on both sides so quiet word onsets
+    and fricatives next to them are kept. Everything is computed on whole
+    arrays, so dead air costs a few vector operations instead of a neural
+    network pass.
+    """
+
+    def __init__(self, config):
+        self.threshold = 10 ** (config['gate_threshold_db'] / 20)
+        self.loud = 10 ** ((config['gate_threshold_db'] + GATE_LOUD_DB) / 20)
+        self.max_zcr = config['gate_max_zcr']
+        self.pad_frames = int(config['gate_pad_ms'] / 1000 * SAMPLE_RATE / GATE_FRAME)
+
+    def __call__(self, samples):
+        count = len(samples) // GATE_FRAME
+        if not count:
+            return [(0.0, len(samples) / SAMPLE_RATE)] if len(samples) else []
+        frames = samples[:count * GATE_FRAME].reshape(count, GATE_FRAME)
+        rms = np.sqrt(np.einsum('ij,ij->i', frames, frames) / GATE_FRAME)
+        zcr = np.count_nonzero(np.diff(np.signbit(frames), axis=1), axis=1) / GATE_FRAME
+        active = (rms >= self.threshold) & ((zcr <= self.max_zcr) | (rms >= self.loud))
+        if self.pad_frames:
+            active = binary_dilation(active, iterations=self.pad_frames)
+        # The partial frame at the end goes with the last whole one
+        edges = np.flatnonzero(np.diff(np.concatenate([[False], active, [False]]).astype(np.int8)))
+        end_of_signal = len(samples) / SAMPLE_RATE
+        return [(start * GATE_FRAME / SAMPLE_RATE, end_of_signal if end == count else end * GATE_FRAME / SAMPLE_RATE)
+                for start, end in zip(edges[::2], edges[1::2])]
+
+
+class GatedVad:
+    """Runs a VAD only over the stretches an EnergyGate lets through."""
+
+    def __init__(self, vad, gate):
+        self.vad = vad
+        self.gate = gate
+
+    def __call__(self, samples):
+        regions = []
+        for start, end in self.gate(samples):
+            offset = int(start * SAMPLE_RATE)
+            regions.extend((offset / SAMPLE_RATE + region_start, offset / SAMPLE_RATE + region_end)
+                           for region_start, region_end in self.vad(samples[offset:int(end * SAMPLE_RATE)]))
+        return regions
+
+
+VAD_BACKENDS = {
+    'silero': SileroVad,
+    'pyannote': PyannoteVad,
+    'none': NoVad,
+}
+
+
+def load_vad(config):
+    model = str(config.get('model') or 'none').lower()
+    if model not in VAD_BACKENDS:
+        raise ValueError(f"Unknown VAD model '{model}', expected one of: {', '.join(VAD_BACKENDS)}")
+    vad = VAD_BACKENDS[model](config)
+    return GatedVad(vad, EnergyGate(config)) if config['energy_gate'] else vad
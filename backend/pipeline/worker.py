@@ -0,0 +1,689 @@
+import os
+import re
+import json
+import time
+import random
+import logging
+import socket
+import argparse
+import traceback
+import multiprocessing
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import requests
+
+from api_client import BackendClient, ResultWriter
+from audio_io import SharedAudio, decoded_bytes, format_duration
+from batching import SegmentBatcher
+from config import (
+    INPUT_DIR, CACHE_DIR, BACKEND_URL, RECOGNIZER, WHISPER_MODEL, CASCADE_FAST_MODEL, CASCADE_MIN_CONFIDENCE,
+    LANGUAGE_PROFILE_CONFIDENCE, CREATED_BY, DEFAULT_CIRCUIT, AUDIO_EXTENSIONS, available_cpus, config_hash, load_vad_config,
+    load_whisper_config, load_worker_config
+)
+from cpu_topology import pin_process
+from fingerprint import FINGERPRINT_REUSE_RATIO, FingerprintIndex, fingerprint
+from model_store import models_in_use, preload
+from recognizer import load_recognizer
+from transcribe import Transcriber, chunk_regions, select_channel
+from transcript import merge_lines, shift_lines
+from transcript_cache import content_hash, get_cached, put_cached, evict_to_budget
+from vad import load_vad
+
+logger = logging.getLogger('pipeline')
+
+# Process and thread counts found by tune_workers.py, unless set here
+TUNED = load_worker_config()
+WORKERS = int(os.getenv('WORKERS', '0')) or TUNED['workers'] or available_cpus()
+RECOGNIZER_THREADS = int(os.getenv('RECOGNIZER_THREADS', '0')) or TUNED['recognizer_threads'] or 1
+POLL_INTERVAL = float(os.getenv('POLL_INTERVAL', '5'))
+BATCH_SIZE = int(os.getenv('BATCH_SIZE', '20'))
+FLUSH_INTERVAL = float(os.getenv('FLUSH_INTERVAL', '10'))
+# Recordings longer than this are split at speech boundaries and the chunks transcribed in parallel
+CHUNK_SECONDS = float(os.getenv('CHUNK_SECONDS', '120'))
+# Segments per recognizer call, above 1 segments from all queued recordings are batched together
+RECOGNIZER_BATCH = int(os.getenv('RECOGNIZER_BATCH', '1'))
+# Longest a segment waits for its batch to fill up
+BATCH_LATENCY = float(os.getenv('BATCH_LATENCY', '2'))
+# Transcribe the L and R channels of stereo files at the same time, RECOGNIZER_THREADS is then per channel
+PARALLEL_CHANNELS = os.getenv('PARALLEL_CHANNELS', '0' if TUNED['parallel_channels'] is False else '1') == '1'
+# Pin every pool process to its own CPUs from the tuned split, only while the counts are the tuned ones
+PIN_WORKERS = os.getenv('PIN_WORKERS', '1') == '1'
+CPU_SETS = TUNED['cpu_sets'] if PIN_WORKERS and (WORKERS, RECOGNIZER_THREADS) == (
+    TUNED['workers'], TUNED['recognizer_threads']) else None
+# Reuse the transcript of near-duplicate recordings found through the fingerprint index
+FINGERPRINTS = os.getenv('FINGERPRINTS', '1') == '1'
+# Jobs are claimed from the transcription_jobs queue under a lease, renewed while they are worked on
+WORKER_ID = os.getenv('WORKER_ID') or f"{socket.gethostname()}-{os.getpid()}"
+LEASE_SECONDS = int(os.getenv('LEASE_SECONDS', '600'))
+MAX_ATTEMPTS = int(os.getenv('MAX_ATTEMPTS', '3'))
+LEDGER_PATH = os.path.join(CACHE_DIR, 'enqueued.json')
+# In cascade mode, records of these circuits and bookmarked or mplan records are patched by WHISPER_MODEL
+CASCADE_CIRCUITS = [circuit for circuit in os.getenv('CASCADE_CIRCUITS', '').split(',') if circuit]
+REFINE_INTERVAL = float(os.getenv('REFINE_INTERVAL', '60'))
+# Share of the files of circuits with a confident language profile that are detected anyway, so a circuit changing language is noticed
+LANGUAGE_RECHECK_RATE = float(os.getenv('LANGUAGE_RECHECK_RATE', '0.05'))
+LANGUAGE_PROFILE_REFRESH = float(os.getenv('LANGUAGE_PROFILE_REFRESH', '60'))
+# Store the VAD output of every file through the API and reuse it when the same audio is transcribed again
+SPEECH_SEGMENTS = os.getenv('SPEECH_SEGMENTS', '1') == '1'
+# Decoded audio of the files in flight is kept in shared memory up to this many bytes, so the pool
+# processes read it without decoding or copying it again. Files over the budget are decoded by each task
+SHARED_AUDIO_BYTES = int(os.getenv('SHARED_AUDIO_BYTES', str(1024 ** 3)))
+# Transcribe a second of silence when a worker process starts, so the first recording does not wait on setup
+MODEL_WARM_UP = os.getenv('MODEL_WARM_UP', '1') == '1'
+
+START_TIME_PATTERN = re.compile(r'(\d{8})[_\-T]?(\d{6})')
+
+# Set in each pool process by init_worker, models are loaded once per process
+_transcriber = None
+_config_key = None
+_fingerprints = None
+_speech_key = None
+_client = None
+
+
+def transcription_model():
+    # Stored with every record as stt_model
+    if RECOGNIZER == 'cascade':
+        return f"{CASCADE_FAST_MODEL}+{WHISPER_MODEL}"
+    return WHISPER_MODEL if RECOGNIZER == 'whisper' else RECOGNIZER
+
+
+def transcription_config_key():
+    # Everything that changes the transcript of the same audio
+    cascade = (CASCADE_MIN_CONFIDENCE,) if RECOGNIZER == 'cascade' else ()
+    return config_hash(transcription_model(), *cascade, load_vad_config(), load_whisper_config())
+
+
+def speech_config_key():
+    # Everything that changes the speech regions found in the same audio
+    whisper_config = load_whisper_config()
+    return config_hash(load_vad_config(), whisper_config['use_vad'], whisper_config['fake_stereo_threshold'])
+
+
+def init_worker(recognizer_name, recognizer_threads, batch_size, parallel_channels, config_key, speech_key,
+                cpu_sets=None, counter=None):
+    global _transcriber, _config_key, _fingerprints, _speech_key, _client
+    # Before the model is loaded, so its threads inherit the CPUs
+    cpus = pin_process(cpu_sets, counter)
+    if cpus:
+        logger.info("Pinned worker process %d to CPUs %s", os.getpid(), cpus)
+    _config_key = config_key
+    if FINGERPRINTS:
+        _fingerprints = FingerprintIndex()
+    if SPEECH_SEGMENTS:
+        _speech_key = speech_key
+        _client = BackendClient(BACKEND_URL)
+    recognizer = load_recognizer(recognizer_name, cpu_threads=recognizer_threads,
+                                 num_workers=2 if parallel_channels else 1)
+    if MODEL_WARM_UP:
+        recognizer.warm_up()
+    _transcriber = Transcriber(recognizer, load_vad(load_vad_config()), load_whisper_config(),
+                               batch_size, parallel_channels)
+
+
+def find_duplicate(path, prints, stereo, duration):
+    """Looks the recording up in the fingerprint index.
+
+    Returns the duplicate_of/duplicate_offset link to the original, or None,
+    and the original's transcript moved to this recording's times when it
+    is cached, has the same channel layout, covers the whole recording and
+    most of this recording's hashes match it, see FINGERPRINT_REUSE_RATIO.
+    """
+    # A file indexed before, e.g. an older version of it, is not its own duplicate
+    match = _fingerprints.lookup(prints, exclude=path)
+    if match is None:
+        return None, None
+    link = {'duplicate_of': match['audio_file_path'], 'duplicate_offset': round(match['offset'], 2)}
+    if match['matches'] < FINGERPRINT_REUSE_RATIO * len(prints):
+        # Only part of the recording is shared, it is linked but transcribed itself
+        return link, None
+    original = get_cached(match['content_hash'], _config_key)
+    covered = match['offset'] > -1 and match['offset'] + duration < match['duration'] + 1
+    if original is None or original['stereo'] != stereo or not covered:
+        return link, None
+    return link, '\n'.join(shift_lines(original['stt_transcript'].splitlines(), match['offset'], duration))
+
+
+def stored_speech(digest):
+    # Speech regions of an earlier VAD run over the same audio, None to run the VAD
+    if _client is None:
+        return None
+    try:
+        return _client.speech_segments(digest, _speech_key)
+    except requests.RequestException:
+        logger.exception("Looking up the speech segments of %s failed", digest)
+        return None
+
+
+def plan_path(path, language=None, handle=None):
+    """Plans the transcription of a file, see Transcriber.plan_channels.
+
+    With a handle, the file is decoded into its shared memory, where the
+    segment tasks find it, and the record carries the handle as 'audio'.
+    """
+    # Identical audio transcribed with the same settings before is served from the cache
+    digest = content_hash(path)
+    record = get_cached(digest, _config_key)
+    if record is not None:
+        # The VAD output cached with the transcript is sent again when the API has none for the audio, so skip
+        # silence playback works for every copy of it
+        stored = record.get('speech') is None or stored_speech(digest) is not None
+        return {**record, 'content_hash': digest, 'cached': True, 'speech_stored': stored}
+
+    if handle is None:
+        channels, duration = _transcriber.load_channels(path)
+        return plan_audio(path, channels, duration, digest, language)
+    with SharedAudio.attach(handle) as audio:
+        audio.decode(path)
+        if _transcriber.is_fake_stereo(audio.channels):
+            audio.downmix()
+        return {**plan_audio(path, audio.channels, audio.duration, digest, language), 'audio': audio.handle}
+
+
+def plan_audio(path, channels, duration, digest, language):
+    extra = {'content_hash': digest, 'cached': False}
+    if _fingerprints is not None:
+        prints = fingerprint(select_channel(channels, 'B'))
+        link, transcript = find_duplicate(path, prints, channels.shape[1] == 2, duration)
+        if transcript is not None:
+            return {'stt_transcript': transcript, 'duration': format_duration(duration),
+                    'stereo': channels.shape[1] == 2, **link, **extra}
+        # Only recordings that were transcribed themselves go into the index
+        extra.update(link or {})
+        extra['fingerprint'] = {'prints': prints, 'duration': duration}
+
+    speech = stored_speech(digest)
+    extra['speech_stored'] = speech is not None
+    # With batching every file is split into segments, so short files are batched too
+    record = _transcriber.plan_channels(channels, duration, None if RECOGNIZER_BATCH > 1 else CHUNK_SECONDS,
+                                        language, speech)
+    return {**record, **extra}
+
+
+def transcribe_segments(items, languages, handles):
+    attached = {}
+    for path, handle in handles.items():
+        try:
+            attached[path] = SharedAudio.attach(handle)
+        except FileNotFoundError:
+            # The file failed meanwhile and its audio is gone, its items are decoded again and their lines dropped
+            pass
+    try:
+        return _transcriber.transcribe_segments(items, languages,
+                                                {path: audio.channels for path, audio in attached.items()})
+    finally:
+        for audio in attached.values():
+            audio.close()
+
+
+def refine_transcript(path, transcript):
+    # Only reached in cascade mode, every line is redone by the accurate model
+    return '\n'.join(_transcriber.patch_lines(path, transcript.splitlines(), _transcriber.recognizer.accurate))
+
+
+def chunk_segments(path, segments):
+    # One task per chunk of consecutive speech regions of a channel, L and R chunks interleaved by time
+    chunks = []
+    for prefix in sorted({prefix for prefix, _, _ in segments}):
+        regions = [(start, end) for p, start, end in segments if p == prefix]
+        chunks.extend([(path, prefix, start, end) for start, end in chunk] for chunk in chunk_regions(regions, CHUNK_SECONDS))
+    return sorted(chunks, key=lambda items: items[0][2])
+
+
+def load_ledger():
+    # path -> "size:mtime" of every file already enqueued, enqueueing again is harmless but wasted
+    if os.path.exists(LEDGER_PATH):
+        with open(LEDGER_PATH) as f:
+            return json.load(f)
+    return {}
+
+
+def save_ledger(ledger):
+    os.makedirs(os.path.dirname(LEDGER_PATH), exist_ok=True)
+    tmp_path = LEDGER_PATH + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(ledger, f)
+    os.replace(tmp_path, LEDGER_PATH)
+
+
+def file_signature(path):
+    stat = os.stat(path)
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def scan_input(input_dir, ledger, in_progress, last_seen):
+    """Yields (path, signature) for new or changed audio files.
+
+    A file is only picked up once its signature is unchanged between two
+    scans, so files still being copied into the directory are skipped.
+    """
+    for root, _, files in os.walk(input_dir):
+        for name in sorted(files):
+            if not name.lower().endswith(AUDIO_EXTENSIONS):
+                continue
+            path = os.path.join(root, name)
+            try:
+                signature = file_signature(path)
+            except FileNotFoundError:
+                continue
+            if ledger.get(path) == signature or path in in_progress:
+                continue
+            if last_seen.get(path) == signature:
+                del last_seen[path]
+                yield path, signature
+            else:
+                last_seen[path] = signature
+
+
+def parse_start_time(path):
+    match = START_TIME_PATTERN.search(os.path.basename(path))
+    if match:
+        try:
+            return datetime.strptime(''.join(match.groups()), '%Y%m%d%H%M%S')
+        except ValueError:
+            pass
+    return datetime.fromtimestamp(os.path.getmtime(path))
+
+
+def record_metadata(path, input_dir):
+    # input/<circuit>/<file>, files directly in input/ go to DEFAULT_CIRCUIT
+    relative = os.path.relpath(path, input_dir)
+    parts = relative.split(os.sep)
+    return {
+        'circuit': parts[0] if len(parts) > 1 else DEFAULT_CIRCUIT,
+        'audio_file_path': path,
+        'file_name': os.path.basename(path),
+        'start_time': parse_start_time(path).isoformat(),
+        'created_by': CREATED_BY,
+    }
+
+
+def job_for(path, signature, input_dir):
+    return {**record_metadata(path, input_dir), 'signature': signature, 'max_attempts': MAX_ATTEMPTS}
+
+
+class Ingestor:
+    """Moves files from the input directory through the job queue to user_data.
+
+    Every worker scans the input directory and enqueues what it finds, the
+    queue drops files that are already queued. Each worker then claims as
+    many jobs as it can work on, so any number of containers can share the
+    input directory. A job is completed once its record reached the API,
+    and a worker that dies leaves its jobs to be claimed again once their
+    lease runs out.
+    """
+
+    def __init__(self, pool, client, input_dir, config_key, speech_key):
+        self.pool = pool
+        self.client = client
+        self.input_dir = input_dir
+        self.config_key = config_key
+        self.speech_key = speech_key
+        self.stt_model = transcription_model()
+        self.writer = ResultWriter(client, BATCH_SIZE, FLUSH_INTERVAL)
+        self.batcher = SegmentBatcher(RECOGNIZER_BATCH, BATCH_LATENCY)
+        self.fingerprints = FingerprintIndex() if FINGERPRINTS else None
+        self.ledger = load_ledger()
+        self.last_seen = {}
+        # future -> path of a plan task, or the (path, prefix, start, end) items of a segments task
+        self.running = {}
+        # path -> job, record and outstanding segment count of files being transcribed
+        self.files = {}
+        # path -> job id of records waiting for their batch to be written
+        self.unflushed = {}
+        # path -> claimed jobs of newer versions of a file whose older version is still in progress, oldest first
+        self.deferred = {}
+        self.last_heartbeat = time.monotonic()
+        # future -> record of a refine task, and the audio files that could not be refined
+        self.refining = {}
+        self.unrefinable = set()
+        self.last_refine = 0
+        # circuit -> language profile, and the detections waiting to be sent with the next flush
+        self.profiles = {}
+        self.last_profiles = 0
+        self.detections = []
+        self.fixed_language = load_whisper_config()['language']
+        # VAD output of newly transcribed files, sent with the next flush
+        self.speech = []
+        # Bytes of shared memory held by the files in self.files
+        self.shared_bytes = 0
+
+    def enqueue_new(self):
+        found = list(scan_input(self.input_dir, self.ledger, set(self.files) | set(self.unflushed), self.last_seen))
+        if not found:
+            return
+        try:
+            enqueued = self.client.enqueue_jobs([job_for(path, signature, self.input_dir) for path, signature in found])
+        except requests.RequestException:
+            logger.exception("Enqueueing %d files failed, will retry", len(found))
+            return
+        logger.info("Found %d files, %d new to the queue", len(found), enqueued)
+        self.ledger.update(found)
+        save_ledger(self.ledger)
+
+    def claim(self):
+        # Keep twice as many files in flight as there are processes, so the pool never waits on the API
+        capacity = 2 * WORKERS - len(self.files) - sum(map(len, self.deferred.values()))
+        if capacity <= 0:
+            return 0
+        try:
+            jobs = self.client.claim_jobs(WORKER_ID, capacity, LEASE_SECONDS)
+        except requests.RequestException:
+            logger.exception("Claiming jobs failed")
+            return 0
+        for job in jobs:
+            path = job['audio_file_path']
+            if path in self.files or path in self.unflushed or path in self.deferred:
+                # An older version of the file is still being worked on here, the job stays claimed until it is done.
+                # Releasing it would count an attempt and hand it straight back to this worker
+                self.deferred.setdefault(path, []).append(job)
+                continue
+            self.start(job)
+        return len(jobs)
+
+    def start(self, job):
+        path = job['audio_file_path']
+        audio = self.share_audio(path)
+        self.files[path] = {'job': job, 'record': None, 'lines': [], 'remaining': 0, 'audio': audio, 'handle': None}
+        self.running[self.pool.submit(plan_path, path, self.job_language(job), audio and audio.handle)] = path
+
+    def start_deferred(self):
+        for path in [path for path in self.deferred if path not in self.files and path not in self.unflushed]:
+            jobs = self.deferred[path]
+            self.start(jobs.pop(0))
+            if not jobs:
+                del self.deferred[path]
+
+    def share_audio(self, path):
+        """Shared memory for the decoded audio of a file, None when it does not fit SHARED_AUDIO_BYTES."""
+        try:
+            if self.shared_bytes + decoded_bytes(path) > SHARED_AUDIO_BYTES:
+                return None
+            audio = SharedAudio.create(path)
+        except (RuntimeError, OSError):
+            # The plan task decodes the file itself, and fails with the decoder's error if it is unreadable
+            return None
+        self.shared_bytes += audio.nbytes
+        return audio
+
+    def unshare_audio(self, state):
+        if state['audio'] is not None:
+            self.shared_bytes -= state['audio'].nbytes
+            state['audio'].unlink()
+            state['audio'] = None
+
+    def job_language(self, job):
+        """The language of a job's circuit when its profile is confident, None to detect it."""
+        if self.fixed_language:
+            return None
+        if time.monotonic() - self.last_profiles >= LANGUAGE_PROFILE_REFRESH:
+            self.last_profiles = time.monotonic()
+            try:
+                self.profiles = {profile['circuit']: profile for profile in self.client.language_profiles()}
+            except requests.RequestException:
+                logger.exception("Fetching language profiles failed, keeping the last ones")
+        profile = self.profiles.get(job['circuit'])
+        if profile is None or profile['confidence'] < LANGUAGE_PROFILE_CONFIDENCE:
+            return None
+        return None if random.random() < LANGUAGE_RECHECK_RATE else profile['language']
+
+    def segment_languages(self, items):
+        return {path: self.files[path]['record'].get('language') for path in {item[0] for item in items}}
+
+    def segment_audio(self, items):
+        # Shared memory handles of the files decoded by their plan task
+        paths = {item[0] for item in items} & set(self.files)
+        return {path: self.files[path]['handle'] for path in paths if self.files[path]['handle'] is not None}
+
+    def release(self, job_id, error):
+        try:
+            self.client.fail_job(job_id, WORKER_ID, error)
+        except requests.RequestException:
+            # The lease runs out and the job is claimed again
+            logger.exception("Releasing job %s failed", job_id)
+
+    def fail(self, path):
+        logger.exception("Transcribing %s failed", path)
+        state = self.files.pop(path)
+        self.unshare_audio(state)
+        self.release(state['job']['id'], traceback.format_exc(limit=5))
+
+    def finish(self, path):
+        state = self.files.pop(path)
+        self.unshare_audio(state)
+        record = state['record']
+        record.pop('segments', None)
+        digest, cached = record.pop('content_hash'), record.pop('cached')
+        speech, stored = record.pop('speech', None), record.pop('speech_stored', True)
+        if SPEECH_SEGMENTS and speech is not None and not stored:
+            self.speech.append({'content_hash': digest, 'vad_config': self.speech_key, 'audio_file_path': path,
+                                'segments': [[prefix, round(start, 3), round(end, 3)] for prefix, start, end in speech]})
+        prints = record.pop('fingerprint', None)
+        language, probability = record.pop('language', None), record.pop('language_probability', None)
+        if language is not None and probability is not None:
+            # Only detections feed the profile, not languages that were assumed
+            self.detections.append({'circuit': state['job']['circuit'], 'language': language,
+                                    'probability': probability})
+        if 'stt_transcript' not in record:
+            # Tasks finish in any order, sorting first keeps L before R on equal start times
+            record['stt_transcript'] = '\n'.join(merge_lines(sorted(state['lines'])))
+        if cached:
+            logger.info("Reused the cached transcript of %s", path)
+        else:
+            put_cached(digest, self.config_key, {**record, 'speech': speech})
+            evict_to_budget()
+        if prints is not None:
+            self.fingerprints.add(path, digest, prints['duration'], record['stereo'], prints['prints'])
+        elif record.get('duplicate_of') and not cached:
+            logger.info("Reused the transcript of %s for its duplicate %s", record['duplicate_of'], path)
+
+        job = state['job']
+        metadata = {key: job[key] for key in ('circuit', 'audio_file_path', 'file_name', 'start_time', 'created_by')}
+        self.writer.add({**metadata, **record, 'stt_model': self.stt_model})
+        self.unflushed[path] = job['id']
+
+    def plan_done(self, path, future):
+        try:
+            record = future.result()
+        except Exception:
+            self.fail(path)
+            return
+        state = self.files[path]
+        state['record'] = record
+        state['handle'] = record.pop('audio', None)
+        segments = record.get('segments', [])
+        state['remaining'] = len(segments)
+        if RECOGNIZER_BATCH > 1:
+            self.batcher.add((path, prefix, start, end) for prefix, start, end in segments)
+        else:
+            for items in chunk_segments(path, segments):
+                future = self.pool.submit(transcribe_segments, items, self.segment_languages(items),
+                                          self.segment_audio(items))
+                self.running[future] = items
+        if not segments:
+            self.finish(path)
+
+    def segments_done(self, items, future):
+        try:
+            results = future.result()
+        except Exception:
+            paths = {item[0] for item in items} & set(self.files)
+            if len(paths) > 1:
+                # One unreadable file must not fail the others batched with it, each file is retried on its own
+                logger.exception("Transcribing a batch of %d files failed, retrying them one by one", len(paths))
+                for path in paths:
+                    retry = [item for item in items if item[0] == path]
+                    future = self.pool.submit(transcribe_segments, retry, self.segment_languages(retry),
+                                              self.segment_audio(retry))
+                    self.running[future] = retry
+                return
+            for path in paths:
+                self.fail(path)
+            return
+        for (path, _, _, _), lines in zip(items, results):
+            if path not in self.files:
+                # Another task of this file already failed
+                continue
+            state = self.files[path]
+            state['lines'].extend(lines)
+            state['remaining'] -= 1
+            if not state['remaining']:
+                self.finish(path)
+
+    def flush(self, force=False):
+        # Jobs only complete once their record reached the API
+        flushed = self.writer.flush() if force else self.writer.maybe_flush()
+        ids = [self.unflushed.pop(record['audio_file_path']) for record in flushed]
+        if ids:
+            try:
+                self.client.complete_jobs(WORKER_ID, ids)
+            except requests.RequestException:
+                # Harmless, the jobs are claimed again once their lease runs out and the upsert repeats
+                logger.exception("Completing %d jobs failed", len(ids))
+        if self.detections and (flushed or force):
+            try:
+                self.client.add_language_detections(self.detections)
+            except requests.RequestException:
+                # Profiles only need a sample of the detections
+                logger.exception("Sending %d language detections failed", len(self.detections))
+            self.detections = []
+        if self.speech and (flushed or force):
+            try:
+                self.client.add_speech_segments(self.speech)
+            except requests.RequestException:
+                # Only costs a VAD run when the audio is transcribed again
+                logger.exception("Sending the speech segments of %d files failed", len(self.speech))
+            self.speech = []
+
+    def refine(self):
+        """Patches records that need the accurate model of the cascade, a few at a time.
+
+        Bookmarks and mplan flags are set by operators after ingestion, so
+        records are looked up again every REFINE_INTERVAL. Records of
+        CASCADE_CIRCUITS are patched on the first lookup after they are written.
+        """
+        if RECOGNIZER != 'cascade' or self.refining or time.monotonic() - self.last_refine < REFINE_INTERVAL:
+            return
+        self.last_refine = time.monotonic()
+        try:
+            records = self.client.records_to_refine(WHISPER_MODEL, CASCADE_CIRCUITS, self.input_dir, CREATED_BY,
+                                                    WORKERS + len(self.unrefinable))
+        except requests.RequestException:
+            logger.exception("Looking up records to refine failed")
+            return
+        # Records that failed before would otherwise take the first places of every lookup for good
+        records = [record for record in records if record['audio_file_path'] not in self.unrefinable]
+        for record in records[:WORKERS]:
+            future = self.pool.submit(refine_transcript, record['audio_file_path'], record['stt_transcript'])
+            self.refining[future] = record
+
+    def refine_done(self, record, future):
+        path = record['audio_file_path']
+        try:
+            transcript = future.result()
+            refined = self.client.refine_record(record, transcript, WHISPER_MODEL)
+        except Exception:
+            logger.exception("Refining %s failed", path)
+            self.unrefinable.add(path)
+            return
+        if refined:
+            logger.info("Refined %s with %s", path, WHISPER_MODEL)
+        # Patched records drop out of the lookup, look again for more right away
+        self.last_refine = 0
+
+    def heartbeat(self):
+        if time.monotonic() - self.last_heartbeat < LEASE_SECONDS / 3:
+            return
+        self.last_heartbeat = time.monotonic()
+        ids = ([state['job']['id'] for state in self.files.values()] + list(self.unflushed.values())
+               + [job['id'] for jobs in self.deferred.values() for job in jobs])
+        if not ids:
+            return
+        try:
+            extended = self.client.heartbeat_jobs(WORKER_ID, ids, LEASE_SECONDS)
+        except requests.RequestException:
+            logger.exception("Renewing %d leases failed", len(ids))
+            return
+        if extended < len(ids):
+            logger.warning("%d of %d leases were lost to other workers", len(ids) - extended, len(ids))
+
+    def close(self):
+        # Shared memory outlives the process unless it is unlinked
+        for state in self.files.values():
+            self.unshare_audio(state)
+
+    def step(self, once=False):
+        """One round of scanning, claiming and collecting results, returns False once done in once mode."""
+        self.enqueue_new()
+        claimed = self.claim()
+
+        if not once:
+            self.refine()
+
+        timeout = POLL_INTERVAL if self.batcher.timeout() is None else min(POLL_INTERVAL, self.batcher.timeout())
+        if self.running or self.refining:
+            done, _ = wait([*self.running, *self.refining], timeout=timeout, return_when=FIRST_COMPLETED)
+        else:
+            done = set()
+            if not once or len(self.batcher):
+                time.sleep(timeout)
+
+        for future in done:
+            if future in self.refining:
+                self.refine_done(self.refining.pop(future), future)
+                continue
+            task = self.running.pop(future)
+            if isinstance(task, str):
+                self.plan_done(task, future)
+            else:
+                self.segments_done(task, future)
+
+        # Partial batches go out once their oldest segment waited BATCH_LATENCY
+        for items in self.batcher.ready():
+            future = self.pool.submit(transcribe_segments, items, self.segment_languages(items),
+                                      self.segment_audio(items))
+            self.running[future] = items
+
+        self.flush()
+        self.start_deferred()
+        self.heartbeat()
+
+        if (once and not claimed and not self.running and not self.files and not self.deferred and not self.last_seen
+                and not len(self.batcher)):
+            self.flush(force=True)
+            return bool(self.unflushed)
+        return True
+
+
+def run(input_dir=INPUT_DIR, once=False):
+    config_key, speech_key = transcription_config_key(), speech_config_key()
+    logger.info("Watching %s as %s with %d workers of %d threads", input_dir, WORKER_ID, WORKERS, RECOGNIZER_THREADS)
+    if TUNED['model'] and TUNED['model'] != transcription_model():
+        logger.warning("Workers were tuned for %s, run tune_workers.py again for %s", TUNED['model'], transcription_model())
+    # Fetched and verified once here, the worker processes then load them from disk
+    for name, directory in preload(models_in_use(RECOGNIZER)).items():
+        logger.info("Model %s from %s", name, directory)
+    with ProcessPoolExecutor(max_workers=WORKERS, initializer=init_worker,
+                             initargs=(RECOGNIZER, RECOGNIZER_THREADS, RECOGNIZER_BATCH, PARALLEL_CHANNELS,
+                                       config_key, speech_key, CPU_SETS, multiprocessing.Value('i', 0))) as pool:
+        ingestor = Ingestor(pool, BackendClient(BACKEND_URL), input_dir, config_key, speech_key)
+        try:
+            while ingestor.step(once):
+                pass
+        finally:
+            ingestor.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Transcribe audio files dropped into the input directory')
+    parser.add_argument('--input', default=INPUT_DIR, help='directory to watch, one subdirectory per circuit')
+    parser.add_argument('--once', action='store_true', help='process the files currently present and exit')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(levelname)s %(message)s')
+    run(args.input, args.once)
+
+
+if __name__ == '__main__':
+    main()
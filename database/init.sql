@@ -10,10 +10,13 @@
 -- =============================================================================
 -- CREATE TABLES
 -- =============================================================================
--- This section creates two tables: 'user_data' and 'keywords' in the 'public'
--- schema. The 'user_data' table stores information related to user interactions,
--- while the 'keywords' table holds keywords associated with different services
--- and users.
+-- This section creates the tables in the 'public' schema. The 'user_data' table
+-- stores information related to user interactions, while the 'keywords' table
+-- holds keywords associated with different services and users. 'wer_stats'
+-- holds data derived from 'user_data', 'transcription_jobs' is the work queue
+-- of the ingestion pipeline and 'circuit_schedule' sets how it is shared.
+-- 'language_profiles' holds the languages the pipeline detected per circuit
+-- and 'speech_segments' the speech its VAD found in each recording.
 -- =============================================================================
 -- Create user_data table
 CREATE TABLE IF NOT EXISTS public.user_data (
@@ -39,9 +42,21 @@ CREATE TABLE IF NOT EXISTS public.user_data (
     mplan TEXT,
     created_by TEXT,
     stereo BOOLEAN DEFAULT FALSE,
+    -- Set by the ingestion pipeline when the audio is a near-duplicate of
+    -- another recording: its audio_file_path and where this one starts in it
+    duplicate_of TEXT,
+    duplicate_offset REAL,
+    -- Model that produced stt_transcript, e.g. 'base+large-v2' for a cascade
+    stt_model TEXT,
     PRIMARY KEY(circuit, start_time, file_name, created_by)
 );
 
+-- Columns added after the first release, CREATE TABLE IF NOT EXISTS leaves
+-- the user_data of an existing database without them
+ALTER TABLE public.user_data ADD COLUMN IF NOT EXISTS duplicate_of TEXT;
+ALTER TABLE public.user_data ADD COLUMN IF NOT EXISTS duplicate_offset REAL;
+ALTER TABLE public.user_data ADD COLUMN IF NOT EXISTS stt_model TEXT;
+
 -- Create keywords table
 CREATE TABLE IF NOT EXISTS public.keywords (
     keyword TEXT,
@@ -51,6 +66,127 @@ CREATE TABLE IF NOT EXISTS public.keywords (
     PRIMARY KEY(keyword, priority_, service_, created_by)
 );
 
+-- Create wer_stats table
+-- Per-record, per-channel WER counts. gt_hash/stt_hash are md5 of the
+-- transcripts the row was computed from; a mismatch with user_data means the
+-- row is stale and gets recomputed on the next refresh.
+CREATE TABLE IF NOT EXISTS public.wer_stats (
+    circuit TEXT,
+    start_time TIMESTAMP,
+    file_name TEXT,
+    created_by TEXT,
+    prefix TEXT,
+    gt_hash TEXT,
+    stt_hash TEXT,
+    hits INT,
+    substitutions INT,
+    insertions INT,
+    deletions INT,
+    confusion_pairs JSONB,
+    computed_at TIMESTAMP,
+    PRIMARY KEY(circuit, start_time, file_name, created_by, prefix)
+);
+
+-- Create transcription_jobs table
+-- One row per version (size:mtime signature) of an audio file. Workers claim
+-- queued jobs with FOR UPDATE SKIP LOCKED and hold them under a lease; a job
+-- whose lease runs out is claimed again until it reaches max_attempts.
+CREATE TABLE IF NOT EXISTS public.transcription_jobs (
+    id BIGSERIAL PRIMARY KEY,
+    audio_file_path TEXT NOT NULL,
+    signature TEXT NOT NULL,
+    circuit TEXT,
+    file_name TEXT,
+    start_time TIMESTAMP,
+    created_by TEXT,
+    priority INT DEFAULT 0,
+    state TEXT DEFAULT 'queued' CHECK (state IN ('queued', 'running', 'done', 'failed')),
+    attempts INT DEFAULT 0,
+    max_attempts INT DEFAULT 3,
+    lease_owner TEXT,
+    lease_expires TIMESTAMP,
+    last_error TEXT,
+    enqueued_at TIMESTAMP DEFAULT now(),
+    started_at TIMESTAMP,
+    finished_at TIMESTAMP,
+    UNIQUE(audio_file_path, signature)
+);
+
+CREATE INDEX IF NOT EXISTS transcription_jobs_claim_idx ON public.transcription_jobs (circuit, priority DESC, enqueued_at)
+WHERE
+    state IN ('queued', 'running');
+
+-- Create circuit_schedule table
+-- Share of the ingestion workers given to each circuit. Circuits without a
+-- row have weight 1; express circuits are claimed before all others.
+CREATE TABLE IF NOT EXISTS public.circuit_schedule (
+    circuit TEXT PRIMARY KEY,
+    weight REAL DEFAULT 1 CHECK (weight > 0),
+    express BOOLEAN DEFAULT FALSE
+);
+
+-- Create language_profiles table
+-- The last languages detected on each circuit, newest last. Once a profile is
+-- confident, the files of its circuit skip language detection, apart from a
+-- sample that keeps checking for drift.
+CREATE TABLE IF NOT EXISTS public.language_profiles (
+    circuit TEXT PRIMARY KEY,
+    language TEXT,
+    confidence REAL,
+    detections JSONB DEFAULT '[]',
+    updated_at TIMESTAMP
+);
+
+-- Create speech_segments table
+-- VAD output per recording content and VAD settings, a JSON list of
+-- [channel, start, end] in seconds. Transcribing the same audio again, e.g.
+-- with another model, skips the VAD, and playback can skip the silence.
+CREATE TABLE IF NOT EXISTS public.speech_segments (
+    content_hash TEXT,
+    vad_config TEXT,
+    audio_file_path TEXT,
+    segments JSONB DEFAULT '[]',
+    created_at TIMESTAMP DEFAULT now(),
+    PRIMARY KEY (content_hash, vad_config)
+);
+
+-- Create keyword_versions table
+-- Moved forward by a trigger whenever an owner's keywords change, so the apps
+-- keep the keyword list and only fetch it again once its version moved. The
+-- version is a microsecond timestamp, it keeps growing when the table is
+-- created again.
+CREATE TABLE IF NOT EXISTS public.keyword_versions (
+    owner TEXT PRIMARY KEY,
+    version BIGINT NOT NULL,
+    updated_at TIMESTAMP DEFAULT now()
+);
+
+-- Runs as its owner, users change keywords but cannot write versions themselves
+CREATE OR REPLACE FUNCTION public.bump_keyword_version() RETURNS TRIGGER
+LANGUAGE plpgsql SECURITY DEFINER SET search_path = public AS $$
+DECLARE
+    owners TEXT[] := ARRAY[]::TEXT[];
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        owners := owners || lower(OLD.created_by);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        owners := owners || lower(NEW.created_by);
+    END IF;
+    INSERT INTO keyword_versions AS v (owner, version, updated_at)
+    SELECT DISTINCT o, (extract(epoch FROM clock_timestamp()) * 1000000)::BIGINT, now() FROM unnest(owners) AS o
+    ON CONFLICT (owner) DO UPDATE SET
+        version = GREATEST(v.version + 1, EXCLUDED.version),
+        updated_at = EXCLUDED.updated_at;
+    RETURN NULL;
+END $$;
+
+DROP TRIGGER IF EXISTS keywords_version_trigger ON public.keywords;
+
+CREATE TRIGGER keywords_version_trigger
+AFTER INSERT OR UPDATE OR DELETE ON public.keywords
+FOR EACH ROW EXECUTE FUNCTION public.bump_keyword_version();
+
 -- =============================================================================
 -- CREATE USERS AND SCHEMAS
 -- =============================================================================
@@ -309,11 +445,19 @@ UPDATE
     DELETE ON TABLE public.keywords TO user1,
     user2;
 
+GRANT
+INSERT
+,
+UPDATE
+,
+    DELETE ON TABLE public.wer_stats TO user1,
+    user2;
+
 -- =============================================================================
 -- ENABLE ROW LEVEL SECURITY (RLS) AND CREATE POLICIES
 -- =============================================================================
--- This section enables Row Level Security on the 'user_data' and 'keywords'
--- tables and defines policies to control access based on the 'created_by'
+-- This section enables Row Level Security on the 'user_data', 'keywords' and
+-- 'wer_stats' tables and defines policies to control access based on the 'created_by'
 -- field. Only the user who created a row can SELECT, INSERT, UPDATE, or DELETE
 -- it.
 -- =============================================================================
@@ -371,6 +515,33 @@ DROP POLICY IF EXISTS delete_keywords_policy ON public.keywords;
 
 CREATE POLICY delete_keywords_policy ON public.keywords FOR DELETE USING (lower(created_by) = lower(current_user));
 
+-- Enable RLS on wer_stats table
+ALTER TABLE
+    public.wer_stats ENABLE ROW LEVEL SECURITY;
+
+-- Create RLS policies for wer_stats
+DROP POLICY IF EXISTS select_wer_stats_policy ON public.wer_stats;
+
+CREATE POLICY select_wer_stats_policy ON public.wer_stats FOR
+SELECT
+    USING (lower(created_by) = lower(current_user));
+
+DROP POLICY IF EXISTS insert_wer_stats_policy ON public.wer_stats;
+
+CREATE POLICY insert_wer_stats_policy ON public.wer_stats FOR
+INSERT
+    WITH CHECK (lower(created_by) = lower(current_user));
+
+DROP POLICY IF EXISTS update_wer_stats_policy ON public.wer_stats;
+
+CREATE POLICY update_wer_stats_policy ON public.wer_stats FOR
+UPDATE
+    USING (lower(created_by) = lower(current_user));
+
+DROP POLICY IF EXISTS delete_wer_stats_policy ON public.wer_stats;
+
+CREATE POLICY delete_wer_stats_policy ON public.wer_stats FOR DELETE USING (lower(created_by) = lower(current_user));
+
 -- =============================================================================
 -- FINAL GRANT STATEMENTS AND COMMIT
 -- =============================================================================
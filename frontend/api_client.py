@@ -0,0 +1,124 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Seconds to connect and to wait for the response, a slow backend fails the callback instead of hanging a Gradio worker
+API_CONNECT_TIMEOUT = float(os.getenv('API_CONNECT_TIMEOUT', '3'))
+API_READ_TIMEOUT = float(os.getenv('API_READ_TIMEOUT', '30'))
+# Retries of idempotent requests after connection errors and 502/503/504, waiting API_BACKOFF seconds, doubling
+API_RETRIES = int(os.getenv('API_RETRIES', '2'))
+API_BACKOFF = float(os.getenv('API_BACKOFF', '0.5'))
+# Keep-alive connections per host, Gradio runs up to 40 callbacks at a time
+API_POOL_SIZE = int(os.getenv('API_POOL_SIZE', '40'))
+# GET responses kept for callers that pass a ttl
+API_CACHE_ENTRIES = int(os.getenv('API_CACHE_ENTRIES', '256'))
+
+
+class ResponseCache:
+    """GET responses by URL and parameters, the least recently used dropped past max_entries.
+
+    Entries outlive their ttl so their ETag or Last-Modified can be sent
+    with the next request for them.
+    """
+
+    def __init__(self, max_entries=API_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+
+    def put(self, key, response, ttl):
+        with self.lock:
+            # [response, expires]
+            self.entries[key] = [response, time.monotonic() + ttl]
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class ApiClient:
+    """requests with one keep-alive connection pool per process, timeouts, retries and a TTL cache.
+
+    Methods take full URLs and requests' keyword arguments and return the
+    requests.Response. Connection errors and timeouts that are left after
+    the retries raise requests.RequestException.
+    """
+
+    def __init__(self, timeout=(API_CONNECT_TIMEOUT, API_READ_TIMEOUT), retries=API_RETRIES, backoff=API_BACKOFF,
+                 pool_size=API_POOL_SIZE, cache_entries=API_CACHE_ENTRIES):
+        self.timeout = timeout
+        self.cache = ResponseCache(cache_entries)
+        # Only requests that can be sent twice are retried, POST and PATCH are not. Read timeouts are not
+        # retried either, a backend that is slow to answer would only be asked again
+        retry = Retry(total=retries, read=0, backoff_factor=backoff, status_forcelist=(502, 503, 504),
+                      allowed_methods=frozenset({'GET', 'HEAD', 'PUT', 'DELETE'}), raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        response = self.session.request(method, url, **kwargs)
+        if method != 'GET' and response.ok:
+            # Any write can change what the cached responses hold
+            self.cache.clear()
+        return response
+
+    def get(self, url, params=None, ttl=0, **kwargs):
+        """GET, answered from the cache for ttl seconds when ttl is given.
+
+        Once an entry expires, the request carries its ETag or Last-Modified
+        and a 304 answer renews it without the body being sent again.
+        """
+        if not ttl:
+            return self.request('GET', url, params=params, **kwargs)
+        key = (url, tuple(sorted((k, str(v)) for k, v in (params or {}).items() if v is not None)))
+        entry = self.cache.get(key)
+        if entry is not None and time.monotonic() < entry[1]:
+            return entry[0]
+
+        headers = dict(kwargs.pop('headers', None) or {})
+        if entry is not None:
+            if 'ETag' in entry[0].headers:
+                headers['If-None-Match'] = entry[0].headers['ETag']
+            if 'Last-Modified' in entry[0].headers:
+                headers['If-Modified-Since'] = entry[0].headers['Last-Modified']
+        response = self.request('GET', url, params=params, headers=headers, **kwargs)
+        if response.status_code == 304 and entry is not None:
+            self.cache.put(key, entry[0], ttl)
+            return entry[0]
+        if response.status_code == 200:
+            self.cache.put(key, response, ttl)
+        return response
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def patch(self, url, **kwargs):
+        return self.request('PATCH', url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request('PUT', url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('DELETE', url, **kwargs)
+
+
+# Shared by all callbacks of an app
+api = ApiClient()
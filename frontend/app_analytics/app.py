@@ -1,5 +1,5 @@
 import gradio as gr
-import requests
+from api_client import api
 import pandas as pd
 import os
 
@@ -18,7 +18,7 @@ def login(request: gr.Request):
     return result_json.get('u', None), result_json.get('p', None)
 
 def update_analytics(u, p):
-    response = requests.get(f"{API_URL}/get_all_user_data/", params={'user': u, 'password': p})
+    response = api.get(f"{API_URL}/get_all_user_data/", params={'user': u, 'password': p})
     df = pd.DataFrame(response.json()['data'])
     df['last_modified'] = pd.to_datetime(df['last_modified'].str.split('.').str[0])
     analytics_df = df.groupby('circuit').agg(
@@ -1,12 +1,18 @@
 import gradio as gr
 import pandas as pd
 import os
+import html
 from datetime import datetime
-import re
-import requests
-import soundfile as sf
+from api_client import api
+from keywords import KeywordCache
+from urllib.parse import urlencode
 
 API_URL = os.getenv('API_URL', 'http://localhost:8000')
+# Browser-facing API address, audio is streamed from there instead of through gradio
+AUDIO_URL = os.getenv('AUDIO_URL', 'http://localhost:8000')
+SNIPPET_MARGIN = 0.5
+# Waveform columns drawn above the B player
+WAVEFORM_BUCKETS = 800
 print(API_URL, '=======================')
 
 shortcut_js = """
@@ -14,6 +20,11 @@ shortcut_js = """
 function getAudioElement(elemId) {
     let elem = document.querySelector('#' + elemId);
     if (elem) {
+        // The players are plain <audio> elements, gr.Audio hides its element in a shadow root
+        let direct = elem.querySelector('audio');
+        if (direct) {
+            return direct;
+        }
         let waveformDiv = elem.querySelector('#waveform');
         if (waveformDiv) {
             let childDiv = waveformDiv.querySelector('div');
@@ -284,7 +295,7 @@ def add_user_data(base_url, circuit, audio_file_path, file_name, duration, stt_t
         "dst": dst,
         "m_plan": m_plan
     }
-    response = requests.post(f"{base_url}/add_user_data/", json=data, params={"user": u, "password": p})
+    response = api.post(f"{base_url}/add_user_data/", json=data, params={"user": u, "password": p})
     if response.status_code == 200:
         return response.json()
     
@@ -301,7 +312,7 @@ def get_filtered_user_data(base_url, circuit=None, operator_remark_contains=None
         'user': u,
         'password': p
     }
-    response = requests.get(f"{base_url}/filter_user_data/", params=params)
+    response = api.get(f"{base_url}/filter_user_data/", params=params)
     return response.json()
 
 def get_unique_values(base_url, column=None, u=None, p=None):
@@ -310,19 +321,45 @@ def get_unique_values(base_url, column=None, u=None, p=None):
         'user': u,
         'password': p
     }
-    response = requests.get(f"{base_url}/unique_values/", params=params)
+    # Dropdown choices, a minute old at most
+    response = api.get(f"{base_url}/unique_values/", params=params, ttl=60)
     return response.json()
 
+def get_speech_segments(base_url, primary_key, u, p):
+    # Speech regions the pipeline's VAD found in the file, None when it has none stored
+    params = {key: primary_key[key] for key in ('circuit', 'start_time', 'file_name')}
+    response = api.get(f"{base_url}/audio/speech_segments/", params={**params, 'user': u, 'password': p}, ttl=60)
+    return response.json() if response.ok else None
+
+def get_waveform(base_url, primary_key, u, p, channel='B'):
+    """SVG of the file's cached min/max peaks, one vertical line per bucket, '' when the API has none."""
+    params = {key: primary_key[key] for key in ('circuit', 'start_time', 'file_name')}
+    params.update({'channel': channel, 'buckets': WAVEFORM_BUCKETS, 'user': u, 'password': p})
+    response = api.get(f"{base_url}/audio/peaks/", params=params, ttl=60)
+    if not response.ok:
+        return ''
+    peaks = response.json()['peaks']
+    path = ' '.join(f"M{i} {1 - high:.3f}V{1 - low:.3f}" for i, (low, high) in enumerate(peaks))
+    return (f'<svg viewBox="0 0 {len(peaks)} 2" preserveAspectRatio="none" style="width: 100%; height: 48px">'
+            f'<path d="{path}" stroke="currentColor" vector-effect="non-scaling-stroke" fill="none"/></svg>')
+
 def update_user_data_partial(base_url, circuit, start_time, file_name, data, u=None, p=None):
     url = f"{base_url}/update_user_data_partial/"
     params = {"circuit": circuit, "start_time": start_time, "file_name": file_name, 'user': u, 'password': p}
-    response = requests.patch(url, json=data, params=params)
+    response = api.patch(url, json=data, params=params)
     return response.json()
 
 def get_all_keywords(base_url, u, p):
-    response = requests.get(f"{base_url}/get_all_keywords/", params={'user': u, 'password': p})
+    response = api.get(f"{base_url}/get_all_keywords/", params={'user': u, 'password': p})
+    return response.json()
+
+def get_keywords_version(base_url, u, p):
+    response = api.get(f"{base_url}/keywords/version/", params={'user': u, 'password': p})
     return response.json()
 
+# Keyword lists per user, checked against their version by the keyword timer only
+keyword_cache = KeywordCache(lambda u, p: get_all_keywords(API_URL, u, p), lambda u, p: get_keywords_version(API_URL, u, p))
+
 def get_dropdown_values(u, p):
     try:
         circuit = get_unique_values(base_url=API_URL,column='circuit', u=u, p=p)['unique_values']
@@ -382,78 +419,129 @@ def edit_transcript(edit_text_area_value, left_edit_text_area_value, right_edit_
     gr.Info('Edit transcript submitted')
 
     # Return highlight text to highlight
-    df = get_keyword(u, p)
-    print(df)
-    if df.empty:
+    keywords = keyword_cache.get(u, p)
+    if keywords.empty:
         return [(new_transcript, None)]
     
     else:
-        priority_one_list = df.loc[df['priority_'] == 1, 'keyword'].tolist()
-        priority_two_list = df.loc[df['priority_'] == 2, 'keyword'].tolist()
-        highlight_text = str_to_keyword_transcript(new_transcript, priority_one_list, priority_two_list)
+        highlight_text = keywords.highlight(new_transcript)
     return gr.Highlight(value=highlight_text)
 
-def str_to_keyword_transcript(sentence='hello this is a test', keyword1=['hello'], keyword2=['test']):
-    sentence = sentence.lower()
-    tokens = re.findall(r'\w+|\s+|[^\w\s]+', sentence)
-    highlighted_words = []
-    
-    for token in tokens:
-        symbol = None
-        if re.match(r'\w+', token):
-            if token in keyword1:
-                symbol = 'Priority 1'
-            elif token in keyword2:
-                symbol = 'Priority 2'
-        highlighted_words.append((token, symbol))
-    return highlighted_words
-
-def dataframe_to_keyword_transcript(df):
-    df = df.sort_values(by='priority_')
-    highlighted_words = [
-    (row['keyword'] + '\n', 'Priority 1' if row['priority_'] == 1 else 'Priority 2' if row['priority_'] == 2 else None)
-    for _, row in df.iterrows()
-    ]
-    return highlighted_words
-
-def get_keyword(u, p):
-    keywords = get_all_keywords(base_url=API_URL, u=u, p=p)
-    df = pd.DataFrame()
-    if 'data' in keywords and keywords['data']:
-        df = pd.DataFrame(keywords['data'])
-    return df
-
 def get_keyword_highlight(u = None, p = None):
     if u is None or p is None or isinstance(u, gr.components.State) or isinstance(p, gr.components.State):
         return [('No User or Password', 'Priority 1')]
-    df = get_keyword(u, p)
-    if df.empty:
+    # Runs on the keyword timer, the one place a changed keyword list is picked up
+    keywords = keyword_cache.refresh(u, p)
+    if keywords.empty:
         return [('No Keyword in Database','Priority 1')]
     else:
-        highlighted_text = dataframe_to_keyword_transcript(df)  
-        print(highlighted_text, 'ticker is running')  
-        return highlighted_text
-
-def split_to_mono(file_path):
-    data, sample_rate = sf.read(file_path)
-    if data.ndim != 2 or data.shape[1] != 2:
-        raise ValueError("The audio file must be stereo (2 channels)")
-    
-    left_channel = data[:, 0]
-    right_channel = data[:, 1]
-    
-    return (sample_rate, data), (sample_rate, left_channel), (sample_rate, right_channel)
+        return keywords.keyword_list()
 
-def update_audio_files(row_selected):
-    audio_file_path = row_selected['audio_file_path']
+def get_audio_url(primary_key, u, p, channel=None, preview=False, speech=False):
+    params = {
+        'circuit': primary_key['circuit'],
+        'start_time': primary_key['start_time'],
+        'file_name': primary_key['file_name'],
+        'user': u,
+        'password': p
+    }
+    if speech:
+        # Only the speech regions, back to back
+        params['channel'] = channel or 'B'
+        return f"{AUDIO_URL}/audio/speech/?{urlencode(params)}"
+    if preview:
+        # Low bitrate rendition cached by the API, for operators on slow links
+        params['channel'] = channel or 'B'
+        return f"{AUDIO_URL}/audio/preview/?{urlencode(params)}"
+    if channel:
+        params['channel'] = channel
+    return f"{AUDIO_URL}/audio/?{urlencode(params)}"
+
+def audio_player(url, label, autoplay=False):
+    # The browser fetches AUDIO_URL itself and streams it with Range requests. Given a URL,
+    # gr.Audio would have the gradio server download the whole file, from an address only the browser can reach
+    src = f' src="{html.escape(url)}"' if url else ''
+    return (f'<div class="audio-player"><span>{html.escape(label)}</span>'
+            f'<audio controls preload="none"{" autoplay" if autoplay else ""} style="width: 100%"{src}></audio></div>')
+
+def get_snippet_url(primary_key, u, p, start, end, channel='B'):
+    params = {
+        'circuit': primary_key['circuit'],
+        'start_time': primary_key['start_time'],
+        'file_name': primary_key['file_name'],
+        'start': start,
+        'end': end,
+        'margin': SNIPPET_MARGIN,
+        'channel': channel,
+        'user': u,
+        'password': p
+    }
+    return f"{AUDIO_URL}/audio/snippet/?{urlencode(params)}"
+
+def combine_adjacent(highlighted_words):
+    # Same merge gr.HighlightedText(combine_adjacent=True) applies, select indexes refer to it
+    combined = []
+    for text, category in highlighted_words:
+        if combined and combined[-1][1] == category:
+            combined[-1] = (combined[-1][0] + text, category)
+        elif combined and not text:
+            continue
+        else:
+            combined.append((text, category))
+    return combined
+
+def get_line_times(text, offset):
+    line_start = text.rfind('\n', 0, offset) + 1
+    line_end = text.find('\n', offset)
+    tokens = text[line_start:line_end if line_end != -1 else len(text)].split()
+    channel = 'B'
+    if tokens and tokens[0].upper() in ('L', 'R', 'B'):
+        channel = tokens[0].upper()
+        tokens = tokens[1:]
+    try:
+        return float(tokens[0]), float(tokens[1]), channel
+    except (IndexError, ValueError):
+        return None
+
+def play_transcript_line(evt: gr.SelectData, highlighted_words, primary_key, u, p):
+    # Clicking a word (e.g. a highlighted keyword) plays just the line it belongs to
+    if not highlighted_words or not primary_key:
+        return gr.update()
+    combined = combine_adjacent(highlighted_words)
+    offset = sum(len(text) for text, _ in combined[:evt.index])
+    line = get_line_times(''.join(text for text, _ in combined), offset)
+    if line is None:
+        return gr.update()
+    start, end, channel = line
+    return gr.HTML(audio_player(get_snippet_url(primary_key, u, p, start, end, channel), 'Selected Line', autoplay=True),
+                   visible=True)
+
+def update_audio_files(row_selected, u, p, preview=False, skip_silence=False):
+    if not row_selected:
+        return gr.update(), gr.update(visible=False), gr.update(visible=False)
     print(row_selected)
     stereo = row_selected.get('stereo', False)
+    if skip_silence:
+        speech = get_speech_segments(API_URL, row_selected, u, p)
+        if speech is None:
+            gr.Warning('No speech segments stored for this file, playing it in full')
+            skip_silence = False
+        else:
+            gr.Info(f"Playing {speech['speech_seconds']:.0f}s of speech out of {speech['duration']:.0f}s")
 
+    # The API serves the file with range support and extracts L/R server side,
+    # so nothing is decoded or re-encoded here
+    both_audio = get_audio_url(row_selected, u, p, preview=preview, speech=skip_silence)
+    # Drawn from a few KB of peaks before any audio is loaded. The speech rendition has a timeline of its own
+    waveform = '' if skip_silence else get_waveform(API_URL, row_selected, u, p)
     if stereo == True:
-        both_audio, left_audio, right_audio = split_to_mono(audio_file_path)
-        return gr.Audio(both_audio), gr.Audio(value=left_audio, visible=True), gr.Audio(value=right_audio, visible=True)
+        left_audio = get_audio_url(row_selected, u, p, channel='L', preview=preview, speech=skip_silence)
+        right_audio = get_audio_url(row_selected, u, p, channel='R', preview=preview, speech=skip_silence)
+        return (gr.HTML(waveform + audio_player(both_audio, 'B')), gr.HTML(audio_player(left_audio, 'L'), visible=True),
+                gr.HTML(audio_player(right_audio, 'R'), visible=True))
     else:
-        return gr.Audio(audio_file_path), gr.Audio(value=audio_file_path, visible=False), gr.update(value=None, visible=False)
+        return (gr.HTML(waveform + audio_player(both_audio, 'B')), gr.update(value=None, visible=False),
+                gr.update(value=None, visible=False))
 
 
 with gr.Blocks(title='Audio Transcription App',theme=gr.themes.Soft(), fill_width=False, head=shortcut_js) as demo:
@@ -558,7 +646,7 @@ with gr.Blocks(title='Audio Transcription App',theme=gr.themes.Soft(), fill_widt
             if 'data' in data and data['data']:
                 df = pd.DataFrame(data['data'])
                 filtered_df = df.drop(['start_year', 'start_month', 'start_day', 'start_hour', 'start_minute', 'start_second'], axis=1)
-                columns_titles = ['circuit', 'src', 'dst', 'file_name', 'duration', 'stt_transcript', 'gt_transcript', 'operator_remark', 'start_time', 'last_modified', 'bookmark', 'mplan', 'audio_file_path', 'stereo']
+                columns_titles = ['circuit', 'src', 'dst', 'file_name', 'duration', 'stt_transcript', 'gt_transcript', 'operator_remark', 'start_time', 'last_modified', 'bookmark', 'mplan', 'audio_file_path', 'stereo', 'duplicate_of']
                 reindex_df = filtered_df.reindex(columns=columns_titles)
                 if not reindex_df.empty:
                     first_row = reindex_df.iloc[[0]]
@@ -590,14 +678,7 @@ with gr.Blocks(title='Audio Transcription App',theme=gr.themes.Soft(), fill_widt
                 'stereo': row_df['stereo']
             } 
             transcription_data_dict = transcription_data.to_dict()
-            df = get_keyword(u, p)
-
-            if df.empty:
-                priority_one_list = []
-                priority_two_list = []
-            else:
-                priority_one_list = df.loc[df['priority_'] == 1, 'keyword'].tolist()
-                priority_two_list = df.loc[df['priority_'] == 2, 'keyword'].tolist()
+            keywords = keyword_cache.get(u, p)
 
             if transcription_data_dict['gt_transcript'] != "" and transcription_data_dict['gt_transcript'] is not None:
                 text = transcription_data_dict['gt_transcript']
@@ -640,16 +721,8 @@ with gr.Blocks(title='Audio Transcription App',theme=gr.themes.Soft(), fill_widt
                 left_edit_text_area_update = gr.update(visible=False)
                 right_edit_text_area_update = gr.update(visible=False)
 
-            # Prepare highlighted transcript (for keyword_transcript)
-            if df.empty:
-                priority_one_list = []
-                priority_two_list = []
-            else:
-                priority_one_list = df.loc[df['priority_'] == 1, 'keyword'].tolist()
-                priority_two_list = df.loc[df['priority_'] == 2, 'keyword'].tolist()
-
             # For the highlighted transcript, we need to process appropriately
-            transcript = str_to_keyword_transcript(text, priority_one_list, priority_two_list)
+            transcript = keywords.highlight(text)
 
             return transcript, edit_text_area_update, left_edit_text_area_update, right_edit_text_area_update, primary_key
 
@@ -678,16 +751,18 @@ with gr.Blocks(title='Audio Transcription App',theme=gr.themes.Soft(), fill_widt
         highlighted_text = [('Invalid data', None)]
     keyword_state = gr.State(value=highlighted_text)
 
-    audio_file = './audio/start.wav'
     sentence = [('Nothing Selected', 'Priority 1')]
 
     with gr.Row():
         with gr.Column(scale=20):
             with gr.Group(elem_id='audios', visible=False) as audios:
-                audio = gr.Audio(value=audio_file, editable=False, visible=True, elem_id='b_audio', label='B')
+                audio = gr.HTML(audio_player(None, 'B'), visible=True, elem_id='b_audio')
+                with gr.Row():
+                    audio_l = gr.HTML(audio_player(None, 'L'), visible=False, elem_id='left_audio')
+                    audio_r = gr.HTML(audio_player(None, 'R'), visible=False, elem_id='right_audio')
                 with gr.Row():
-                    audio_l = gr.Audio(value=audio_file, editable=False, visible=False, elem_id='left_audio', label='L')
-                    audio_r = gr.Audio(value=audio_file, editable=False, visible=False, elem_id='right_audio', label='R')
+                    preview_checkbox = gr.Checkbox(value=False, label='Compressed Preview', info='Load a low bitrate copy of the audio, for slow connections')
+                    skip_silence_checkbox = gr.Checkbox(value=False, label='Skip Silence', info='Play only the speech found by the VAD, back to back')
 
             with gr.Tabs() as tabs:
                 with gr.TabItem('Transcript Overview (Mixed)'):
@@ -751,6 +826,7 @@ with gr.Blocks(title='Audio Transcription App',theme=gr.themes.Soft(), fill_widt
                                 combine_adjacent=True,
                                 show_legend=True,
                                 color_map={"Priority 1": "red", "Priority 2": "purple"})
+                            snippet_audio = gr.HTML(visible=False)
                         
                         with gr.Column(scale=1):
                             keywords_text = gr.HighlightedText(
@@ -761,6 +837,7 @@ with gr.Blocks(title='Audio Transcription App',theme=gr.themes.Soft(), fill_widt
                                 color_map={"Priority 1": "red", "Priority 2": "purple"})
                     
                     submit_edit_button.click(fn=edit_transcript, inputs=[edit_text_area, left_edit_text_area, right_edit_text_area, row_selected, u, p], outputs=keyword_transcript_text)
+                    keyword_transcript_text.select(fn=play_transcript_line, inputs=[keyword_transcript, row_selected, u, p], outputs=snippet_audio)
                     full_df_state.select(fn=on_row_select, inputs=full_df_state, outputs=[data_gr_dataframe, current_index])
                     data_gr_dataframe.change(fn=on_change, inputs=[data_gr_dataframe, u, p], outputs=[keyword_transcript, edit_text_area, left_edit_text_area, right_edit_text_area, row_selected])
 
@@ -769,14 +846,11 @@ with gr.Blocks(title='Audio Transcription App',theme=gr.themes.Soft(), fill_widt
                     prev_button.click(fn=lambda df, idx: navigate(df, idx, 'prev'), inputs=[full_df_state, current_index], outputs=[data_gr_dataframe, current_index])
 
         def get_highlight_overview_text(df, u, p, use_mixed_transcript=False):
-            key_df = get_keyword(u, p)
+            keywords = keyword_cache.get(u, p)
             
-            if key_df.empty:
-                priority_one_list, priority_two_list = [], [] 
+            if keywords.empty:
                 return [('Nothing has been returned', None)]
             else:
-                priority_one_list = key_df.loc[key_df['priority_'] == 1, 'keyword'].tolist()
-                priority_two_list = key_df.loc[key_df['priority_'] == 2, 'keyword'].tolist()
                 try:
                     df = df.sort_values(by='start_time')
                 except:
@@ -802,14 +876,14 @@ with gr.Blocks(title='Audio Transcription App',theme=gr.themes.Soft(), fill_widt
                     transcript = None
                 
                 if transcript:
-                    highlighted_transcript = str_to_keyword_transcript(
-                        transcript, priority_one_list, priority_two_list
-                    )
+                    highlighted_transcript = keywords.highlight(transcript)
                     transcript_tuples.extend(highlighted_transcript)
 
-                if transcript_tuples[-1][0] != '\n':
+                # The highlighter merges a trailing newline into the last span of the transcript
+                tail = ''.join(text for text, _ in transcript_tuples[-2:])
+                if not tail.endswith('\n'):
                     transcript_tuples.extend([('\n', None), ('\n', None)])
-                elif transcript_tuples[-1][0] == '\n' and transcript_tuples[-2][0] != '\n':
+                elif not tail.endswith('\n\n'):
                     transcript_tuples.append(('\n', None))
 
             return transcript_tuples
@@ -819,7 +893,9 @@ with gr.Blocks(title='Audio Transcription App',theme=gr.themes.Soft(), fill_widt
         edit_transcript_text.change(fn=lambda x:x, inputs=edit_transcript_text, outputs=[edit_text_area, left_edit_text_area, right_edit_text_area])
 
         keyword_state.change(fn=lambda x:[gr.HighlightedText(value=x), gr.HighlightedText(value=x), gr.HighlightedText(value=x)], inputs=keyword_state, outputs=[keywords_text, keywords_text1, keywords_text2])
-        row_selected.change(fn=update_audio_files, inputs=row_selected, outputs=[audio, audio_l, audio_r])
+        row_selected.change(fn=update_audio_files, inputs=[row_selected, u, p, preview_checkbox, skip_silence_checkbox], outputs=[audio, audio_l, audio_r])
+        preview_checkbox.change(fn=update_audio_files, inputs=[row_selected, u, p, preview_checkbox, skip_silence_checkbox], outputs=[audio, audio_l, audio_r])
+        skip_silence_checkbox.change(fn=update_audio_files, inputs=[row_selected, u, p, preview_checkbox, skip_silence_checkbox], outputs=[audio, audio_l, audio_r])
 
         user_login.click(fn=auth, inputs=username_box, outputs=[audios, edit_tab])
         filter_button.click(fn=get_filter_data, inputs=[circuit_dropdown, operator_textbox, source_dropdown, dst_dropdown, start_time_textbox, end_time_textbox, filter_checkbox, mplan_checkbox, u, p], outputs=[data_gr_dataframe, full_df_state, current_index, keyword_transcript_text_overview,  keyword_transcript_text_overview_gt])
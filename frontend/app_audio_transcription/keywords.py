@@ -0,0 +1,162 @@
+import os
+import re
+import time
+import threading
+from itertools import accumulate
+
+# Seconds between checks of a user's keyword version, however many sessions of the user are open
+KEYWORD_CHECK_INTERVAL = float(os.getenv('KEYWORD_CHECK_INTERVAL', '5'))
+
+PRIORITY_LABELS = {1: 'Priority 1', 2: 'Priority 2'}
+WORD_PATTERN = re.compile(r'\w+')
+# Splits a text into separators at even indexes and words at odd ones
+WORD_SPLIT = re.compile(r'(\w+)')
+
+
+def normalize(keyword):
+    # The lowercase words of a keyword, punctuation and spacing do not matter
+    return tuple(WORD_PATTERN.findall(keyword.lower()))
+
+
+class KeywordMatcher:
+    """Finds keywords and keyword phrases in a text, in one pass over its words.
+
+    The keywords are compiled into a trie of their lowercase words. Only
+    words that start a keyword are looked at further, so the cost grows
+    with the text and not with the number of keywords. A phrase matches
+    its words separated by any spaces or punctuation on one line. Where
+    matches overlap, the one starting first wins, then the longest. A
+    keyword listed under several labels keeps the first one.
+    """
+
+    def __init__(self, keywords_by_label):
+        # {words: label}, the trie ends a keyword with a None key
+        self.labels = {}
+        self.trie = {}
+        for label, keywords in keywords_by_label.items():
+            for keyword in keywords:
+                words = normalize(keyword)
+                if not words or words in self.labels:
+                    continue
+                self.labels[words] = label
+                node = self.trie
+                for word in words:
+                    node = node.setdefault(word, {})
+                node[None] = True
+
+    def longest_match(self, parts, k):
+        # Index of the last word of the longest keyword starting at word k, or None
+        node = self.trie[parts[k]]
+        end = k if None in node else None
+        while k + 2 < len(parts) and '\n' not in parts[k + 1]:
+            node = node.get(parts[k + 2])
+            if node is None:
+                break
+            k += 2
+            if None in node:
+                end = k
+        return end
+
+    def highlight(self, text):
+        """[(text, label)] spans of the whole text for gr.HighlightedText, label None between keywords."""
+        lowered = text.lower()
+        if len(lowered) != len(text):
+            # The few characters whose lowercase is longer would shift the offsets
+            text = lowered
+        parts = WORD_SPLIT.split(lowered)
+        candidates = [k for k in range(1, len(parts), 2) if parts[k] in self.trie]
+        if not candidates:
+            return [(text, None)]
+
+        offsets = [0, *accumulate(map(len, parts))]
+        spans = []
+        done = 0
+        for k in candidates:
+            if k < done:
+                continue
+            end = self.longest_match(parts, k)
+            if end is None:
+                continue
+            if offsets[k] > offsets[done]:
+                spans.append((text[offsets[done]:offsets[k]], None))
+            spans.append((text[offsets[k]:offsets[end + 1]], self.labels[tuple(parts[k:end + 1:2])]))
+            done = end + 1
+        if offsets[done] < len(text):
+            spans.append((text[offsets[done]:], None))
+        return spans
+
+
+class KeywordSet:
+    """A user's keywords at one version, with lowercase lookup sets per priority."""
+
+    def __init__(self, rows, version=0):
+        self.rows = rows
+        self.version = version
+        words = {priority: set() for priority in PRIORITY_LABELS}
+        for row in rows:
+            if row['priority_'] in words:
+                words[row['priority_']].add(row['keyword'].lower())
+        self.priority_one = frozenset(words[1])
+        self.priority_two = frozenset(words[2])
+        # Compiled once per version, every transcript of the user is highlighted with it
+        self.matcher = KeywordMatcher({PRIORITY_LABELS[1]: self.priority_one, PRIORITY_LABELS[2]: self.priority_two})
+
+    @property
+    def empty(self):
+        return not self.rows
+
+    def highlight(self, text):
+        return self.matcher.highlight(text)
+
+    def keyword_list(self):
+        # The keyword list as shown next to the transcripts, priority 1 first
+        rows = sorted(self.rows, key=lambda row: row['priority_'])
+        return [(row['keyword'] + '\n', PRIORITY_LABELS.get(row['priority_'])) for row in rows]
+
+
+class KeywordCache:
+    """The keywords of every user of the app, shared by all callbacks and sessions.
+
+    get() never asks the API once a user's keywords are loaded. refresh()
+    asks for their version, at most every check_interval seconds per
+    user, and only loads the keywords again when it moved.
+    fetch_keywords(u, p) returns the /get_all_keywords/ JSON and
+    fetch_version(u, p) the /keywords/version/ one.
+    """
+
+    def __init__(self, fetch_keywords, fetch_version, check_interval=KEYWORD_CHECK_INTERVAL):
+        self.fetch_keywords = fetch_keywords
+        self.fetch_version = fetch_version
+        self.check_interval = check_interval
+        # (u, p): [KeywordSet, checked]
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def load(self, u, p):
+        keywords = self.fetch_keywords(u, p)
+        keyword_set = KeywordSet(keywords.get('data') or [], keywords.get('version', 0))
+        with self.lock:
+            self.entries[(u, p)] = [keyword_set, time.monotonic()]
+        return keyword_set
+
+    def get(self, u, p):
+        with self.lock:
+            entry = self.entries.get((u, p))
+        return entry[0] if entry else self.load(u, p)
+
+    def refresh(self, u, p):
+        with self.lock:
+            entry = self.entries.get((u, p))
+            if entry and time.monotonic() - entry[1] < self.check_interval:
+                return entry[0]
+            if entry:
+                # Other sessions of the user take the cached set until this check is done
+                entry[1] = time.monotonic()
+        if entry is None:
+            return self.load(u, p)
+        version = self.fetch_version(u, p).get('version')
+        return entry[0] if version == entry[0].version else self.load(u, p)
+
+    def invalidate(self, u, p):
+        with self.lock:
+            self.entries.pop((u, p), None)
@@ -1,5 +1,5 @@
 import gradio as gr
-import requests
+from api_client import api
 import pandas as pd
 import os
 import pytz
@@ -18,7 +18,7 @@ def login(request: gr.Request):
     return result_json.get('u', None), result_json.get('p', None)
 
 def get_dataset(u, p):
-    response = requests.get(f"{API_URL}/get_all_user_data/", params={"latest": 1, 'user': u, 'password': p})
+    response = api.get(f"{API_URL}/get_all_user_data/", params={"latest": 1, 'user': u, 'password': p})
     if response.status_code == 200:
         data = response.json()["data"]
         df = pd.DataFrame(data)
@@ -4,7 +4,7 @@ import os
 from datetime import datetime
 import zipfile
 import tempfile
-import requests
+from api_client import api
 
 API_URL = os.getenv('API_URL', 'http://localhost:8000')
 
@@ -31,7 +31,7 @@ def get_filtered_user_data(base_url, circuit=None, operator_remark_contains=None
         'user': u,
         'password': p
     }
-    response = requests.get(f"{base_url}/filter_user_data/", params=params)
+    response = api.get(f"{base_url}/filter_user_data/", params=params)
     return response.json()
 
 def get_unique_values(base_url, column=None, u=None, p=None):
@@ -40,7 +40,8 @@ def get_unique_values(base_url, column=None, u=None, p=None):
         'user': u,
         'password': p
     }
-    response = requests.get(f"{base_url}/unique_values/", params=params)
+    # Dropdown choices, a minute old at most
+    response = api.get(f"{base_url}/unique_values/", params=params, ttl=60)
     return response.json()
 
 def get_dropdown_values(u, p):
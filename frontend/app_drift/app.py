@@ -2,7 +2,7 @@ import gradio as gr
 import pandas as pd
 import os
 from datetime import datetime
-import requests
+from api_client import api
 
 from calculate_wer import process_pair, generate_summary_and_zip
 
@@ -31,7 +31,7 @@ def get_filtered_user_data(base_url, circuit=None, operator_remark_contains=None
         'user': u,
         'password': p
     }
-    response = requests.get(f"{base_url}/filter_user_data/", params=params)
+    response = api.get(f"{base_url}/filter_user_data/", params=params)
     return response.json()
 
 def get_unique_values(base_url, column=None, u=None, p=None):
@@ -40,7 +40,20 @@ def get_unique_values(base_url, column=None, u=None, p=None):
         'user': u,
         'password': p
     }
-    response = requests.get(f"{base_url}/unique_values/", params=params)
+    # Dropdown choices, a minute old at most
+    response = api.get(f"{base_url}/unique_values/", params=params, ttl=60)
+    return response.json()
+
+def get_wer_summary(base_url, circuit=None, start_time=None, end_time=None, group_by='circuit', u=None, p=None):
+    params = {
+        "circuit": circuit,
+        "start_time": start_time,
+        "end_time": end_time,
+        "group_by": group_by,
+        'user': u,
+        'password': p
+    }
+    response = api.get(f"{base_url}/wer_summary/", params=params)
     return response.json()
 
 def get_dropdown_values(u, p):
@@ -102,9 +115,34 @@ def evaluate_data(data_list):
     else:
         return [None for _ in range(5)]
 
+def get_summary(circuit, start_time, end_time, u, p):
+    if start_time:
+        start_time = datetime.strptime(start_time, "%Y-%m-%d %H:%M:%S")
+
+    if end_time:
+        end_time = datetime.strptime(end_time, "%Y-%m-%d %H:%M:%S")
+
+    circuit = None if circuit == 'empty' else circuit
+
+    # Stats are persisted per record/channel by the API, so this is an aggregate not a re-alignment
+    summary = get_wer_summary(base_url=API_URL,
+                              circuit=circuit,
+                              start_time=start_time,
+                              end_time=end_time,
+                              group_by='circuit,prefix',
+                              u=u,
+                              p=p)
+
+    columns = ['circuit', 'prefix', 'files', 'wer', 'hits', 'substitutions', 'insertions', 'deletions']
+    if 'data' in summary and summary['data']:
+        return pd.DataFrame(summary['data']).reindex(columns=columns)
+    else:
+        return pd.DataFrame(columns=columns)
+
 def load_data(circuit, start_time, end_time, u, p):
     data_list, display_df = get_data(circuit, start_time, end_time, u, p)
-    return data_list, display_df
+    summary_df = get_summary(circuit, start_time, end_time, u, p)
+    return data_list, display_df, summary_df
 
 with gr.Blocks(title='Drifting App', theme=gr.themes.Soft()) as demo:
     gr.Markdown('# Evaluate')
@@ -123,6 +161,7 @@ with gr.Blocks(title='Drifting App', theme=gr.themes.Soft()) as demo:
         refresh_button = gr.Button(value='Refresh Circuits', variant='huggingface')
 
     data_table = gr.Dataframe(label='User Data')
+    summary_table = gr.Dataframe(label='WER Summary')
 
     evaluate_button = gr.Button(value='Evaluate', variant='huggingface')
 
@@ -136,7 +175,7 @@ with gr.Blocks(title='Drifting App', theme=gr.themes.Soft()) as demo:
 
     demo.load(fn=login, outputs=[u, p]).then(refresh_dropdown, inputs=[u, p], outputs=circuit_dropdown)
 
-    load_data_button.click(fn=load_data, inputs=[circuit_dropdown, start_time_input, end_time_input, u, p], outputs=[data_state, data_table])
+    load_data_button.click(fn=load_data, inputs=[circuit_dropdown, start_time_input, end_time_input, u, p], outputs=[data_state, data_table, summary_table])
     refresh_button.click(fn=refresh_dropdown, inputs=[u, p], outputs=circuit_dropdown)
     evaluate_button.click(fn=evaluate_data, inputs=[data_state], outputs=[errors_file, word_errors_file, download_zip])
 
@@ -33,6 +33,28 @@ def split_transcript_by_prefix(transcript):
         transcripts[key] = ' '.join(transcripts[key])
     return transcripts
 
+def get_word_times(transcript):
+    # (start, end) of the line each word came from, in the same word order as
+    # split_transcript_by_prefix, so errors can be located in the audio
+    word_times = {'L': [], 'R': [], 'B': []}
+    for line in transcript.strip().split('\n'):
+        tokens = line.strip().split()
+        if not tokens:
+            continue
+        if tokens[0] in {'L', 'R', 'B'}:
+            prefix = tokens[0]
+            tokens = tokens[1:]
+        else:
+            prefix = 'B'
+
+        try:
+            times = (float(tokens[0]), float(tokens[1]))
+        except (IndexError, ValueError):
+            times = (None, None)
+        words = remove_punct(' '.join(tokens).lower()).split()[2:]
+        word_times[prefix].extend([times] * len(words))
+    return word_times
+
 def get_dtl(alignments, ref, hyp, correct, substitutions, deletions, insertions):
     for chunk in alignments:
         if chunk.type == "equal":
@@ -54,10 +76,16 @@ def get_dtl(alignments, ref, hyp, correct, substitutions, deletions, insertions)
                 dst = hyp[j]
                 insertions[dst] = insertions.get(dst, 0) + 1
 
-def get_alignments(wer_output, filename, prefix):
+def get_alignments(wer_output, filename, prefix, ref_times=None, hyp_times=None):
     ref_words = []
     hyp_words = []
     error_types = []
+    word_times = []
+
+    def time_at(times, idx):
+        if times and idx < len(times):
+            return times[idx]
+        return (None, None)
 
     for chunk in wer_output.alignments[0]:
         if chunk.type == "delete":
@@ -66,12 +94,14 @@ def get_alignments(wer_output, filename, prefix):
                 ref_words.append(src)
                 hyp_words.append("*" * len(src))
                 error_types.append(chunk.type)
+                word_times.append(time_at(ref_times, i))
         elif chunk.type == "insert":
             for i in range(chunk.hyp_start_idx, chunk.hyp_end_idx):
                 dst = wer_output.hypotheses[0][i]
                 ref_words.append("*" * len(dst))
                 hyp_words.append(dst)
                 error_types.append(chunk.type)
+                word_times.append(time_at(hyp_times, i))
         else:
             for i, j in zip(range(chunk.ref_start_idx, chunk.ref_end_idx),
                             range(chunk.hyp_start_idx, chunk.hyp_end_idx)):
@@ -81,6 +111,7 @@ def get_alignments(wer_output, filename, prefix):
                 ref_words.append(src.rjust(max_len))
                 hyp_words.append(dst.rjust(max_len))
                 error_types.append(chunk.type)
+                word_times.append(time_at(ref_times, i))
 
     errors = []
 
@@ -98,7 +129,9 @@ def get_alignments(wer_output, filename, prefix):
             " ".join(hyp_words[min_i:i]),
             hyp_words[i],
             " ".join(hyp_words[i+1:max_i]),
-            err
+            err,
+            word_times[i][0],
+            word_times[i][1]
         ))
 
     return errors
@@ -109,6 +142,8 @@ def process_pair(ref_transcript, hyp_transcript, filename):
 
     ref_segments = split_transcript_by_prefix(ref_transcript)
     hyp_segments = split_transcript_by_prefix(hyp_transcript)
+    ref_word_times = get_word_times(ref_transcript)
+    hyp_word_times = get_word_times(hyp_transcript)
 
     combined_results = {
         'filename': filename,
@@ -147,7 +182,7 @@ def process_pair(ref_transcript, hyp_transcript, filename):
             insertions
         )
 
-        errors = get_alignments(wer_output, filename, prefix)
+        errors = get_alignments(wer_output, filename, prefix, ref_word_times[prefix], hyp_word_times[prefix])
 
         alignment = jiwer.visualize_alignment(wer_output)
         wer = wer_output.wer
@@ -235,7 +270,7 @@ def generate_summary_and_zip(results):
 
     errors_df = pd.DataFrame(
         errors,
-        columns=["filename", "prefix", "ref_prev", "ref", "ref_post", "hyp_prev", "hyp", "hyp_post", "type"]
+        columns=["filename", "prefix", "ref_prev", "ref", "ref_post", "hyp_prev", "hyp", "hyp_post", "type", "start", "end"]
     )
     errors_csv_path = os.path.join(output_dir, "errors_context.csv")
     errors_df.to_csv(errors_csv_path, index=False)
@@ -2,7 +2,9 @@ import dash_bootstrap_components as dbc
 import plotly.graph_objects as go
 import base64
 import io
+import os
 import pandas as pd
+from urllib.parse import parse_qs, urlencode
 
 from dash import Dash, html, Input, Output, State
 from dash_extensions.callback import CallbackCache
@@ -11,6 +13,10 @@ from functools import reduce
 from template import get_layout
 from plot_functions import get_piechart_lists, get_sankey_lists
 
+# Browser-facing API address, error snippets are played straight from it
+AUDIO_URL = os.getenv('AUDIO_URL', 'http://localhost:8000')
+SNIPPET_MARGIN = 1.0
+
 # Initialize app
 app = Dash(__name__)
 cc = CallbackCache()
@@ -506,16 +512,34 @@ def display_figure(df_data, selected_rows: pd.Index):
     )])
     return fig
 
+def get_snippet_url(row, credentials):
+    # Older errors_context.csv files have no timestamps
+    if 'start' not in row or pd.isna(row['start']) or pd.isna(row['end']):
+        return None
+    if 'u' not in credentials or 'p' not in credentials:
+        return None
+    params = {
+        'file_name': row['filename'],
+        'start': row['start'],
+        'end': row['end'],
+        'margin': SNIPPET_MARGIN,
+        'channel': row.get('prefix', 'B'),
+        'user': credentials['u'],
+        'password': credentials['p']
+    }
+    return f"{AUDIO_URL}/audio/snippet/?{urlencode(params)}"
+
 @cc.callback(
     Output("alignments", "children"),
     [
         Input("errors_df", "data"),
         Input("selected_category", "value"),
         Input("source_word", "value"),
-        Input("target_word", "value")
+        Input("target_word", "value"),
+        State("url", "search")
     ]
 )
-def update_alignments(errors_df_data, selected_category, source_word, target_word):
+def update_alignments(errors_df_data, selected_category, source_word, target_word, search):
     if errors_df_data is None:
         return ""
     errors_df = pd.read_json(io.StringIO(errors_df_data), orient='split')
@@ -529,8 +553,12 @@ def update_alignments(errors_df_data, selected_category, source_word, target_wor
                 data = data[data["ref"].str.strip() == source_word]
             if target_word != "" and (selected_category == "Insertions" or selected_category == "Substitutions"):
                 data = data[data["hyp"].str.strip() == target_word]
+            credentials = {key: values[0] for key, values in parse_qs((search or '').lstrip('?')).items()}
             for _, row in data.iterrows():
                 text.append(html.P(row['filename']))
+                snippet_url = get_snippet_url(row, credentials)
+                if snippet_url:
+                    text.append(html.Audio(src=snippet_url, controls=True, preload="none"))
                 text.append(html.P([
                     f"GT:  {row['ref_prev']} ",
                     html.Span(row['ref'], style={"color": "green"}),
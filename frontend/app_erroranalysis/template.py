@@ -174,6 +174,7 @@ def get_layout() -> html.Div:
             )
         ]),
 
+        dcc.Location(id="url"),
         dcc.Store("df", data=None),
         dcc.Store("errors_df", data=None),
         dcc.Store("selected_index", data=None),
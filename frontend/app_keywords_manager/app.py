@@ -1,5 +1,5 @@
 import gradio as gr
-import requests
+from api_client import api
 import pandas as pd
 import os
 
@@ -18,7 +18,7 @@ def login(request: gr.Request):
 
 def get_keywords(u, p):
     url = f'{API_URL}/get_all_keywords/'
-    response = requests.get(url, params={"user": u, "password": p})
+    response = api.get(url, params={"user": u, "password": p})
     if response.status_code == 200:
         data = response.json().get('data', [])
         df = pd.DataFrame(data)
@@ -38,7 +38,7 @@ def add_keyword(keyword, priority_, service_, u, p):
     }
 
     print(data)
-    response = requests.post(url, json=data, params={"user": u, "password": p})
+    response = api.post(url, json=data, params={"user": u, "password": p})
     if response.status_code == 200:
         return "Keyword added successfully."
     else:
@@ -54,7 +54,7 @@ def delete_keyword(keyword, priority_, service_, u, p):
         "password": p,
         "created_by": u
     }
-    response = requests.delete(url, params=params)
+    response = api.delete(url, params=params)
     if response.status_code == 200:
         return "Keyword deleted successfully."
     else:
@@ -1,6 +1,6 @@
 import gradio as gr
 import os
-import requests
+from api_client import api
 
 IP_ADDRESS = os.getenv('IP_ADDRESS', 'http://127.0.0.1')
 AUDIO_TRANSCRIPTION_PORT = os.getenv('AUDIO_TRANSCRIPTION_PORT', '7681')
@@ -15,7 +15,7 @@ API_URL = os.getenv('API_URL', 'http://localhost:8000')
 
 def login(username, password):
     try:
-        response = requests.post(f"{API_URL}/login_user/", json={"username": username, "password": password})
+        response = api.post(f"{API_URL}/login_user/", json={"username": username, "password": password})
         if response.status_code == 200:
             return True, [username, password], "Login successful."
         else: